@@ -1,4 +1,4 @@
-import io
+import tempfile
 import zipfile
 from datetime import date
 
@@ -7,10 +7,11 @@ from django.contrib.admin import helpers
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
 from django.db import transaction
+from django.db.models import Sum
 from django.forms.models import modelformset_factory
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect
 from django.shortcuts import render, redirect
-from django.utils import translation, timezone
+from django.utils import translation
 from django.utils.safestring import mark_safe
 from django.utils.translation import ungettext, ugettext_lazy as _
 
@@ -18,10 +19,12 @@ from orchestra.admin.decorators import action_with_confirmation
 from orchestra.admin.forms import AdminFormSet
 from orchestra.admin.utils import get_object_from_url, change_url
 
-from . import settings
+from . import reports, settings
+from .batch import BillBatch
 from .forms import SelectSourceForm
 from .helpers import validate_contact, set_context_emails
 from .models import Bill, BillLine
+from .pdf import get_pdfs
 
 
 def view_bill(modeladmin, request, queryset):
@@ -49,12 +52,10 @@ def close_bills(modeladmin, request, queryset, action='close_bills'):
     if request.POST.get('post') == 'generic_confirmation':
         formset = SelectSourceFormSet(request.POST, request.FILES, queryset=queryset)
         if formset.is_valid():
-            transactions = []
-            for form in formset.forms:
-                source = form.cleaned_data['source']
-                transaction = form.instance.close(payment=source)
-                if transaction:
-                    transactions.append(transaction)
+            payments = {
+                form.instance.pk: form.cleaned_data['source'] for form in formset.forms
+            }
+            transactions = BillBatch(queryset).close(payments=payments)
             for bill in queryset:
                 modeladmin.log_change(request, bill, 'Closed')
             messages.success(request, _("Selected bills have been closed"))
@@ -107,8 +108,8 @@ def send_bills_action(modeladmin, request, queryset):
         if not validate_contact(request, bill):
             return False
     num = 0
-    for bill in queryset:
-        bill.send()
+    for bill, pdf in get_pdfs(queryset):
+        bill.send(pdf=pdf)
         modeladmin.log_change(request, bill, 'Sent')
         num += 1
     messages.success(request, ungettext(
@@ -129,13 +130,14 @@ def download_bills(modeladmin, request, queryset):
         if not validate_contact(request, bill):
             return False
     if len(queryset) > 1:
-        bytesio = io.BytesIO()
-        archive = zipfile.ZipFile(bytesio, 'w')
-        for bill in queryset:
-            pdf = bill.as_pdf()
+        # PDFs are written to the archive as soon as they are rendered
+        archive_file = tempfile.TemporaryFile()
+        archive = zipfile.ZipFile(archive_file, 'w')
+        for bill, pdf in get_pdfs(queryset):
             archive.writestr('%s.pdf' % bill.number, pdf)
         archive.close()
-        response = HttpResponse(bytesio.getvalue(), content_type='application/pdf')
+        archive_file.seek(0)
+        response = FileResponse(archive_file, content_type='application/pdf')
         response['Content-Disposition'] = 'attachment; filename="orchestra-bills.zip"'
         return response
     bill = queryset[0]
@@ -237,9 +239,12 @@ def move_lines(modeladmin, request, queryset, action=None):
         return render(request, 'admin/orchestra/generic_confirmation.html', context)
     target = Bill.objects.get(pk=int(pk))
     if request.POST.get('post') == 'generic_confirmation':
+        sources = set()
         for line in queryset:
+            sources.add(line.bill_id)
             line.bill = target
             line.save(update_fields=['bill'])
+        Bill.objects.filter(pk__in=sources).update_totals()
         # TODO bill history update
         messages.success(request, _("Lines moved"))
     # Final confirmation
@@ -309,64 +314,25 @@ amend_bills.url_name = 'amend'
 
 
 def bill_report(modeladmin, request, queryset):
-    subtotals = {}
-    total = 0
-    for bill in queryset:
-        for tax, subtotal in bill.compute_subtotals().items():
-            try:
-                subtotals[tax][0] += subtotal[0]
-            except KeyError:
-                subtotals[tax] = subtotal
-            else:
-                subtotals[tax][1] += subtotal[1]
-        total += bill.compute_total()
+    bill_ids = queryset.values_list('id', flat=True)
+    bills = Bill.objects.filter(id__in=bill_ids)
     context = {
-        'subtotals': subtotals,
-        'total': total,
-        'bills': queryset,
+        'subtotals': reports.tax_report(BillLine.objects.filter(bill_id__in=bill_ids)),
+        'total': bills.aggregate(Sum('total'))['total__sum'] or 0,
+        'bills': bills.select_related('account__billcontact').defer('html'),
         'currency': settings.BILLS_CURRENCY,
     }
     return render(request, 'admin/bills/bill/report.html', context)
 
 
 def service_report(modeladmin, request, queryset):
-    services = {}
-    totals = [0, 0, 0, 0, 0]
-    now = timezone.now().date()
     if queryset.model == Bill:
         queryset = BillLine.objects.filter(bill_id__in=queryset.values_list('id', flat=True))
     # Filter amends
     queryset = queryset.filter(bill__amend_of__isnull=True)
-    for line in queryset.select_related('order__service').prefetch_related('sublines'):
-        order, service = None, None
-        if line.order_id:
-            order = line.order
-            service = order.service
-            name = service.description
-            active, cancelled = (1, 0) if not order.cancelled_on or order.cancelled_on > now else (0, 1)
-            nominal_price = order.service.nominal_price
-        else:
-            name = '*%s' % line.description
-            active = 1
-            cancelled = 0
-            nominal_price = 0
-        try:
-            info = services[name]
-        except KeyError:
-            info = [active, cancelled, nominal_price, line.quantity or 1, line.compute_total()]
-            services[name] = info
-        else:
-            info[0] += active
-            info[1] += cancelled
-            info[3] += line.quantity or 1
-            info[4] += line.compute_total()
-        totals[0] += active
-        totals[1] += cancelled
-        totals[2] += nominal_price
-        totals[3] += line.quantity or 1
-        totals[4] += line.compute_total()
+    services, totals = reports.service_report(queryset)
     context = {
-        'services': sorted(services.items(), key=lambda n: -n[1][4]),
+        'services': services,
         'totals': totals,
     }
     return render(request, 'admin/bills/billline/report.html', context)
@@ -1,3 +1,5 @@
+from datetime import date
+
 from django import forms
 from django.conf.urls import url
 from django.contrib import admin, messages
@@ -9,7 +11,7 @@ from django.db.models.functions import Coalesce
 from django.templatetags.static import static
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
-from django.shortcuts import redirect
+from django.shortcuts import redirect, render
 
 from orchestra.admin import ExtendedModelAdmin
 from orchestra.admin.utils import admin_date, insertattr, admin_link, change_url
@@ -17,7 +19,7 @@ from orchestra.contrib.accounts.actions import list_accounts
 from orchestra.contrib.accounts.admin import AccountAdminMixin, AccountAdmin
 from orchestra.forms.widgets import paddingCheckboxSelectMultiple
 
-from . import settings, actions
+from . import settings, actions, reports
 from .filters import (BillTypeListFilter, HasBillContactListFilter, TotalListFilter,
     PaymentStateListFilter, AmendedListFilter)
 from .models import (Bill, Invoice, AmendmentInvoice, Fee, AmendmentFee, ProForma, BillLine,
@@ -250,10 +252,10 @@ class BillAdminMixin(AccountAdminMixin):
                 subtotals.append(_("Subtotal %s%% VAT   %s &%s;") % (tax, subtotal[0], currency))
                 subtotals.append(_("Taxes %s%% VAT   %s &%s;") % (tax, subtotal[1], currency))
             subtotals = '\n'.join(subtotals)
-            return '<span title="%s">%s &%s;</span>' % (subtotals, bill.compute_total(), currency)
+            return '<span title="%s">%s &%s;</span>' % (subtotals, bill.total, currency)
     display_total_with_subtotals.allow_tags = True
     display_total_with_subtotals.short_description = _("total")
-    display_total_with_subtotals.admin_order_field = 'approx_total'
+    display_total_with_subtotals.admin_order_field = 'total'
 
     def display_payment_state(self, bill):
         if bill.pk:
@@ -281,13 +283,7 @@ class BillAdminMixin(AccountAdminMixin):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        qs = qs.annotate(
-            models.Count('lines'),
-            # FIXME https://code.djangoproject.com/ticket/10060
-            approx_total=Coalesce(Sum(
-                (F('lines__subtotal') + Coalesce('lines__sublines__total', 0)) * (1+F('lines__tax')/100),
-            ), 0),
-        )
+        qs = qs.annotate(models.Count('lines'))
         qs = qs.prefetch_related(
             Prefetch('amends', queryset=Bill.objects.filter(is_open=False), to_attr='closed_amends')
         )
@@ -376,10 +372,10 @@ class BillAdmin(BillAdminMixin, ExtendedModelAdmin):
     
     def display_total(self, bill):
         currency = settings.BILLS_CURRENCY.lower()
-        return '%s &%s;' % (bill.compute_total(), currency)
+        return '%s &%s;' % (bill.total, currency)
     display_total.allow_tags = True
     display_total.short_description = _("total")
-    display_total.admin_order_field = 'approx_total'
+    display_total.admin_order_field = 'total'
     
     def type_link(self, bill):
         bill_type = bill.type.lower()
@@ -397,9 +393,22 @@ class BillAdmin(BillAdminMixin, ExtendedModelAdmin):
             url("^manage-lines/$",
                 admin_site.admin_view(BillLineManagerAdmin(BillLine, admin_site).changelist_view),
                 name='bills_bill_manage_lines'),
+            url("^report/(?P<year>\d{4})/$",
+                admin_site.admin_view(self.report_view),
+                name='bills_bill_report'),
         ]
         return extra_urls + urls
     
+    def report_view(self, request, year):
+        """ Yearly service report of closed bills, served from the daily rollup """
+        year = int(year)
+        services, totals = reports.rollup_report(date(year, 1, 1), date(year, 12, 31))
+        context = {
+            'services': services,
+            'totals': totals,
+        }
+        return render(request, 'admin/bills/billline/report.html', context)
+    
     def get_readonly_fields(self, request, obj=None):
         fields = super().get_readonly_fields(request, obj)
         if obj and not obj.is_open:
@@ -10,3 +10,4 @@ class BillsConfig(AppConfig):
     def ready(self):
         from .models import Bill
         accounts.register(Bill, icon='invoice.png')
+        from . import signals
@@ -0,0 +1,106 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import transaction
+from django.db.models import Prefetch
+from django.template import loader
+
+from orchestra.contrib.accounts.models import Account
+
+from .models import Bill
+
+
+class BillBatch(object):
+    """
+    Renders or closes many bills at once
+    
+    Lines, sublines, buyer contacts and payment sources are fetched in bulk, the seller
+    and the templates are loaded once and the HTML is rendered on a pool of threads.
+    The render time of each bill is kept on timings as (bill, template_name, seconds).
+    """
+    def __init__(self, queryset, workers=None):
+        self.workers = workers
+        self.bills = list(self.prefetch(queryset))
+        self.seller = Account.objects.get_main().billcontact
+        self.templates = {}
+        self.timings = []
+    
+    def prefetch(self, queryset):
+        source_model = Account._meta.get_field('paymentsources').related_model
+        sources = source_model.objects.filter(is_active=True).order_by('pk')
+        return queryset.select_related('account__billcontact').prefetch_related(
+            'lines__sublines',
+            Prefetch('account__paymentsources', queryset=sources, to_attr='active_paymentsources'),
+        )
+    
+    def get_payment(self, bill, payments):
+        """ payment source provided on payments {bill.pk: source} or account default """
+        try:
+            return payments[bill.pk]
+        except KeyError:
+            sources = bill.account.active_paymentsources
+            return sources[0] if sources else None
+    
+    def get_template(self, bill):
+        template_name = bill.get_template_name()
+        try:
+            template = self.templates[template_name]
+        except KeyError:
+            template = loader.get_template(template_name)
+            self.templates[template_name] = template
+        return template_name, template
+    
+    def render_bill(self, bill, payment):
+        template_name, template = self.get_template(bill)
+        start = time.time()
+        html = bill.render(payment=payment, template=template)
+        return html, (bill, template_name, time.time()-start)
+    
+    def render(self, payments=None):
+        """ sets bill.html of all bills, returns their timings """
+        payments = payments or {}
+        arguments = []
+        for bill in self.bills:
+            # Everything that queries the database is done before dispatching to the pool
+            bill.seller = self.seller
+            bill.compute_total()
+            bill.compute_subtotals()
+            self.get_template(bill)
+            arguments.append((bill, self.get_payment(bill, payments)))
+        with ThreadPoolExecutor(max_workers=self.workers or os.cpu_count()) as executor:
+            results = list(executor.map(lambda args: self.render_bill(*args), arguments))
+        timings = []
+        for bill, (html, timing) in zip(self.bills, results):
+            bill.html = html
+            timings.append(timing)
+        self.timings += timings
+        return timings
+    
+    @transaction.atomic
+    def close(self, payments=None):
+        """ closes all bills with gapless numbers, returns the created transactions """
+        payments = payments or {}
+        for bill in self.bills:
+            if not bill.is_open:
+                raise TypeError("Bill %s not in Open state." % bill.number)
+        numbers = Bill.objects.allocate_numbers(self.bills, is_open=False)
+        transactions = []
+        for bill, number in zip(self.bills, numbers):
+            payment = self.get_payment(bill, payments)
+            payments[bill.pk] = payment
+            bill_transaction = bill.close(payment=payment, number=number, commit=False)
+            if bill_transaction:
+                transactions.append(bill_transaction)
+        self.render(payments)
+        for bill in self.bills:
+            bill.save()
+        return transactions
+    
+    def get_template_timings(self):
+        """ {template_name: (bills, seconds)} """
+        result = {}
+        for bill, template_name, seconds in self.timings:
+            count, total = result.get(template_name, (0, 0))
+            result[template_name] = (count+1, total+seconds)
+        return result
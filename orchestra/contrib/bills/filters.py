@@ -1,6 +1,5 @@
 from django.contrib.admin import SimpleListFilter
 from django.core.urlresolvers import reverse
-from django.db.models import Q
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 
@@ -56,13 +55,13 @@ class TotalListFilter(SimpleListFilter):
     
     def queryset(self, request, queryset):
         if self.value() == 'gt':
-            return queryset.filter(approx_total__gt=0)
+            return queryset.filter(total__gt=0)
         elif self.value() == 'eq':
-            return queryset.filter(approx_total=0)
+            return queryset.filter(total=0)
         elif self.value() == 'lt':
-            return queryset.filter(approx_total__lt=0)
+            return queryset.filter(total__lt=0)
         elif self.value() == 'ne':
-            return queryset.exclude(approx_total=0)
+            return queryset.exclude(total=0)
         return queryset
 
 
@@ -97,41 +96,15 @@ class PaymentStateListFilter(SimpleListFilter):
         )
     
     def queryset(self, request, queryset):
-        # FIXME use queryset.computed_total instead of approx_total, bills.admin.BillAdmin.get_queryset
-        Transaction = queryset.model.transactions.field.remote_field.related_model
         if self.value() == 'OPEN':
-            return queryset.filter(Q(is_open=True)|Q(type=queryset.model.PROFORMA))
+            return queryset.filter(payment_state=Bill.OPEN)
         elif self.value() == 'PAID':
-            zeros = queryset.filter(approx_total=0, approx_total__isnull=True)
-            zeros = zeros.values_list('id', flat=True)
-            amounts = Transaction.objects.exclude(bill_id__in=zeros).secured().group_by('bill_id')
-            paid = []
-            relevant = queryset.exclude(approx_total=0, approx_total__isnull=True, is_open=True)
-            for bill_id, total in relevant.values_list('id', 'approx_total'):
-                try:
-                    amount = sum([t.amount for t in amounts[bill_id]])
-                except KeyError:
-                    pass
-                else:
-                    if abs(total) <= abs(amount):
-                        paid.append(bill_id)
-            return queryset.filter(
-                Q(approx_total=0) |
-                Q(approx_total__isnull=True) |
-                Q(id__in=paid)
-            ).exclude(is_open=True)
+            return queryset.filter(payment_state=Bill.PAID)
         elif self.value() == 'PENDING':
-            has_transaction = queryset.exclude(transactions__isnull=True)
-            non_rejected = has_transaction.exclude(transactions__state=Transaction.REJECTED)
-            paid = non_rejected.exclude(transactions__state=Transaction.SECURED)
-            paid = paid.values_list('id', flat=True).distinct()
-            return queryset.filter(pk__in=paid)
+            return queryset.filter(payment_state__in=(
+                Bill.CREATED, Bill.PROCESSED, Bill.EXECUTED, Bill.INCOMPLETE))
         elif self.value() == 'BAD_DEBT':
-            closed = queryset.filter(is_open=False).exclude(approx_total=0)
-            return closed.filter(
-                Q(transactions__state=Transaction.REJECTED) |
-                Q(transactions__isnull=True)
-            )
+            return queryset.filter(payment_state=Bill.BAD_DEBT)
 
 
 class AmendedListFilter(SimpleListFilter):
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from ...models import Bill
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the stored total, base, tax and payment state of bills.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', dest='verify', default=False,
+            help='Only report out of date values, nothing is changed.')
+        parser.add_argument('--batch-size', type=int, dest='batch_size', default=500,
+            help='Number of bills loaded at once.')
+        parser.add_argument('ids', nargs='*', type=int,
+            help='Bill ids, all bills by default.')
+    
+    def handle(self, *args, **options):
+        bills = Bill.objects.all()
+        if options['ids']:
+            bills = bills.filter(pk__in=options['ids'])
+        if options['verify']:
+            num = 0
+            for bill, field, stored, computed in bills.verify_totals(options['batch_size']):
+                self.stdout.write("%s %s: stored %s, computed %s" % (bill.number, field, stored, computed))
+                num += 1
+            self.stdout.write("%i out of date values." % num)
+        else:
+            num = bills.update_totals(options['batch_size'])
+            self.stdout.write("%i bills have been updated." % num)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bills', '0007_billnumber'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='base',
+            field=models.DecimalField(default=0, editable=False, max_digits=12, decimal_places=2, verbose_name='base'),
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='tax',
+            field=models.DecimalField(default=0, editable=False, max_digits=12, decimal_places=2, verbose_name='tax'),
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='total',
+            field=models.DecimalField(default=0, editable=False, max_digits=12, decimal_places=2, verbose_name='total'),
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='payment_state',
+            field=models.CharField(choices=[('', 'Open'), ('CREATED', 'Created'), ('PROCESSED', 'Processed'), ('AMENDED', 'Amended'), ('PAID', 'Paid'), ('INCOMPLETE', 'Incomplete'), ('EXECUTED', 'Executed'), ('BAD_DEBT', 'Bad debt')], default='', blank=True, editable=False, db_index=True, max_length=16, verbose_name='payment state'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bills', '0008_bill_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, verbose_name='date')),
+                ('name', models.CharField(max_length=256, verbose_name='name')),
+                ('tax', models.DecimalField(max_digits=4, decimal_places=2, verbose_name='tax')),
+                ('lines', models.PositiveIntegerField(verbose_name='lines')),
+                ('active', models.PositiveIntegerField(verbose_name='active')),
+                ('cancelled', models.PositiveIntegerField(verbose_name='cancelled')),
+                ('nominal_price', models.DecimalField(max_digits=12, decimal_places=2, verbose_name='nominal price')),
+                ('nominal_total', models.DecimalField(max_digits=14, decimal_places=2, verbose_name='nominal total')),
+                ('quantity', models.DecimalField(max_digits=14, decimal_places=2, verbose_name='quantity')),
+                ('total', models.DecimalField(max_digits=14, decimal_places=2, verbose_name='total')),
+            ],
+        ),
+    ]
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Sum
+
+
+def get_payment_state(bill, total, transactions):
+    """ Bill.compute_payment_state() of the time this migration was written """
+    if bill.is_open or bill.type == 'PROFORMA':
+        return ''
+    secured = 0
+    pending = 0
+    created = processed = executed = False
+    for state, amount in transactions:
+        if state == 'SECURED':
+            secured += amount
+            pending += amount
+        elif state == 'WAITTING_PROCESSING':
+            pending += amount
+            created = True
+        elif state == 'WAITTING_EXECUTION':
+            pending += amount
+            processed = True
+        elif state == 'EXECUTED':
+            pending += amount
+            executed = True
+    ongoing = bool(secured != 0 or created or processed or executed)
+    if total >= 0:
+        if secured >= total:
+            return 'PAID'
+        elif ongoing and pending < total:
+            return 'INCOMPLETE'
+    else:
+        if secured <= total:
+            return 'PAID'
+        elif ongoing and pending > total:
+            return 'INCOMPLETE'
+    if created:
+        return 'CREATED'
+    elif processed:
+        return 'PROCESSED'
+    elif executed:
+        return 'EXECUTED'
+    return 'BAD_DEBT'
+
+
+def update_totals(apps, schema_editor, batch_size=500):
+    """ same values as Bill.objects.update_totals(), computed with the historical models """
+    Bill = apps.get_model('bills', 'Bill')
+    BillLine = apps.get_model('bills', 'BillLine')
+    BillSubline = apps.get_model('bills', 'BillSubline')
+    Transaction = apps.get_model('payments', 'Transaction')
+    queryset = Bill.objects.order_by('pk').only('id', 'type', 'is_open', 'base', 'tax', 'total',
+        'payment_state')
+    last = 0
+    while True:
+        bills = list(queryset.filter(pk__gt=last)[:batch_size])
+        if not bills:
+            break
+        last = bills[-1].pk
+        sublines = BillSubline.objects.filter(line__bill__in=bills).order_by()
+        sublines = dict(sublines.values_list('line_id').annotate(Sum('total')))
+        lines = {}
+        for line_id, bill_id, subtotal, tax in BillLine.objects.filter(bill__in=bills).values_list(
+                'id', 'bill_id', 'subtotal', 'tax'):
+            line_total = round((subtotal or 0) + (sublines.get(line_id) or 0), 2)
+            lines.setdefault(bill_id, []).append((line_total, tax))
+        transactions = {}
+        for bill_id, state, amount in Transaction.objects.filter(bill__in=bills).values_list(
+                'bill_id', 'state', 'amount'):
+            transactions.setdefault(bill_id, []).append((state, amount))
+        for bill in bills:
+            bill_lines = lines.get(bill.pk, [])
+            base = round(sum(amount for amount, rate in bill_lines), 2)
+            tax = round(sum(amount*rate/100 for amount, rate in bill_lines), 2)
+            total = round(sum(amount*(1+rate/100) for amount, rate in bill_lines), 2)
+            payment_state = get_payment_state(bill, total, transactions.get(bill.pk, []))
+            values = (base, tax, total, payment_state)
+            if values != (bill.base, bill.tax, bill.total, bill.payment_state):
+                Bill.objects.filter(pk=bill.pk).update(base=base, tax=tax, total=total,
+                    payment_state=payment_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bills', '0009_billrollup'),
+        ('payments', '0002_auto_20150709_1018'),
+    ]
+
+    operations = [
+        migrations.RunPython(update_totals, migrations.RunPython.noop),
+    ]
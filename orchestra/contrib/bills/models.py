@@ -1,14 +1,14 @@
+import binascii
 import datetime
 from dateutil.relativedelta import relativedelta
 
 from django.core.urlresolvers import reverse
 from django.core.validators import ValidationError, RegexValidator
-from django.db import models
+from django.db import IntegrityError, ProgrammingError, connections, models, transaction
 from django.db.models import F, Sum
 from django.db.models.functions import Coalesce
 from django.template import loader, Context
 from django.utils import timezone, translation
-from django.utils.encoding import force_text
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 
@@ -16,10 +16,11 @@ from orchestra.admin.utils import change_url
 from orchestra.contrib.accounts.models import Account
 from orchestra.contrib.contacts.models import Contact
 from orchestra.core import validators
+from orchestra.models.utils import bulk_update
 from orchestra.utils.functional import cached
-from orchestra.utils.html import html_to_pdf
 
 from . import settings
+from .pdf import get_pdf
 
 
 class BillContact(models.Model):
@@ -52,13 +53,148 @@ class BillContact(models.Model):
         })
 
 
-class BillManager(models.Manager):
+class BillNumberManager(models.Manager):
+    def get_last_used(self, prefix, year):
+        """ last number already used by a bill, only needed the first time """
+        bills = Bill.objects.filter(number__regex=r'^%s%s[0-9]+' % (prefix, year))
+        last_number = bills.order_by('-number').values_list('number', flat=True).first()
+        if last_number is None:
+            return 0
+        return int(last_number[len(prefix)+4:])
+    
+    def allocate(self, prefix, year, count=1, is_open=False):
+        """
+        Reserves count numbers and returns them.
+        Closed bill numbers are consecutive, the counter row stays locked until the current
+        transaction ends, so numbers are gapless as long as they are allocated within the
+        transaction that uses them. Open bill numbers may have gaps and never wait for other
+        transactions on PostgreSQL.
+        """
+        if is_open and connections[self.db].vendor == 'postgresql':
+            return self.allocate_sequence(prefix, year, count)
+        with transaction.atomic():
+            try:
+                counter = self.select_for_update().get(prefix=prefix, year=year)
+            except self.model.DoesNotExist:
+                last = self.get_last_used(prefix, year)
+                try:
+                    with transaction.atomic():
+                        counter = self.create(prefix=prefix, year=year, last=last)
+                except IntegrityError:
+                    # Created by a concurrent transaction
+                    counter = self.select_for_update().get(prefix=prefix, year=year)
+            first = counter.last + 1
+            counter.last += count
+            counter.save(update_fields=('last',))
+        return list(range(first, first+count))
+    
+    def allocate_sequence(self, prefix, year, count):
+        """
+        numbers from a sequence per prefix and year, nextval() is not transactional.
+        Only the transaction creating the sequence, once a year, blocks concurrent ones.
+        """
+        connection = connections[self.db]
+        name = 'bills_number_%s_%i' % (binascii.hexlify(prefix.encode()).decode(), year)
+        nextval = "SELECT nextval('%s') FROM generate_series(1, %%s)" % name
+        with connection.cursor() as cursor:
+            try:
+                with transaction.atomic(using=self.db):
+                    cursor.execute(nextval, [count])
+                    return [row[0] for row in cursor.fetchall()]
+            except ProgrammingError:
+                # First allocation of the year
+                pass
+            # Continues the counter used before sequences
+            counter = self.filter(prefix=prefix, year=year).values_list('last', flat=True).first()
+            last = max(counter or 0, self.get_last_used(prefix, year))
+            try:
+                with transaction.atomic(using=self.db):
+                    cursor.execute('CREATE SEQUENCE %s START %i' % (name, last+1))
+            except (IntegrityError, ProgrammingError):
+                # Created by a concurrent transaction
+                pass
+            cursor.execute(nextval, [count])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class BillNumber(models.Model):
+    """ Last number handed out for each bill number prefix and year """
+    prefix = models.CharField(_("prefix"), max_length=16)
+    year = models.PositiveIntegerField(_("year"))
+    last = models.PositiveIntegerField(_("last"), default=0)
+    
+    objects = BillNumberManager()
+    
+    class Meta:
+        unique_together = ('prefix', 'year')
+    
+    def __str__(self):
+        return "%s%i" % (self.prefix, self.year)
+
+
+class BillQuerySet(models.QuerySet):
+    TOTAL_FIELDS = ('base', 'tax', 'total', 'payment_state')
+    
+    def recompute_totals(self, batch_size=500):
+        """ yields (bill, stored values) with the materialized totals of bill recomputed """
+        queryset = self.order_by('pk').defer('html')
+        queryset = queryset.prefetch_related('lines__sublines', 'transactions')
+        last = 0
+        while True:
+            bills = list(queryset.filter(pk__gt=last)[:batch_size])
+            if not bills:
+                break
+            for bill in bills:
+                stored = [getattr(bill, field) for field in self.TOTAL_FIELDS]
+                bill.update_totals()
+                yield bill, stored
+            last = bills[-1].pk
+    
+    def update_totals(self, batch_size=500):
+        """ stores the recomputed totals, returns the number of changed bills """
+        changed = []
+        num = 0
+        for bill, stored in self.recompute_totals(batch_size=batch_size):
+            if stored != [getattr(bill, field) for field in self.TOTAL_FIELDS]:
+                changed.append(bill)
+            if len(changed) >= batch_size:
+                bulk_update(changed, self.TOTAL_FIELDS)
+                num += len(changed)
+                changed = []
+        bulk_update(changed, self.TOTAL_FIELDS)
+        return num + len(changed)
+    
+    def verify_totals(self, batch_size=500):
+        """ yields (bill, field, stored, computed) for every out of date value """
+        for bill, stored in self.recompute_totals(batch_size=batch_size):
+            for field, value in zip(self.TOTAL_FIELDS, stored):
+                if getattr(bill, field) != value:
+                    yield bill, field, value, getattr(bill, field)
+
+
+class BillManager(models.Manager.from_queryset(BillQuerySet)):
     def get_queryset(self):
         queryset = super(BillManager, self).get_queryset()
         if self.model != Bill:
             bill_type = self.model.get_class_type()
             queryset = queryset.filter(type=bill_type)
         return queryset
+    
+    def allocate_numbers(self, bills, is_open=None):
+        """ returns the numbers of bills, with one allocation per prefix """
+        year = timezone.now().year
+        groups = {}
+        for ix, bill in enumerate(bills):
+            bill_open = bill.is_open if is_open is None else is_open
+            prefix = bill.get_number_prefix(is_open=bill_open)
+            groups.setdefault((prefix, bill_open), []).append(ix)
+        numbers = [None] * len(bills)
+        for (prefix, bill_open), group in groups.items():
+            allocated = BillNumber.objects.allocate(prefix, year, count=len(group),
+                is_open=bill_open)
+            for ix, number in zip(group, allocated):
+                numbers[ix] = bills[ix].format_number(prefix, year, number)
+        return numbers
 
 
 class Bill(models.Model):
@@ -110,7 +246,15 @@ class Bill(models.Model):
     is_sent = models.BooleanField(_("sent"), default=False)
     due_on = models.DateField(_("due on"), null=True, blank=True)
     updated_on = models.DateField(_("updated on"), auto_now=True)
-#    total = models.DecimalField(max_digits=12, decimal_places=2, null=True)
+    # Materialized by update_totals(), kept up to date by bills.signals
+    base = models.DecimalField(_("base"), max_digits=12, decimal_places=2, default=0,
+        editable=False)
+    tax = models.DecimalField(_("tax"), max_digits=12, decimal_places=2, default=0,
+        editable=False)
+    total = models.DecimalField(_("total"), max_digits=12, decimal_places=2, default=0,
+        editable=False)
+    payment_state = models.CharField(_("payment state"), max_length=16, choices=PAYMENT_STATES,
+        default=OPEN, blank=True, editable=False, db_index=True)
     comments = models.TextField(_("comments"), blank=True)
     html = models.TextField(_("HTML"), blank=True)
     
@@ -128,10 +272,6 @@ class Bill(models.Model):
             cls = cls.__base__
         return cls.__name__.upper()
     
-    @cached_property
-    def total(self):
-        return self.compute_total()
-    
     @cached_property
     def seller(self):
         return Account.objects.get_main().billcontact
@@ -144,8 +284,7 @@ class Bill(models.Model):
     def has_multiple_pages(self):
         return self.type != self.FEE
     
-    @cached_property
-    def payment_state(self):
+    def compute_payment_state(self):
         if self.is_open or self.get_type() == self.PROFORMA:
             return self.OPEN
         secured = 0
@@ -205,10 +344,6 @@ class Bill(models.Model):
             if errors:
                 raise ValidationError(errors)
     
-    def get_payment_state_display(self):
-        value = self.payment_state
-        return force_text(dict(self.PAYMENT_STATES).get(value, value))
-    
     def get_current_transaction(self):
         return self.transactions.exclude_rejected().first()
     
@@ -225,30 +360,30 @@ class Bill(models.Model):
             raise TypeError("%s has no associated amend type." % self.type)
         return amend_type
     
-    def get_number(self):
-        cls = type(self)
-        if cls is models.DEFERRED:
-            cls = cls.__base__
+    def get_number_prefix(self, is_open=None):
         bill_type = self.get_type()
         if bill_type == self.BILL:
             raise TypeError('This method can not be used on BILL instances')
         bill_type = bill_type.replace('AMENDMENT', 'AMENDMENT_')
         prefix = getattr(settings, 'BILLS_%s_NUMBER_PREFIX' % bill_type)
-        if self.is_open:
+        if is_open is None:
+            is_open = self.is_open
+        if is_open:
             prefix = 'O{}'.format(prefix)
-        year = timezone.now().strftime("%Y")
-        bills = cls.objects.filter(number__regex=r'^%s%s[0-9]+' % (prefix, year))
-        last_number = bills.order_by('-number').values_list('number', flat=True).first()
-        if last_number is None:
-            last_number = 0
-        else:
-            last_number = int(last_number[len(prefix)+4:])
-        number = last_number + 1
+        return prefix
+    
+    def format_number(self, prefix, year, number):
         number_length = settings.BILLS_NUMBER_LENGTH
         zeros = (number_length - len(str(number))) * '0'
         number = zeros + str(number)
         return '{prefix}{year}{number}'.format(prefix=prefix, year=year, number=number)
     
+    def get_number(self):
+        prefix = self.get_number_prefix()
+        year = timezone.now().year
+        number, = BillNumber.objects.allocate(prefix, year, is_open=self.is_open)
+        return self.format_number(prefix, year, number)
+    
     def get_due_date(self, payment=None):
         now = timezone.now()
         if payment:
@@ -258,7 +393,12 @@ class Bill(models.Model):
     def get_absolute_url(self):
         return reverse('admin:bills_bill_view', args=(self.pk,))
     
-    def close(self, payment=False):
+    @transaction.atomic
+    def close(self, payment=False, number=None, commit=True):
+        """
+        number can be preallocated with Bill.objects.allocate_numbers(bills, is_open=False)
+        commit=False leaves rendering and saving the bill to the caller
+        """
         if not self.is_open:
             raise TypeError("Bill not in Open state.")
         if payment is False:
@@ -272,16 +412,18 @@ class Bill(models.Model):
         self.closed_on = timezone.now()
         self.is_open = False
         self.is_sent = False
-        self.number = self.get_number()
-        self.html = self.render(payment=payment)
-        self.save()
+        self.number = number or self.get_number()
+        self.update_totals()
+        if commit:
+            self.html = self.render(payment=payment)
+            self.save()
         return transaction
     
     def get_billing_contact_emails(self):
         return self.account.get_contacts_emails(usages=(Contact.BILLING,))
     
-    def send(self):
-        pdf = self.as_pdf()
+    def send(self, pdf=None):
+        pdf = pdf or self.as_pdf()
         self.account.send_email(
             template=settings.BILLS_EMAIL_NOTIFICATION_TEMPLATE,
             context={
@@ -297,13 +439,21 @@ class Bill(models.Model):
         self.is_sent = True
         self.save(update_fields=['is_sent'])
     
-    def render(self, payment=False, language=None):
+    def get_template_name(self):
+        template_name = 'BILLS_%s_TEMPLATE' % self.get_type()
+        return getattr(settings, template_name, settings.BILLS_DEFAULT_TEMPLATE)
+    
+    def render(self, payment=False, language=None, template=None):
         with translation.override(language or self.account.language):
             if payment is False:
                 payment = self.account.paymentsources.get_default()
+            if self.has_prefetched_lines():
+                lines = self.lines.all()
+            else:
+                lines = self.lines.all().prefetch_related('sublines')
             context = Context({
                 'bill': self,
-                'lines': self.lines.all().prefetch_related('sublines'),
+                'lines': lines,
                 'seller': self.seller,
                 'buyer': self.buyer,
                 'seller_info': {
@@ -317,16 +467,13 @@ class Bill(models.Model):
                 'default_due_date': self.get_due_date(payment=payment),
                 'now': timezone.now(),
             })
-            template_name = 'BILLS_%s_TEMPLATE' % self.get_type()
-            template = getattr(settings, template_name, settings.BILLS_DEFAULT_TEMPLATE)
-            bill_template = loader.get_template(template)
+            bill_template = template or loader.get_template(self.get_template_name())
             html = bill_template.render(context)
             html = html.replace('-pageskip-', '<pdf:nextpage />')
         return html
     
     def as_pdf(self):
-        html = self.html or self.render()
-        return html_to_pdf(html, pagination=self.has_multiple_pages)
+        return get_pdf(self)
     
     def updated(self):
         self.updated_on = timezone.now()
@@ -337,13 +484,23 @@ class Bill(models.Model):
             self.type = self.get_type()
         if not self.number:
             self.number = self.get_number()
+        if (self.payment_state == self.OPEN) != (self.is_open or self.get_type() == self.PROFORMA):
+            # Closed or reopened without update_totals()
+            self.payment_state = self.compute_payment_state()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'payment_state' not in update_fields:
+                kwargs['update_fields'] = list(update_fields) + ['payment_state']
         super(Bill, self).save(*args, **kwargs)
     
     @cached
     def compute_subtotals(self):
         subtotals = {}
-        lines = self.lines.annotate(totals=F('subtotal') + Sum(Coalesce('sublines__total', 0)))
-        for tax, total in lines.values_list('tax', 'totals'):
+        if self.has_prefetched_lines():
+            lines = [(line.tax, line.compute_total()) for line in self.lines.all()]
+        else:
+            lines = self.lines.annotate(totals=F('subtotal') + Sum(Coalesce('sublines__total', 0)))
+            lines = lines.values_list('tax', 'totals')
+        for tax, total in lines:
             try:
                 subtotals[tax] += total
             except KeyError:
@@ -353,8 +510,20 @@ class Bill(models.Model):
             result[tax] = [subtotal, round(tax/100*subtotal, 2)]
         return result
     
+    def update_totals(self):
+        """ sets the materialized total, base, tax and payment_state, does not save """
+        self.base = self.compute_base()
+        self.tax = self.compute_tax()
+        self.total = self.compute_total()
+        self.payment_state = self.compute_payment_state()
+    
+    def has_prefetched_lines(self):
+        return 'lines' in getattr(self, '_prefetched_objects_cache', ())
+    
     @cached
     def compute_base(self):
+        if self.has_prefetched_lines():
+            return round(sum(line.compute_total() for line in self.lines.all()), 2)
         bases = self.lines.annotate(
             bases=F('subtotal') + Sum(Coalesce('sublines__total', 0))
         )
@@ -362,6 +531,8 @@ class Bill(models.Model):
     
     @cached
     def compute_tax(self):
+        if self.has_prefetched_lines():
+            return round(sum(line.compute_total()*line.tax/100 for line in self.lines.all()), 2)
         taxes = self.lines.annotate(
             taxes=(F('subtotal') + Coalesce(Sum('sublines__total'), 0)) * (F('tax')/100)
         )
@@ -369,7 +540,7 @@ class Bill(models.Model):
     
     @cached
     def compute_total(self):
-        if 'lines' in getattr(self, '_prefetched_objects_cache', ()):
+        if self.has_prefetched_lines():
             total = 0
             for line in self.lines.all():
                 line_total = line.compute_total()
@@ -495,3 +666,23 @@ class BillSubline(models.Model):
     
     def __str__(self):
         return "%s %i" % (self.description, self.total)
+
+
+class BillRollup(models.Model):
+    """
+    Lines of closed bills aggregated per day, service and tax, maintained by bills.reports
+    active and cancelled are counted at the time the day is aggregated
+    """
+    date = models.DateField(_("date"), db_index=True)
+    name = models.CharField(_("name"), max_length=256)
+    tax = models.DecimalField(_("tax"), max_digits=4, decimal_places=2)
+    lines = models.PositiveIntegerField(_("lines"))
+    active = models.PositiveIntegerField(_("active"))
+    cancelled = models.PositiveIntegerField(_("cancelled"))
+    nominal_price = models.DecimalField(_("nominal price"), max_digits=12, decimal_places=2)
+    nominal_total = models.DecimalField(_("nominal total"), max_digits=14, decimal_places=2)
+    quantity = models.DecimalField(_("quantity"), max_digits=14, decimal_places=2)
+    total = models.DecimalField(_("total"), max_digits=14, decimal_places=2)
+    
+    def __str__(self):
+        return "%s %s" % (self.date, self.name)
@@ -0,0 +1,87 @@
+import hashlib
+import os
+import tempfile
+
+from orchestra.utils.html import renderer
+from orchestra.utils.paths import get_site_dir
+
+from . import settings
+
+
+class PDFStore(object):
+    """
+    Content-addressed store of rendered bills, a PDF is kept under the hash of the HTML
+    it was rendered from, so closed bills are only rendered once.
+    """
+    def get_dir(self):
+        path = settings.BILLS_PDF_CACHE_PATH
+        if path:
+            return path % {
+                'site_dir': get_site_dir(),
+            }
+        return None
+    
+    def get_key(self, html, pagination):
+        content = '%i:%s' % (int(pagination), html)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+    
+    def get_path(self, key):
+        path = self.get_dir()
+        if path:
+            return os.path.join(path, key[:2], '%s.pdf' % key)
+        return None
+    
+    def get(self, key):
+        path = self.get_path(key)
+        if path:
+            try:
+                with open(path, 'rb') as handler:
+                    return handler.read()
+            except FileNotFoundError:
+                pass
+        return None
+    
+    def set(self, key, pdf):
+        path = self.get_path(key)
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Readers never see a partially written file
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as handler:
+                handler.write(pdf)
+            os.replace(tmp, path)
+
+
+store = PDFStore()
+
+
+def get_pdfs(bills):
+    """
+    Yields (bill, pdf) in bills order, cached PDFs are served from the store and
+    the remaining bills are rendered in parallel
+    """
+    bills = list(bills)
+    keys = []
+    documents = []
+    for bill in bills:
+        if bill.html:
+            key = store.get_key(bill.html, bill.has_multiple_pages)
+            pdf = store.get(key)
+        else:
+            # Open bills are rendered each time
+            key = pdf = None
+        keys.append((key, pdf))
+        if pdf is None:
+            documents.append((bill.html or bill.render(), bill.has_multiple_pages))
+    rendered = renderer.render_many(documents)
+    for bill, (key, pdf) in zip(bills, keys):
+        if pdf is None:
+            pdf = next(rendered)
+            if key:
+                store.set(key, pdf)
+        yield bill, pdf
+
+
+def get_pdf(bill):
+    for bill, pdf in get_pdfs([bill]):
+        return pdf
@@ -0,0 +1,158 @@
+from django.db import transaction
+from django.db.models import (Case, CharField, Count, DecimalField, F, IntegerField, Max, Q, Sum,
+    Value, When)
+from django.utils import timezone
+
+from .models import Bill, BillLine, BillSubline, BillRollup
+
+
+def get_name(service, description):
+    """ service description or *line description for custom lines """
+    return service if service is not None else '*%s' % description
+
+
+def aggregate_lines(lines, now=None, by_date=False):
+    """
+    Aggregates bill lines by service and tax in SQL
+    returns {(name, tax): info} or {(date, name, tax): info} when by_date
+    
+    Sublines are aggregated with their own grouped query, joining them on the lines
+    query would count the line subtotals once per subline
+    """
+    now = now or timezone.now().date()
+    keys = ['order__service__description', 'custom', 'tax']
+    if by_date:
+        keys.insert(0, 'bill__closed_on')
+    lines = lines.order_by()
+    custom = Case(
+        When(order__isnull=True, then=F('description')), default=Value(''), output_field=CharField()
+    )
+    active = Q(order__cancelled_on__isnull=True) | Q(order__cancelled_on__gt=now)
+    # line.quantity or 1
+    quantity = Case(
+        When(Q(quantity__isnull=True) | Q(quantity=0), then=Value(1)), default=F('quantity'),
+        output_field=DecimalField()
+    )
+    rows = lines.annotate(custom=custom).values(*keys).annotate(
+        num_lines=Count('id'),
+        num_active=Sum(Case(When(active, then=1), default=0, output_field=IntegerField())),
+        max_nominal_price=Max('order__service__nominal_price'),
+        sum_nominal_price=Sum('order__service__nominal_price'),
+        sum_quantity=Sum(quantity),
+        sum_subtotal=Sum('subtotal'),
+    )
+    result = {}
+    for row in rows:
+        key = (get_name(row['order__service__description'], row['custom']), row['tax'])
+        if by_date:
+            key = (row['bill__closed_on'],) + key
+        result[key] = {
+            'lines': row['num_lines'],
+            'active': row['num_active'],
+            'cancelled': row['num_lines'] - row['num_active'],
+            'nominal_price': row['max_nominal_price'] or 0,
+            'nominal_total': row['sum_nominal_price'] or 0,
+            'quantity': row['sum_quantity'],
+            'total': row['sum_subtotal'],
+        }
+    sublines = BillSubline.objects.filter(line__in=lines).order_by()
+    custom = Case(
+        When(line__order__isnull=True, then=F('line__description')), default=Value(''),
+        output_field=CharField()
+    )
+    subkeys = ['line__%s' % key if key != 'custom' else key for key in keys]
+    for row in sublines.annotate(custom=custom).values(*subkeys).annotate(sum_total=Sum('total')):
+        key = (get_name(row['line__order__service__description'], row['custom']), row['line__tax'])
+        if by_date:
+            key = (row['line__bill__closed_on'],) + key
+        result[key]['total'] += row['sum_total']
+    return result
+
+
+def service_report(lines, now=None):
+    """ [(name, [active, cancelled, nominal_price, quantity, total])], totals """
+    services = {}
+    totals = [0, 0, 0, 0, 0]
+    for (name, tax), info in aggregate_lines(lines, now=now).items():
+        try:
+            service = services[name]
+        except KeyError:
+            service = [0, 0, info['nominal_price'], 0, 0]
+            services[name] = service
+        service[0] += info['active']
+        service[1] += info['cancelled']
+        service[3] += info['quantity']
+        service[4] += info['total']
+        totals[0] += info['active']
+        totals[1] += info['cancelled']
+        totals[2] += info['nominal_total']
+        totals[3] += info['quantity']
+        totals[4] += info['total']
+    return sorted(services.items(), key=lambda n: -n[1][4]), totals
+
+
+def tax_report(lines):
+    """ {tax: [subtotal, taxes]} """
+    subtotals = {}
+    for (name, tax), info in aggregate_lines(lines).items():
+        subtotals[tax] = subtotals.get(tax, 0) + info['total']
+    return {
+        tax: [subtotal, round(tax/100*subtotal, 2)] for tax, subtotal in subtotals.items()
+    }
+
+
+def get_rollup_lines():
+    """ lines accounted on the rollup, the ones of closed bills that are not amends nor pro formas """
+    return BillLine.objects.filter(
+        bill__is_open=False, bill__amend_of__isnull=True
+    ).exclude(bill__type=Bill.PROFORMA)
+
+
+@transaction.atomic
+def refresh_rollup(dates):
+    dates = list(dates)
+    BillRollup.objects.filter(date__in=dates).delete()
+    lines = get_rollup_lines().filter(bill__closed_on__in=dates)
+    BillRollup.objects.bulk_create([
+        BillRollup(date=date, name=name, tax=tax, **info)
+            for (date, name, tax), info in aggregate_lines(lines, by_date=True).items()
+    ])
+
+
+def invalidate_rollup(dates):
+    """ the rollup of dates is computed again the next time it is needed """
+    dates = [date for date in dates if date]
+    if dates:
+        BillRollup.objects.filter(date__in=dates).delete()
+
+
+def rollup_report(ini, end):
+    """ service_report() of the lines of the bills closed between ini and end, using the rollup """
+    closed = Bill.objects.filter(
+        is_open=False, amend_of__isnull=True, closed_on__range=(ini, end)
+    ).exclude(type=Bill.PROFORMA).order_by().values_list('closed_on', flat=True).distinct()
+    rollups = BillRollup.objects.filter(date__range=(ini, end))
+    missing = set(closed) - set(rollups.order_by().values_list('date', flat=True).distinct())
+    if missing:
+        refresh_rollup(missing)
+    services = {}
+    totals = [0, 0, 0, 0, 0]
+    rows = rollups.order_by().values('name').annotate(
+        sum_active=Sum('active'),
+        sum_cancelled=Sum('cancelled'),
+        max_nominal_price=Max('nominal_price'),
+        sum_nominal_total=Sum('nominal_total'),
+        sum_quantity=Sum('quantity'),
+        sum_total=Sum('total'),
+    )
+    for row in rows:
+        services[row['name']] = [
+            row['sum_active'], row['sum_cancelled'], row['max_nominal_price'],
+            row['sum_quantity'], row['sum_total']
+        ]
+        totals[0] += row['sum_active']
+        totals[1] += row['sum_cancelled']
+        totals[2] += row['sum_nominal_total']
+        totals[3] += row['sum_quantity']
+        totals[4] += row['sum_total']
+    return sorted(services.items(), key=lambda n: -n[1][4]), totals
@@ -101,3 +101,11 @@ BILLS_CONTACT_DEFAULT_COUNTRY = Setting('BILLS_CONTACT_DEFAULT_COUNTRY',
     'ES',
     choices=BILLS_CONTACT_COUNTRIES
 )
+
+
+BILLS_PDF_CACHE_PATH = Setting('BILLS_PDF_CACHE_PATH',
+    '%(site_dir)s/pdfs',
+    validators=[Setting.string_format_validator(('site_dir',))],
+    help_text=("Directory where the PDFs of closed bills are kept, addressed by the hash of their "
+               "HTML. Leave it empty for disabling the cache.")
+)
@@ -0,0 +1,54 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import reports
+from .models import (AmendmentFee, AmendmentInvoice, Bill, BillLine, BillSubline, Fee, Invoice,
+    ProForma)
+
+
+Transaction = Bill._meta.get_field('transactions').related_model
+
+
+def update_totals(bill_id):
+    if bill_id is not None:
+        Bill.objects.filter(pk=bill_id).update_totals()
+        invalidate_rollup(bill_id)
+
+
+def invalidate_rollup(bill_id):
+    """ closing day of the bill is aggregated again by the next report """
+    reports.invalidate_rollup(
+        Bill.objects.filter(pk=bill_id, is_open=False).values_list('closed_on', flat=True)
+    )
+
+
+@receiver(post_save, sender=BillLine, dispatch_uid='bills.line_update_totals')
+@receiver(post_delete, sender=BillLine, dispatch_uid='bills.line_delete_totals')
+@receiver(post_save, sender=Transaction, dispatch_uid='bills.transaction_update_totals')
+@receiver(post_delete, sender=Transaction, dispatch_uid='bills.transaction_delete_totals')
+def update_bill_totals(sender, *args, **kwargs):
+    update_totals(kwargs['instance'].bill_id)
+
+
+@receiver(post_save, sender=BillSubline, dispatch_uid='bills.subline_update_totals')
+@receiver(post_delete, sender=BillSubline, dispatch_uid='bills.subline_delete_totals')
+def update_line_totals(sender, *args, **kwargs):
+    line_id = kwargs['instance'].line_id
+    # The line may have already been deleted
+    bill_id = BillLine.objects.filter(pk=line_id).values_list('bill_id', flat=True).first()
+    update_totals(bill_id)
+
+
+def invalidate_bill_rollup(sender, *args, **kwargs):
+    instance = kwargs['instance']
+    if not instance.is_open:
+        reports.invalidate_rollup([instance.closed_on])
+
+
+# Bill types are proxy models, sent as sender
+for model in (Bill, Invoice, AmendmentInvoice, Fee, AmendmentFee, ProForma):
+    name = model._meta.model_name
+    post_save.connect(invalidate_bill_rollup, sender=model,
+        dispatch_uid='bills.%s_invalidate_rollup' % name)
+    post_delete.connect(invalidate_bill_rollup, sender=model,
+        dispatch_uid='bills.%s_delete_rollup' % name)
@@ -10,6 +10,7 @@ class LetsEncryptController(ServiceController):
     model = 'websites.Website'
     verbose_name = "Let's encrypt!"
     actions = ('encrypt',)
+    instance_attributes = ('encrypt_domains',)
     
     def prepare(self):
         super().prepare()
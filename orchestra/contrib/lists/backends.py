@@ -83,6 +83,7 @@ class MailmanController(MailmanVirtualDomainController):
     Includes <tt>MailmanVirtualDomainController</tt>
     """
     verbose_name = "Mailman"
+    instance_attributes = ('password',)
     address_suffixes = [
         '',
         '-admin',
@@ -7,7 +7,7 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.utils.translation import ugettext_lazy as _
 
 from orchestra.contrib.orchestration import ServiceController
-from orchestra.contrib.resources import ServiceMonitor
+from orchestra.contrib.resources import LogMonitor, ServiceMonitor
 
 from . import settings
 from .models import Address, Mailbox
@@ -455,10 +455,13 @@ class DovecotMaildirDisk(ServiceMonitor):
         return context
 
 
-class PostfixMailscannerTraffic(ServiceMonitor):
+class PostfixMailscannerTraffic(LogMonitor):
     """
     A high-performance log parser.
     Reads the mail.log file only once, for all users.
+    
+    Queue ids are not kept between runs, when reading only the new lines a message
+    authenticated on one run and delivered on the next one is not counted.
     """
     model = 'mailboxes.Mailbox'
     resource = ServiceMonitor.TRAFFIC
@@ -470,10 +473,11 @@ class PostfixMailscannerTraffic(ServiceMonitor):
     )
     
     def prepare(self):
+        self.append(self.get_log_reader())
         mail_log = settings.MAILBOXES_MAIL_LOG_PATH
         context = {
             'current_date': self.current_date.strftime("%Y-%m-%d %H:%M:%S %Z"),
-            'mail_logs': str((mail_log, mail_log+'.1')),
+            'mail_log': mail_log,
         }
         self.append(textwrap.dedent("""\
             import re
@@ -488,9 +492,12 @@ class PostfixMailscannerTraffic(ServiceMonitor):
                 date = date.astimezone(tzlocal)
                 return date
             
-            maillogs = {mail_logs}
+            maillog = '{mail_log}'
             end_datetime = to_local_timezone('{current_date}')
             end_date = int(end_datetime.strftime('%Y%m%d%H%M%S'))
+            if consume:
+                # Lines are read only once, the ones logged while running belong to this period
+                end_date = 99999999999999
             months = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
             months = dict((m, '%02d' % n) for n, m in enumerate(months, 1))
             
@@ -522,67 +529,62 @@ class PostfixMailscannerTraffic(ServiceMonitor):
                 delivers[mailbox] = set()
                 reverse[mailbox] = set()
             
-            def monitor(users, delivers, reverse, maillogs):
+            def monitor(users, delivers, reverse, maillog):
                 targets = {{}}
                 counter = {{}}
                 user_regex = re.compile(r'\(Authenticated sender: ([^ ]+)\)')
-                for maillog in maillogs:
-                    try:
-                        with open(maillog, 'r') as maillog:
-                            for line in maillog.readlines():
-                                # Only search for Authenticated sendings
-                                if '(Authenticated sender: ' in line:
-                                    username = user_regex.search(line).groups()[0]
-                                    try:
-                                        sender = users[username]
-                                    except KeyError:
-                                        continue
-                                    else:
-                                        month, day, time, __, proc, id = line.split()[:6]
-                                        if inside_period(month, day, time, sender[0]):
-                                            # Add new email
-                                            delivers[id[:-1]] = username
-                                # Look for a MailScanner requeue ID
-                                elif ' Requeue: ' in line:
-                                    id, __, req_id = line.split()[6:9]
-                                    id = id.split('.')[0]
-                                    try:
-                                        username = delivers[id]
-                                    except KeyError:
-                                        pass
-                                    else:
-                                        targets[req_id] = (username, 0)
-                                        reverse[username].add(req_id)
-                                # Look for the mail size and count the number of recipients of each email
+                for line in read_logs(maillog):
+                    # Only search for Authenticated sendings
+                    if '(Authenticated sender: ' in line:
+                        username = user_regex.search(line).groups()[0]
+                        try:
+                            sender = users[username]
+                        except KeyError:
+                            continue
+                        else:
+                            month, day, time, __, proc, id = line.split()[:6]
+                            if inside_period(month, day, time, sender[0]):
+                                # Add new email
+                                delivers[id[:-1]] = username
+                    # Look for a MailScanner requeue ID
+                    elif ' Requeue: ' in line:
+                        id, __, req_id = line.split()[6:9]
+                        id = id.split('.')[0]
+                        try:
+                            username = delivers[id]
+                        except KeyError:
+                            pass
+                        else:
+                            targets[req_id] = (username, 0)
+                            reverse[username].add(req_id)
+                    # Look for the mail size and count the number of recipients of each email
+                    else:
+                        try:
+                            month, day, time, __, proc, req_id, __, msize = line.split()[:8]
+                        except ValueError:
+                            # not interested in this line
+                            continue
+                        if proc.startswith('postfix/'):
+                            req_id = req_id[:-1]
+                            if msize.startswith('size='):
+                                try:
+                                    target = targets[req_id]
+                                except KeyError:
+                                    pass
+                                else:
+                                    targets[req_id] = (target[0], int(msize[5:-1]))
+                            elif proc.startswith('postfix/smtp'):
+                                try:
+                                    target = targets[req_id]
+                                except KeyError:
+                                    pass
                                 else:
-                                    try:
-                                        month, day, time, __, proc, req_id, __, msize = line.split()[:8]
-                                    except ValueError:
-                                        # not interested in this line
-                                        continue
-                                    if proc.startswith('postfix/'):
-                                        req_id = req_id[:-1]
-                                        if msize.startswith('size='):
-                                            try:
-                                                target = targets[req_id]
-                                            except KeyError:
-                                                pass
-                                            else:
-                                                targets[req_id] = (target[0], int(msize[5:-1]))
-                                        elif proc.startswith('postfix/smtp'):
-                                            try:
-                                                target = targets[req_id]
-                                            except KeyError:
-                                                pass
-                                            else:
-                                                if inside_period(month, day, time, users[target[0]][0]):
-                                                    try:
-                                                        counter[req_id] += 1
-                                                    except KeyError:
-                                                        counter[req_id] = 1
-                    except IOError as e:
-                        sys.stderr.write(str(e)+'\\n')
-                    
+                                    if inside_period(month, day, time, users[target[0]][0]):
+                                        try:
+                                            counter[req_id] += 1
+                                        except KeyError:
+                                            counter[req_id] = 1
+                
                 for username, opts in users.iteritems():
                     size = 0
                     for req_id in reverse[username]:
@@ -592,7 +594,8 @@ class PostfixMailscannerTraffic(ServiceMonitor):
         )
     
     def commit(self):
-        self.append('monitor(users, delivers, reverse, maillogs)')
+        self.append('monitor(users, delivers, reverse, maillog)')
+        self.append('save_offsets()')
     
     def monitor(self, mailbox):
         context = self.get_context(mailbox)
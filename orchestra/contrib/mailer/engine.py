@@ -1,16 +1,29 @@
 import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from socket import error as SocketError
 
 from django.core.mail import get_connection
+from django.db import connection as db_connection, transaction
 from django.db.models import Q
 from django.utils import timezone
 from django.utils.encoding import smart_str
 
+from orchestra.models.utils import bulk_update
 from orchestra.utils.sys import LockFile, OperationLocked
 
 from . import settings
-from .models import Message
+from .models import Message, SMTPLog
+
+
+SEND_ERRORS = (
+    SocketError,
+    smtplib.SMTPSenderRefused,
+    smtplib.SMTPRecipientsRefused,
+    smtplib.SMTPAuthenticationError,
+)
 
 
 def send_message(message, connection=None, bulk=settings.MAILER_BULK_MESSAGES):
@@ -32,10 +45,7 @@ def send_message(message, connection=None, bulk=settings.MAILER_BULK_MESSAGES):
     error = None
     try:
         connection.connection.sendmail(message.from_address, [message.to_address], smart_str(message.content))
-    except (SocketError,
-            smtplib.SMTPSenderRefused,
-            smtplib.SMTPRecipientsRefused,
-            smtplib.SMTPAuthenticationError) as err:
+    except SEND_ERRORS as err:
         message.defer()
         error = err
     else:
@@ -44,33 +54,167 @@ def send_message(message, connection=None, bulk=settings.MAILER_BULK_MESSAGES):
     return connection
 
 
-def send_pending(bulk=settings.MAILER_BULK_MESSAGES):
-    try:
-        with LockFile('/dev/shm/mailer.send_pending.lock'):
+class RateLimiter(object):
+    """ Spaces messages to the same destination domain by 1/rate seconds, shared by all workers """
+    def __init__(self, rate):
+        self.interval = 1/rate if rate else 0
+        self.slots = {}
+        self.lock = threading.Lock()
+    
+    def wait(self, address):
+        if not self.interval:
+            return
+        domain = address.rsplit('@', 1)[-1].lower()
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.slots.get(domain, 0))
+            self.slots[domain] = slot + self.interval
+        if slot > now:
+            time.sleep(slot-now)
+
+
+class SMTPPool(object):
+    """
+    One SMTP connection per worker thread, kept open between messages and batches.
+    Connections are reopened every bulk messages or when the server has dropped them.
+    """
+    def __init__(self, bulk=settings.MAILER_BULK_MESSAGES):
+        self.bulk = bulk
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+    
+    def get(self):
+        try:
+            connection = self.local.connection
+        except AttributeError:
             connection = get_connection(backend='django.core.mail.backends.smtp.EmailBackend')
-            cur, total = 0, 0
-            for message in Message.objects.filter(state=Message.QUEUED).order_by('priority', 'last_try', 'created_at'):
-                if cur >= bulk:
-                    connection.close()
-                    cur = 0
-                send_message(message, connection, bulk)
-                cur += 1
-                total += 1
-            now = timezone.now()
-            qs = Q()
-            for retries, seconds in enumerate(settings.MAILER_DEFERE_SECONDS):
-                delta = timedelta(seconds=seconds)
-                qs = qs | Q(retries=retries, last_try__lte=now-delta)
-            for message in Message.objects.filter(state=Message.DEFERRED).filter(qs).order_by('priority', 'last_try'):
-                if cur >= bulk:
-                    connection.close()
-                    cur = 0
-                send_message(message, connection, bulk)
-                cur += 1
-                total += 1
+            self.local.connection = connection
+            self.local.sent = 0
+            with self.lock:
+                self.connections.append(connection)
+        if self.local.sent >= self.bulk:
+            connection.close()
+            self.local.sent = 0
+        if connection.connection is None:
+            connection.open()
+        return connection
+    
+    def sendmail(self, message):
+        args = (message.from_address, [message.to_address], smart_str(message.content))
+        connection = self.get()
+        try:
+            connection.connection.sendmail(*args)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # Stale pooled connection
+            connection.close()
+            connection = self.get()
+            connection.connection.sendmail(*args)
+        self.local.sent += 1
+    
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+
+
+class Sender(object):
+    """ Sends messages on parallel workers, without database access """
+    def __init__(self, workers=None, bulk=settings.MAILER_BULK_MESSAGES, rate=None):
+        self.pool = SMTPPool(bulk)
+        self.limiter = RateLimiter(settings.MAILER_DOMAIN_RATE_LIMIT if rate is None else rate)
+        self.executor = ThreadPoolExecutor(max_workers=workers or settings.MAILER_WORKERS)
+    
+    def send_message(self, message):
+        """ returns the sending error or None """
+        self.limiter.wait(message.to_address)
+        try:
+            self.pool.sendmail(message)
+        except (smtplib.SMTPException, OSError) as err:
+            # A failing message never aborts the batch, the rest of it has already been sent
+            return err
+        return None
+    
+    def send(self, messages):
+        """ errors of messages, in messages order """
+        return list(self.executor.map(self.send_message, messages))
+    
+    def close(self):
+        self.executor.shutdown()
+        self.pool.close()
+
+
+def can_skip_locked():
+    return db_connection.vendor == 'postgresql' and db_connection.pg_version >= 90500
+
+
+def get_pending(now):
+    """ queued and retriable deferred messages querysets, in sending order """
+    retry = Q()
+    for retries, seconds in enumerate(settings.MAILER_DEFERE_SECONDS):
+        delta = timedelta(seconds=seconds)
+        retry = retry | Q(retries=retries, last_try__lte=now-delta)
+    return (
+        Message.objects.filter(state=Message.QUEUED).order_by('priority', 'last_try', 'created_at'),
+        Message.objects.filter(state=Message.DEFERRED).filter(retry).order_by('priority', 'last_try'),
+    )
+
+
+def claim(queryset, size):
+    """ locks up to size messages until the end of the transaction, skipping the ones locked by other senders """
+    queryset = queryset[:size]
+    if can_skip_locked():
+        sql, params = queryset.query.sql_with_params()
+        return list(Message.objects.raw(sql + ' FOR UPDATE SKIP LOCKED', params))
+    return list(queryset.select_for_update())
+
+
+def record(messages, errors):
+    """ saves the outcome of sending messages with bulk queries """
+    now = timezone.now()
+    logs = []
+    for message, error in zip(messages, errors):
+        message.last_try = now
+        if message.state != message.QUEUED:
+            message.retries += 1
+        if error is None:
+            message.state = message.SENT
+            result = SMTPLog.SUCCESS
+        else:
+            message.state = message.DEFERRED
+            # Max tries
+            if message.retries >= len(settings.MAILER_DEFERE_SECONDS):
+                message.state = message.FAILED
+            result = SMTPLog.FAILURE
+        logs.append(SMTPLog(message=message, log_message=str(error), result=result))
+    bulk_update(messages, ('state', 'retries', 'last_try'))
+    SMTPLog.objects.bulk_create(logs)
+
+
+def send_pending(bulk=settings.MAILER_BULK_MESSAGES, workers=None, claim_size=None):
+    """
+    Sends queued and deferred messages, at most claim_size messages are sent before
+    their state is committed. Delivered messages are sent again if the process dies
+    before that, there is no record of the messages being sent
+    """
+    claim_size = claim_size or settings.MAILER_CLAIM_MESSAGES
+    # Concurrent senders skip each other's messages, the lock file is only needed without SKIP LOCKED
+    lock = LockFile('/dev/shm/mailer.send_pending.lock', unlocked=can_skip_locked())
+    try:
+        with lock:
+            sender = Sender(workers=workers, bulk=bulk)
+            total = 0
+            try:
+                for pending in get_pending(timezone.now()):
+                    while True:
+                        with transaction.atomic():
+                            messages = claim(pending, claim_size)
+                            if not messages:
+                                break
+                            record(messages, sender.send(messages))
+                        total += len(messages)
+            finally:
+                sender.close()
         return total
     except OperationLocked:
         pass
-    finally:
-        if 'connection' in vars() and connection.connection is not None:
-            connection.close()
@@ -22,3 +22,23 @@ MAILER_NON_QUEUED_PER_REQUEST_THRESHOLD = Setting('MAILER_NON_QUEUED_PER_REQUEST
 MAILER_BULK_MESSAGES = Setting('MAILER_BULK_MESSAGES',
     500,
 )
+
+
+MAILER_CLAIM_MESSAGES = Setting('MAILER_CLAIM_MESSAGES',
+    50,
+    help_text=_("Number of queued messages sent and recorded on each transaction. "
+                "A crash after sending them and before recording their state sends them again."),
+)
+
+
+MAILER_WORKERS = Setting('MAILER_WORKERS',
+    4,
+    help_text=_("Number of parallel SMTP connections used for sending queued messages."),
+)
+
+
+MAILER_DOMAIN_RATE_LIMIT = Setting('MAILER_DOMAIN_RATE_LIMIT',
+    0,
+    help_text=_("Maximum messages per second sent to the same destination domain, 0 for no limit."),
+    types=(int, float),
+)
@@ -0,0 +1,111 @@
+"""
+Sending pipeline benchmarks against a local SMTP stand-in that answers with latency
+
+    DJANGO_SETTINGS_MODULE=panel.settings python -m orchestra.contrib.mailer.tests.benchmarks
+"""
+import socketserver
+import threading
+import time
+
+from django.test.utils import override_settings
+
+from orchestra.utils.python import AttrDict
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """ Minimal SMTP dialog, enough for smtplib.sendmail() """
+    def reply(self, line):
+        self.wfile.write(('%s\r\n' % line).encode('ascii'))
+    
+    def handle(self):
+        self.reply('220 localhost benchmark')
+        data = False
+        for line in self.rfile:
+            if data:
+                if line == b'.\r\n':
+                    data = False
+                    time.sleep(self.server.latency)
+                    self.server.count()
+                    self.reply('250 queued')
+                continue
+            command = line[:4].upper()
+            if command in (b'EHLO', b'HELO'):
+                self.reply('250 localhost')
+            elif command == b'DATA':
+                data = True
+                self.reply('354 go ahead')
+            elif command == b'QUIT':
+                self.reply('221 bye')
+                break
+            else:
+                self.reply('250 ok')
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.latency = latency
+        self.received = 0
+        self.lock = threading.Lock()
+    
+    def count(self):
+        with self.lock:
+            self.received += 1
+
+
+def get_messages(num, domains):
+    content = 'Subject: benchmark\r\n\r\n' + 'x'*2000
+    return [
+        AttrDict(from_address='bench@example.com', to_address='user%i@domain%i.com' % (i, i % domains),
+                 content=content)
+            for i in range(num)
+    ]
+
+
+def bench_serial(messages):
+    """ one connection, one message at a time, like the previous send_pending """
+    from django.core.mail import get_connection
+    connection = get_connection(backend='django.core.mail.backends.smtp.EmailBackend')
+    connection.open()
+    for message in messages:
+        connection.connection.sendmail(message.from_address, [message.to_address], message.content)
+    connection.close()
+
+
+def bench_pool(messages, workers, rate=0):
+    from ..engine import Sender
+    sender = Sender(workers=workers, rate=rate)
+    errors = sender.send(messages)
+    sender.close()
+    assert not any(errors), errors
+
+
+def run(num=500, domains=50, latency=0.01, workers=(1, 4, 8, 16)):
+    server = SMTPServer(latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    messages = get_messages(num, domains)
+    with override_settings(EMAIL_HOST='127.0.0.1', EMAIL_PORT=server.server_address[1],
+                           EMAIL_USE_TLS=False, EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD=''):
+        start = time.time()
+        bench_serial(messages)
+        print('bench_serial: %i messages in %.2fs' % (num, time.time()-start))
+        for num_workers in workers:
+            start = time.time()
+            bench_pool(messages, num_workers)
+            print('bench_pool: %i messages in %.2fs using %i workers' % (
+                num, time.time()-start, num_workers))
+        # Each domain receives num/domains messages at 10 per second
+        start = time.time()
+        bench_pool(messages, max(workers), rate=10)
+        print('bench_pool: %i messages in %.2fs limited to 10/s per domain' % (num, time.time()-start))
+    server.shutdown()
+    print('%i messages received' % server.received)
+
+
+if __name__ == '__main__':
+    import django
+    django.setup()
+    run()
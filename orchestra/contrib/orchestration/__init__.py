@@ -1,6 +1,8 @@
 import collections
-import copy
 
+from django.utils.encoding import force_text
+
+from orchestra.models.utils import snapshot
 from orchestra.utils.python import AttrDict
 
 from .backends import ServiceBackend, ServiceController, replace
@@ -24,17 +26,20 @@ class Operation():
     
     def __hash__(self):
         """ set() """
-        return hash((self.backend, self.instance, self.action))
+        return hash(self.key)
     
     def __eq__(self, operation):
         """ set() """
-        return hash(self) == hash(operation)
+        return self.key == getattr(operation, 'key', None)
     
     def __init__(self, backend, instance, action, routes=None):
         self.backend = backend
-        # instance should maintain any dynamic attribute until backend execution
-        # deep copy is prefered over copy otherwise objects will share same atributes (queryset cache)
-        self.instance = copy.deepcopy(instance)
+        # (backend, model, pk, action) identifies the operation, unsaved instances by identity
+        model = instance._meta.concrete_model
+        self.key = (backend, model, instance.pk or id(instance), action)
+        # Snapshot of the field values, only the dynamic attributes declared by the backend are kept
+        # objects would share the same attributes (queryset cache) otherwise
+        self.instance = snapshot(instance, attributes=backend.instance_attributes)
         self.action = action
         self.routes = routes
     
@@ -80,6 +85,22 @@ class Operation():
             action=self.action,
         )
     
+    @classmethod
+    def store_all(cls, operations, log):
+        """ stores all the operations of log with a single query, returns the BackendOperations """
+        from .models import BackendOperation
+        backend_operations = [
+            BackendOperation(
+                log=log,
+                backend=operation.backend.get_name(),
+                instance=operation.instance,
+                instance_repr=force_text(operation.instance)[:256],
+                action=operation.action,
+            ) for operation in operations
+        ]
+        BackendOperation.objects.using(log._state.db).bulk_create(backend_operations)
+        return backend_operations
+    
     @classmethod
     def load(cls, operation, log=None):
         routes = None
@@ -89,10 +89,9 @@ def orchestrate(modeladmin, request, queryset):
                 models.add(model)
         querysets = [model.objects.order_by('id') for model in models]
         
-        route_cache = {}
         for model in models:
             for instance in model.objects.all():
-                manager.collect(instance, action, operations=operations, route_cache=route_cache)
+                manager.collect(instance, action, operations=operations)
             routes = []
         result = []
         for operation in operations:
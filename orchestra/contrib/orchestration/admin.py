@@ -4,6 +4,7 @@ from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 
 from orchestra.admin import ExtendedModelAdmin, ChangeViewActionsMixin
+from orchestra.admin.html import monospace_format
 from orchestra.admin.utils import admin_link, admin_date, admin_colored, display_mono, display_code
 from orchestra.plugins.admin import display_plugin_field
 
@@ -154,8 +155,6 @@ class BackendLogAdmin(ChangeViewActionsMixin, admin.ModelAdmin):
     display_created = admin_date('created_at', short_description=_("Created"))
     display_state = admin_colored('state', colors=STATE_COLORS)
     display_script = display_code('script')
-    mono_stdout = display_mono('stdout')
-    mono_stderr = display_mono('stderr')
     mono_traceback = display_mono('traceback')
     
     class Media:
@@ -163,6 +162,14 @@ class BackendLogAdmin(ChangeViewActionsMixin, admin.ModelAdmin):
             'all': ('orchestra/css/pygments/github.css',)
         }
     
+    def mono_stdout(self, log):
+        return monospace_format(escape(log.get_stdout()))
+    mono_stdout.short_description = 'stdout'
+    
+    def mono_stderr(self, log):
+        return monospace_format(escape(log.get_stderr()))
+    mono_stderr.short_description = 'stderr'
+    
     def get_queryset(self, request):
         """ Order by structured name and imporve performance """
         qs = super(BackendLogAdmin, self).get_queryset(request)
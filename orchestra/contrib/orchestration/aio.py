@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import threading
+
+from orchestra.settings import ORCHESTRA_SSH_DEFAULT_USER
+
+from . import settings
+
+
+logger = logging.getLogger(__name__)
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """ returns the event loop shared by all AsyncSSH executions, running on its own thread """
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='orchestration-loop')
+            thread.daemon = True
+            thread.start()
+            _loop = loop
+    return _loop
+
+
+class ConnectionPool(object):
+    """ asyncssh connections keyed by address, only accessed from the event loop thread """
+    def __init__(self):
+        self.connections = {}
+        self.locks = {}
+    
+    @asyncio.coroutine
+    def connect(self, addr):
+        import asyncssh
+        return (yield from asyncssh.connect(addr, username=ORCHESTRA_SSH_DEFAULT_USER,
+            client_keys=[settings.ORCHESTRATION_SSH_KEY_PATH], known_hosts=None))
+    
+    @asyncio.coroutine
+    def get(self, addr):
+        lock = self.locks.setdefault(addr, asyncio.Lock())
+        with (yield from lock):
+            conn = self.connections.get(addr)
+            if conn is None:
+                conn = yield from self.connect(addr)
+                self.connections[addr] = conn
+            return conn
+    
+    def discard(self, addr):
+        conn = self.connections.pop(addr, None)
+        if conn is not None:
+            conn.close()
+
+
+connections = ConnectionPool()
+
+
+@asyncio.coroutine
+def pump(source, stream, name):
+    while True:
+        part = yield from source.read(4096)
+        if not part:
+            break
+        stream.write(**{name: part})
+
+
+@asyncio.coroutine
+def run_script(addr, script, stream, executable='bash', pool=connections):
+    """
+    Runs script on addr writing its output into a LogStream
+    Flushing to the database is left to the calling thread, returns the exit code.
+    """
+    conn = yield from pool.get(addr)
+    try:
+        process = yield from conn.create_process(executable, encoding='utf8')
+    except Exception:
+        # Stale connection, reconnect once
+        pool.discard(addr)
+        conn = yield from pool.get(addr)
+        process = yield from conn.create_process(executable, encoding='utf8')
+    try:
+        process.stdin.write(script)
+        process.stdin.write_eof()
+        yield from asyncio.gather(
+            pump(process.stdout, stream, 'stdout'),
+            pump(process.stderr, stream, 'stderr'),
+        )
+        yield from process.wait_closed()
+    finally:
+        # Also reached on timeout cancellation
+        process.close()
+    return process.exit_status
+
+
+def get_timeout(addr):
+    return settings.ORCHESTRATION_SSH_HOST_TIMEOUTS.get(addr, settings.ORCHESTRATION_SSH_TIMEOUT)
+
+
+def submit(addr, script, stream, executable='bash', pool=connections, timeout=None):
+    """ schedules run_script on the shared event loop, returns a concurrent.futures.Future """
+    if timeout is None:
+        timeout = get_timeout(addr)
+    coro = run_script(addr, script, stream, executable=executable, pool=pool)
+    if timeout:
+        coro = asyncio.wait_for(coro, timeout)
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
@@ -9,6 +9,10 @@ class OrchestrationConfig(AppConfig):
     
     def ready(self):
         from .models import Server, Route, BackendLog
+        from .backends import ServiceBackend
+        # Connects route table invalidation signals
+        from . import caches
+        ServiceBackend.build_model_index()
         administration.register(BackendLog, icon='scriptlog.png')
         administration.register(Server, parent=BackendLog, icon='vps.png')
         administration.register(Route, parent=BackendLog, icon='hal.png')
@@ -10,6 +10,10 @@ from orchestra import plugins
 from . import methods
 
 
+# model class -> [(backend, accessor)], see ServiceBackend.get_model_backends()
+_model_index = {}
+
+
 def replace(context, pattern, repl):
     """ applies replace to all context str values """
     for key, value in context.items():
@@ -24,6 +28,8 @@ class ServiceMount(plugins.PluginMount):
         if not (attrs.get('abstract', False) or name == 'ServiceBackend' or cls.model):
             raise AttributeError("'%s' does not have a defined model attribute." % cls)
         super(ServiceMount, cls).__init__(name, bases, attrs)
+        # A new backend has been registered
+        _model_index.clear()
 
 
 class ServiceBackend(plugins.Plugin, metaclass=ServiceMount):
@@ -46,6 +52,8 @@ class ServiceBackend(plugins.Plugin, metaclass=ServiceMount):
     default_route_match = 'True'
     # Force the backend manager to block in multiple backend executions executing them synchronously
     serialize = False
+    # Non-field instance attributes the backend uses, e.g. raw passwords or action arguments
+    instance_attributes = ()
     doc_settings = None
     # By default backend will not run if actions do not generate insctructions,
     # If your backend uses prepare() or commit() only then you should set force_empty_action_execution = True
@@ -110,14 +118,49 @@ class ServiceBackend(plugins.Plugin, metaclass=ServiceMount):
         model = '%s.%s' % (opts.app_label, opts.object_name)
         for rel_model, field in cls.related_models:
             if rel_model == model:
-                related = obj
-                for attribute in field.split('__'):
-                    related = getattr(related, attribute)
-                if type(related).__name__ == 'RelatedManager':
-                    return related.all()
-                return [related]
+                return cls.get_related_by_accessor(obj, field)
         return []
     
+    @classmethod
+    def get_related_by_accessor(cls, obj, accessor):
+        related = obj
+        for attribute in accessor.split('__'):
+            related = getattr(related, attribute)
+        if type(related).__name__ == 'RelatedManager':
+            return related.all()
+        return [related]
+    
+    @classmethod
+    def get_model_backends(cls, model):
+        """
+        Returns [(backend, accessor)] of all backends interested in model, in backend order
+        accessor is None when model is the backend main model, otherwise the related_models one
+        
+        Precomputed index, allows signal handlers to ignore unrelated models right away
+        """
+        try:
+            return _model_index[model]
+        except KeyError:
+            pass
+        opts = model._meta
+        label = '%s.%s' % (opts.app_label, opts.object_name)
+        backends = []
+        for backend in ServiceBackend.get_backends():
+            if backend.model == label:
+                backends.append((backend, None))
+            else:
+                for rel_model, accessor in backend.related_models:
+                    if rel_model == label:
+                        backends.append((backend, accessor))
+                        break
+        _model_index[model] = backends
+        return backends
+    
+    @classmethod
+    def build_model_index(cls):
+        for model in apps.get_models():
+            cls.get_model_backends(model)
+    
     @classmethod
     def get_backends(cls, instance=None, action=None):
         backends = cls.get_plugins()
@@ -0,0 +1,132 @@
+import logging
+import threading
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import settings
+from .models import Route, Server
+
+
+logger = logging.getLogger(__name__)
+
+
+class RouteTable(object):
+    """
+    Process-wide (backend, action) -> [routes] table, loaded once and invalidated
+    when a Route or Server changes.
+    
+    Changes made inside a transaction are not cached until it has finished, it loads its own
+    table meanwhile and the other connections can not see them yet.
+    
+    When ORCHESTRATION_ROUTE_CACHE is set, a version key is kept on that Django cache
+    so all workers reload their table after a change made by any of them.
+    """
+    VERSION_KEY = 'orchestration.route_table.version'
+    # seconds between checks of the shared version
+    check_interval = 5
+    
+    def __init__(self):
+        self.table = None
+        self.version = None
+        self.last_check = 0
+        self.hits = 0
+        self.misses = 0
+        # [(connection, on_commit callback)] of the changes of unfinished transactions
+        self.pending = []
+        self.lock = threading.Lock()
+    
+    def get_cache(self):
+        if settings.ORCHESTRATION_ROUTE_CACHE:
+            return caches[settings.ORCHESTRATION_ROUTE_CACHE]
+        return None
+    
+    def get_shared_version(self):
+        cache = self.get_cache()
+        if cache is None:
+            return None
+        version = cache.get(self.VERSION_KEY)
+        if version is None:
+            version = time.time()
+            cache.add(self.VERSION_KEY, version, None)
+            version = cache.get(self.VERSION_KEY, version)
+        return version
+    
+    def is_stale(self):
+        if self.table is None:
+            return True
+        now = time.time()
+        if now-self.last_check > self.check_interval:
+            self.last_check = now
+            return self.get_shared_version() != self.version
+        return False
+    
+    def get(self):
+        with self.lock:
+            if self.pending:
+                pending = [
+                    (connection, callback) for connection, callback in self.pending
+                        if any(func is callback for __, func in connection.run_on_commit)
+                ]
+                if len(pending) < len(self.pending):
+                    # Committed or rolled back
+                    self.pending = pending
+                    self.table = None
+                current = transaction.get_connection()
+                if any(connection is current for connection, __ in pending):
+                    self.misses += 1
+                    return Route.objects.get_cache({})
+            if self.is_stale():
+                self.misses += 1
+                self.version = self.get_shared_version()
+                self.last_check = time.time()
+                self.table = Route.objects.get_cache({})
+                logger.debug("Route table loaded (%i keys)" % len(self.table))
+            else:
+                self.hits += 1
+            return self.table
+    
+    def invalidate(self, shared=True):
+        with self.lock:
+            self.table = None
+        if shared:
+            cache = self.get_cache()
+            if cache is not None:
+                cache.set(self.VERSION_KEY, time.time(), None)
+    
+    def invalidate_on_commit(self):
+        """ invalidates the table, and the other workers' ones once the transaction commits """
+        connection = transaction.get_connection()
+        if not connection.in_atomic_block:
+            self.invalidate()
+            return
+        
+        def commit():
+            self.invalidate()
+        
+        with self.lock:
+            self.table = None
+            self.pending.append((connection, commit))
+        # Other workers should not reload the table before the change is visible to them
+        connection.on_commit(commit)
+    
+    def get_stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'loaded': self.table is not None,
+        }
+
+
+route_table = RouteTable()
+
+
+@receiver(post_save, sender=Route, dispatch_uid='orchestration.route_table.route_save')
+@receiver(post_delete, sender=Route, dispatch_uid='orchestration.route_table.route_delete')
+@receiver(post_save, sender=Server, dispatch_uid='orchestration.route_table.server_save')
+@receiver(post_delete, sender=Server, dispatch_uid='orchestration.route_table.server_delete')
+def invalidate_route_table(sender, *args, **kwargs):
+    route_table.invalidate_on_commit()
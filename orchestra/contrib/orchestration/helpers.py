@@ -58,13 +58,15 @@ def get_instance_url(operation):
     return orchestra_settings.ORCHESTRA_SITE_URL + url
 
 
-def send_report(method, args, log):
+def send_report(method, args, log, operations=None):
     server = args[0]
     backend = method.__self__.__class__.__name__
     subject = '[Orchestra] %s execution %s on %s'  % (backend, log.state, server)
     separator = "\n%s\n\n" % ('~ '*40,)
+    if operations is None:
+        operations = log.operations.all()
     operations = '\n'.join(
-        [' '.join((op.action, get_instance_url(op))) for op in log.operations.all()]
+        [' '.join((op.action, get_instance_url(op))) for op in operations]
     )
     log_url = reverse('admin:orchestration_backendlog_change', args=(log.pk,))
     log_url = orchestra_settings.ORCHESTRA_SITE_URL + log_url
@@ -67,10 +67,9 @@ class Command(BaseCommand):
             querysets = [queryset]
         
         operations = OrderedSet()
-        route_cache = {}
         for queryset in querysets:
             for instance in queryset:
-                manager.collect(instance, action, operations=operations, route_cache=route_cache)
+                manager.collect(instance, action, operations=operations)
         if backends:
             result = []
             for operation in operations:
@@ -117,18 +116,19 @@ class Command(BaseCommand):
         if not dry:
             logs = manager.execute(scripts, serialize=serialize, async=True)
             running = list(logs)
-            stdout = 0
-            stderr = 0
+            # Offsets already written for each log stream
+            stdout = {log: 0 for log in logs}
+            stderr = {log: 0 for log in logs}
             while running:
-                for log in running:
-                    cstdout = len(log.stdout)
-                    cstderr = len(log.stderr)
-                    if cstdout > stdout:
-                        self.stdout.write(log.stdout[stdout:])
-                        stdout = cstdout
-                    if cstderr > stderr:
-                        self.stderr.write(log.stderr[stderr:])
-                        stderr = cstderr
+                for log in list(running):
+                    cstdout = log.get_stdout()
+                    cstderr = log.get_stderr()
+                    if len(cstdout) > stdout[log]:
+                        self.stdout.write(cstdout[stdout[log]:])
+                        stdout[log] = len(cstdout)
+                    if len(cstderr) > stderr[log]:
+                        self.stderr.write(cstderr[stderr[log]:])
+                        stderr[log] = len(cstderr)
                     if log.has_finished:
                         running.remove(log)
                     time.sleep(0.05)
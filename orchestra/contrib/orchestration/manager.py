@@ -1,7 +1,7 @@
 import logging
-import threading
 import traceback
 from collections import OrderedDict
+from concurrent import futures
 
 from django.core.mail import mail_admins
 
@@ -12,6 +12,7 @@ from . import settings, Operation
 from .backends import ServiceBackend
 from .helpers import send_report
 from .models import BackendLog
+from .pool import pool
 from .signals import pre_action, post_action, pre_commit, post_commit, pre_prepare, post_prepare
 
 
@@ -38,12 +39,12 @@ def keep_log(execute, log, operations):
             mail_admins(subject, trace)
             # We don't propagate the exception further to avoid transaction rollback
         finally:
-            # Store and log the operation
+            # Store and log the operations
             for operation in operations:
                 logger.info("Executed %s" % operation)
-                operation.store(log)
+            backend_operations = Operation.store_all(operations, log)
             if not log.is_success:
-                send_report(execute, args, log)
+                send_report(execute, args, log, operations=backend_operations)
             stdout = log.stdout.strip()
             stdout and logger.debug('STDOUT %s', stdout.encode('ascii', errors='replace').decode())
             stderr = log.stderr.strip()
@@ -53,13 +54,15 @@ def keep_log(execute, log, operations):
 
 def generate(operations):
     scripts = OrderedDict()
-    cache = {}
     serialize = False
+    # Resolve pending routes in bulk
+    pending = [operation for operation in operations if operation.routes is None]
+    if pending:
+        for operation, routes in router.objects.get_for_operations(pending).items():
+            operation.routes = routes
     # Generate scripts per route+backend
     for operation in operations:
         logger.debug("Queued %s" % operation)
-        if operation.routes is None:
-            operation.routes = router.objects.get_for_operation(operation, cache=cache)
         for route in operation.routes:
             # TODO key by action.async
             async_action = route.action_is_async(operation.action)
@@ -108,8 +111,7 @@ def execute(scripts, serialize=False, async=None):
         logger.info('Orchestration execution is dissabled by ORCHESTRATION_DISABLE_EXECUTION.')
         return []
     # Execute scripts on each server
-    executions = []
-    threads_to_join = []
+    futures_to_join = []
     logs = []
     for key, value in scripts.items():
         route, __, async_action = key
@@ -133,28 +135,29 @@ def execute(scripts, serialize=False, async=None):
             # Execute one backend at a time, no need for threads
             task(*args, **kwargs)
         else:
+            # Queued on the server's bounded worker pool instead of a new thread per script
             task = db.close_connection(task)
-            thread = threading.Thread(target=task, args=args, kwargs=kwargs)
-            thread.start()
+            future = pool.submit(route.host, task, *args, **kwargs)
             if not is_async:
-                threads_to_join.append(thread)
+                futures_to_join.append(future)
         logs.append(log)
-    [ thread.join() for thread in threads_to_join ]
+    # Only wait for the routes that are not async
+    futures.wait(futures_to_join)
     return logs
 
 
 def collect(instance, action, **kwargs):
     """ collect operations """
     operations = kwargs.get('operations', OrderedSet())
-    route_cache = kwargs.get('route_cache', {})
-    for backend_cls in ServiceBackend.get_backends():
+    route_cache = kwargs.get('route_cache')
+    for backend_cls, accessor in ServiceBackend.get_model_backends(type(instance)):
         # Check if there exists a related instance to be executed for this backend and action
         instances = []
         if action in backend_cls.actions:
-            if backend_cls.is_main(instance):
+            if accessor is None:
                 instances = [(instance, action)]
             else:
-                for candidate in backend_cls.get_related(instance):
+                for candidate in backend_cls.get_related_by_accessor(instance, accessor):
                     if candidate.__class__.__name__ == 'ManyRelatedManager':
                         if 'pk_set' in kwargs:
                             # m2m_changed signal
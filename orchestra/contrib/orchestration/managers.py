@@ -9,20 +9,25 @@ from django.utils.decorators import ContextDecorator
 from orchestra.utils.python import OrderedSet
 
 from . import manager, Operation, helpers
+from .backends import ServiceBackend
 from .middlewares import OperationsMiddleware
-from .models import BackendLog, BackendOperation
+from .models import BackendLog, BackendLogChunk, BackendOperation
 
 
 @receiver(post_save, dispatch_uid='orchestration.post_save_manager_collector')
 def post_save_collector(sender, *args, **kwargs):
-    if sender not in (BackendLog, BackendOperation, LogEntry):
+    # Models without backends are discarded right away
+    if (sender not in (BackendLog, BackendLogChunk, BackendOperation, LogEntry) and
+            ServiceBackend.get_model_backends(sender)):
         instance = kwargs.get('instance')
         orchestrate.collect(Operation.SAVE, **kwargs)
 
 
 @receiver(pre_delete, dispatch_uid='orchestration.pre_delete_manager_collector')
 def pre_delete_collector(sender, *args, **kwargs):
-    if sender not in (BackendLog, BackendOperation, LogEntry):
+    # Models without backends are discarded right away
+    if (sender not in (BackendLog, BackendLogChunk, BackendOperation, LogEntry) and
+            ServiceBackend.get_model_backends(sender)):
         orchestrate.collect(Operation.DELETE, **kwargs)
 
 
@@ -45,7 +50,6 @@ class orchestrate(ContextDecorator):
     """
     thread_locals = local()
     thread_locals.pending_operations = None
-    thread_locals.route_cache = None
     
     @classmethod
     def collect(cls, action, **kwargs):
@@ -54,7 +58,6 @@ class orchestrate(ContextDecorator):
             # No active orchestrate context manager
             return
         kwargs['operations'] = cls.thread_locals.pending_operations
-        kwargs['route_cache'] = cls.thread_locals.route_cache
         instance = kwargs.pop('instance')
         manager.collect(instance, action, **kwargs)
     
@@ -62,8 +65,6 @@ class orchestrate(ContextDecorator):
         cls = type(self)
         self.old_pending_operations = cls.thread_locals.pending_operations
         cls.thread_locals.pending_operations = OrderedSet()
-        self.old_route_cache = cls.thread_locals.route_cache
-        cls.thread_locals.route_cache = {}
     
     def __exit__(self, exc_type, exc_value, traceback):
         cls = type(self)
@@ -78,4 +79,3 @@ class orchestrate(ContextDecorator):
                     else:
                         sys.stdout.write('%s: %s\n' % (t, msg))
         cls.thread_locals.pending_operations = self.old_pending_operations
-        cls.thread_locals.route_cache = self.old_route_cache
@@ -1,9 +1,11 @@
+import asyncio
 import inspect
 import logging
 import socket
 import sys
 import select
 import textwrap
+from concurrent import futures
 
 from celery.datastructures import ExceptionInfo
 
@@ -22,6 +24,7 @@ def Paramiko(backend, log, server, cmds, async=False, paramiko_connections={}):
     Executes cmds to remote server using Pramaiko
     """
     import paramiko
+    from .streams import LogStream
     script = '\n'.join(cmds)
     script = script.replace('\r', '')
     log.state = log.STARTED
@@ -31,6 +34,7 @@ def Paramiko(backend, log, server, cmds, async=False, paramiko_connections={}):
         return
     channel = None
     ssh = None
+    stream = None
     try:
         addr = server.get_address()
         # ssh connection
@@ -56,6 +60,7 @@ def Paramiko(backend, log, server, cmds, async=False, paramiko_connections={}):
         # Log results
         logger.debug('%s running on %s' % (backend, server))
         if async:
+            stream = LogStream(log)
             second = False
             while True:
                 # Non-blocking is the secret ingridient in the async sauce
@@ -63,14 +68,14 @@ def Paramiko(backend, log, server, cmds, async=False, paramiko_connections={}):
                 if channel.recv_ready():
                     part = channel.recv(1024).decode('utf-8')
                     while part:
-                        log.stdout += part
+                        stream.write(stdout=part)
                         part = channel.recv(1024).decode('utf-8')
                 if channel.recv_stderr_ready():
                     part = channel.recv_stderr(1024).decode('utf-8')
                     while part:
-                        log.stderr += part
+                        stream.write(stderr=part)
                         part = channel.recv_stderr(1024).decode('utf-8')
-                log.save(update_fields=('stdout', 'stderr', 'updated_at'))
+                stream.flush()
                 if channel.exit_status_ready():
                     if second:
                         break
@@ -95,12 +100,15 @@ def Paramiko(backend, log, server, cmds, async=False, paramiko_connections={}):
             log.save(update_fields=('state', 'updated_at'))
         if channel is not None:
             channel.close()
+        if stream is not None:
+            stream.close()
 
 
 def OpenSSH(backend, log, server, cmds, async=False):
     """
     Executes cmds to remote server using SSH with connection resuse for maximum performance
     """
+    from .streams import LogStream
     script = '\n'.join(cmds)
     script = script.replace('\r', '')
     log.state = log.STARTED
@@ -108,15 +116,15 @@ def OpenSSH(backend, log, server, cmds, async=False):
     log.save(update_fields=('script', 'state', 'updated_at'))
     if not cmds:
         return
+    stream = LogStream(log)
     try:
         ssh = sshrun(server.get_address(), script, executable=backend.script_executable,
             persist=True, async=async, silent=True)
         logger.debug('%s running on %s' % (backend, server))
         if async:
             for state in ssh:
-                log.stdout += state.stdout.decode('utf8')
-                log.stderr += state.stderr.decode('utf8')
-                log.save(update_fields=('stdout', 'stderr', 'updated_at'))
+                stream.write(state.stdout.decode('utf8'), state.stderr.decode('utf8'))
+                stream.flush()
             exit_code = state.exit_code
         else:
             log.stdout += ssh.stdout.decode('utf8')
@@ -140,6 +148,59 @@ def OpenSSH(backend, log, server, cmds, async=False):
         if log.state == log.STARTED:
             log.state = log.ABORTED
             log.save(update_fields=('state', 'updated_at'))
+        stream.close()
+
+
+def AsyncSSH(backend, log, server, cmds, async=False):
+    """
+    Executes cmds to remote server using asyncssh.
+    All executions share the same event loop and connection pool, no thread or process per script.
+    """
+    from . import aio
+    from .streams import LogStream
+    script = '\n'.join(cmds)
+    script = script.replace('\r', '')
+    log.state = log.STARTED
+    log.script = '\n'.join((log.script, script))
+    log.save(update_fields=('script', 'state', 'updated_at'))
+    if not cmds:
+        return
+    addr = server.get_address()
+    stream = LogStream(log)
+    try:
+        future = aio.submit(addr, script, stream, executable=backend.script_executable)
+        logger.debug('%s running on %s' % (backend, server))
+        while True:
+            try:
+                # The event loop only writes to the stream, database access is done here
+                exit_code = future.result(timeout=1 if async else None)
+            except futures.TimeoutError:
+                if future.done():
+                    # per-host timeout raised by the event loop
+                    raise
+                stream.flush()
+            else:
+                break
+        log.exit_code = exit_code
+        log.state = log.SUCCESS if exit_code == 0 else log.FAILURE
+        logger.debug('%s execution state on %s is %s' % (backend, server, log.state))
+        log.save()
+    except (asyncio.TimeoutError, socket.error) as e:
+        logger.error('%s timed out on %s' % (backend, addr))
+        log.state = log.TIMEOUT
+        log.stderr += str(e) or 'Execution timed out after %ss' % aio.get_timeout(addr)
+        log.save()
+    except:
+        log.state = log.ERROR
+        log.traceback = ExceptionInfo(sys.exc_info()).traceback
+        logger.error('Exception while executing %s on %s' % (backend, server))
+        logger.debug(log.traceback)
+        log.save()
+    finally:
+        if log.state == log.STARTED:
+            log.state = log.ABORTED
+            log.save(update_fields=('state', 'updated_at'))
+        stream.close()
 
 
 def SSH(*args, **kwargs):
@@ -149,6 +210,7 @@ def SSH(*args, **kwargs):
 
 
 def Python(backend, log, server, cmds, async=False):
+    from .streams import LogStream
     script = ''
     functions = set()
     for cmd in cmds:
@@ -162,16 +224,17 @@ def Python(backend, log, server, cmds, async=False):
     log.script = '\n'.join((log.script, script))
     log.save(update_fields=('script', 'state', 'updated_at'))
     stdout = ''
+    stream = LogStream(log)
     try:
         for cmd in cmds:
             with CaptureStdout() as stdout:
                 result = cmd(server)
             for line in stdout:
-                log.stdout += line + '\n'
+                stream.write(line + '\n')
             if result:
-                log.stdout += '# Result: %s\n' % result
+                stream.write('# Result: %s\n' % result)
             if async:
-                log.save(update_fields=('stdout', 'updated_at'))
+                stream.flush()
     except:
         log.exit_code = 1
         log.state = log.FAILURE
@@ -184,3 +247,4 @@ def Python(backend, log, server, cmds, async=False):
             log.state = log.SUCCESS
         logger.debug('%s execution state on %s is %s' % (backend, server, log.state))
     log.save()
+    stream.close()
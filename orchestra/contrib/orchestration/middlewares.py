@@ -10,20 +10,25 @@ from django.http.response import HttpResponseServerError
 from orchestra.utils.python import OrderedSet
 
 from . import manager, Operation
+from .backends import ServiceBackend
 from .helpers import message_user
-from .models import BackendLog, BackendOperation
+from .models import BackendLog, BackendLogChunk, BackendOperation
 
 
 @receiver(post_save, dispatch_uid='orchestration.post_save_collector')
 def post_save_collector(sender, *args, **kwargs):
-    if sender not in (BackendLog, BackendOperation, LogEntry):
+    # Models without backends are discarded right away
+    if (sender not in (BackendLog, BackendLogChunk, BackendOperation, LogEntry) and
+            ServiceBackend.get_model_backends(sender)):
         instance = kwargs.get('instance')
         OperationsMiddleware.collect(Operation.SAVE, **kwargs)
 
 
 @receiver(pre_delete, dispatch_uid='orchestration.pre_delete_collector')
 def pre_delete_collector(sender, *args, **kwargs):
-    if sender not in (BackendLog, BackendOperation, LogEntry):
+    # Models without backends are discarded right away
+    if (sender not in (BackendLog, BackendLogChunk, BackendOperation, LogEntry) and
+            ServiceBackend.get_model_backends(sender)):
         OperationsMiddleware.collect(Operation.DELETE, **kwargs)
 
 
@@ -55,16 +60,6 @@ class OperationsMiddleware(object):
             return request.pending_operations
         return set()
     
-    @classmethod
-    def get_route_cache(cls):
-        """ chache the routes to save sql queries """
-        if hasattr(cls.thread_locals, 'request'):
-            request = cls.thread_locals.request
-            if not hasattr(request, 'route_cache'):
-                request.route_cache = {}
-            return request.route_cache
-        return {}
-    
     @classmethod
     def collect(cls, action, **kwargs):
         """ Collects all pending operations derived from model signals """
@@ -72,7 +67,6 @@ class OperationsMiddleware(object):
         if request is None:
             return
         kwargs['operations'] = cls.get_pending_operations()
-        kwargs['route_cache'] = cls.get_route_cache()
         instance = kwargs.pop('instance')
         manager.collect(instance, action, **kwargs)
     
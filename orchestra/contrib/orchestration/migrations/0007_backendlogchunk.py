@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orchestration', '0006_auto_20160219_1110'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackendLogChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stream', models.CharField(choices=[('stdout', 'stdout'), ('stderr', 'stderr')], max_length=6, verbose_name='stream')),
+                ('content', models.TextField(verbose_name='content')),
+                ('log', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='orchestration.BackendLog')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
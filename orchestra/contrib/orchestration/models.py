@@ -1,5 +1,6 @@
 import logging
 import socket
+from collections import OrderedDict
 
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
@@ -121,6 +122,44 @@ class BackendLog(models.Model):
     
     def backend_class(self):
         return ServiceBackend.get_backend(self.backend)
+    
+    def get_output(self, stream):
+        """
+        Full stream text, built from the appended chunks while the execution is running
+        """
+        content = getattr(self, stream)
+        if content or self.has_finished:
+            return content
+        return ''.join(self.chunks.filter(stream=stream).values_list('content', flat=True))
+    
+    def get_stdout(self):
+        return self.get_output(BackendLogChunk.STDOUT)
+    
+    def get_stderr(self):
+        return self.get_output(BackendLogChunk.STDERR)
+
+
+class BackendLogChunk(models.Model):
+    """
+    Output appended by a running execution, avoids rewritting the whole log on every update
+    """
+    STDOUT = 'stdout'
+    STDERR = 'stderr'
+    
+    STREAMS = (
+        (STDOUT, STDOUT),
+        (STDERR, STDERR),
+    )
+    
+    log = models.ForeignKey(BackendLog, related_name='chunks')
+    stream = models.CharField(_("stream"), max_length=6, choices=STREAMS)
+    content = models.TextField(_("content"))
+    
+    class Meta:
+        ordering = ('id',)
+    
+    def __str__(self):
+        return '%s %s' % (self.log, self.stream)
 
 
 class BackendOperationQuerySet(models.QuerySet):
@@ -164,8 +203,14 @@ autodiscover_modules('backends')
 
 
 class RouteQuerySet(models.QuerySet):
-    def get_for_operation(self, operation, **kwargs):
-        cache = kwargs.get('cache', {})
+    def get_cache(self, cache=None):
+        """
+        fills cache with (backend, action) -> [routes]
+        the process-wide route table is used when no cache is provided
+        """
+        if cache is None:
+            from .caches import route_table
+            return route_table.get()
         if not cache:
             for route in self.filter(is_active=True).select_related('host'):
                 try:
@@ -179,6 +224,10 @@ class RouteQuerySet(models.QuerySet):
                             cache[key].append(route)
                         except KeyError:
                             cache[key] = [route]
+        return cache
+    
+    def get_for_operation(self, operation, **kwargs):
+        cache = self.get_cache(kwargs.get('cache'))
         routes = []
         backend_cls = operation.backend
         key = (backend_cls.get_name(), operation.action)
@@ -191,6 +240,28 @@ class RouteQuerySet(models.QuerySet):
                 if route.matches(operation.instance):
                     routes.append(route)
         return routes
+    
+    def get_for_operations(self, operations, **kwargs):
+        """
+        Bulk version of get_for_operation(), returns {operation: [routes]}
+        Operations are grouped by (backend, action) and each route expression is evaluated
+        once per group
+        """
+        cache = self.get_cache(kwargs.get('cache'))
+        groups = OrderedDict()
+        for operation in operations:
+            key = (operation.backend.get_name(), operation.action)
+            groups.setdefault(key, []).append(operation)
+        result = OrderedDict()
+        for key, group in groups.items():
+            for operation in group:
+                result[operation] = []
+            for route in cache.get(key, []):
+                matches = route.matches
+                for operation in group:
+                    if matches(operation.instance):
+                        result[operation].append(route)
+        return result
 
 
 class Route(models.Model):
@@ -245,16 +316,29 @@ class Route(models.Model):
                 name = type(exception).__name__
                 raise ValidationError(': '.join((name, str(exception))))
     
+    def save(self, *args, **kwargs):
+        self._match_code = None
+        super(Route, self).save(*args, **kwargs)
+    
     def action_is_async(self, action):
         return action in self.async_actions
     
+    @property
+    def match_code(self):
+        """ compiled match expression, avoids parsing it for every instance """
+        source, code = getattr(self, '_match_code', None) or (None, None)
+        if source != self.match:
+            code = compile(self.match, '<route %s match>' % self.pk, 'eval')
+            self._match_code = (self.match, code)
+        return code
+    
     def matches(self, instance):
         safe_locals = {
             'instance': instance,
             'obj': instance,
             instance._meta.model_name: instance,
         }
-        return eval(self.match, safe_locals)
+        return eval(self.match_code, safe_locals)
     
     def enable(self):
         self.is_active = True
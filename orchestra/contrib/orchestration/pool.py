@@ -0,0 +1,52 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class ServerPool(object):
+    """
+    Persistent per-server worker pool used for executing backend scripts
+    
+    Each server has its own queue with a bounded number of workers, so bulk operations
+    touching hundreds of objects on the same host do not spawn hundreds of threads and
+    ssh processes. Workers are reused between requests.
+    """
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or settings.ORCHESTRATION_MAX_WORKERS_PER_SERVER
+        self.executors = {}
+        self.lock = threading.Lock()
+    
+    def get_executor(self, server):
+        key = server.pk
+        try:
+            return self.executors[key]
+        except KeyError:
+            pass
+        with self.lock:
+            # double checked, another thread may have created it in the meantime
+            executor = self.executors.get(key)
+            if executor is None:
+                logger.debug("Starting execution pool for %s" % server)
+                executor = ThreadPoolExecutor(max_workers=self.max_workers)
+                self.executors[key] = executor
+            return executor
+    
+    def submit(self, server, task, *args, **kwargs):
+        """ queues task on server's queue, returns a future """
+        executor = self.get_executor(server)
+        return executor.submit(task, *args, **kwargs)
+    
+    def shutdown(self, wait=True):
+        with self.lock:
+            executors = list(self.executors.values())
+            self.executors = {}
+        for executor in executors:
+            executor.shutdown(wait=wait)
+
+
+pool = ServerPool()
@@ -43,9 +43,50 @@ ORCHESTRATION_BACKEND_CLEANUP_DAYS = Setting('ORCHESTRATION_BACKEND_CLEANUP_DAYS
 
 ORCHESTRATION_SSH_METHOD_BACKEND = Setting('ORCHESTRATION_SSH_METHOD_BACKEND',
     'orchestra.contrib.orchestration.methods.OpenSSH',
-    help_text=_("Two methods are provided:<br>"
+    help_text=_("Three methods are provided:<br>"
                 "1) <tt>orchestra.contrib.orchestration.methods.OpenSSH</tt> with ControlPersist.<br>"
                 "2) <tt>orchestra.contrib.orchestration.methods.Paramiko</tt> with connection pool.<br>"
+                "3) <tt>orchestra.contrib.orchestration.methods.AsyncSSH</tt> with a shared event loop "
+                "(requires asyncssh).<br>"
                 "Both perform similarly, but OpenSSH has the advantage that the connections are shared between workers. "
-                "Paramiko, in contrast, has a per worker connection pool.")
+                "Paramiko, in contrast, has a per worker connection pool. "
+                "AsyncSSH scales better when executing on many servers at once.")
+)
+
+
+ORCHESTRATION_SSH_TIMEOUT = Setting('ORCHESTRATION_SSH_TIMEOUT',
+    600,
+    help_text=_("Seconds before an AsyncSSH execution is considered timed out, <tt>None</tt> for no timeout.")
+)
+
+
+ORCHESTRATION_SSH_HOST_TIMEOUTS = Setting('ORCHESTRATION_SSH_HOST_TIMEOUTS',
+    {},
+    help_text=_("Per server address overrides of ORCHESTRATION_SSH_TIMEOUT, "
+                "e.g. <tt>{'10.0.0.2': 3600}</tt>.")
+)
+
+
+ORCHESTRATION_MAX_WORKERS_PER_SERVER = Setting('ORCHESTRATION_MAX_WORKERS_PER_SERVER',
+    4,
+    help_text=_("Maximum number of backend scripts concurrently executed on the same server.")
+)
+
+
+ORCHESTRATION_LOG_FLUSH_INTERVAL = Setting('ORCHESTRATION_LOG_FLUSH_INTERVAL',
+    2,
+    help_text=_("Seconds between writes of the output of running executions to the database.")
+)
+
+
+ORCHESTRATION_LOG_FLUSH_SIZE = Setting('ORCHESTRATION_LOG_FLUSH_SIZE',
+    64*1024,
+    help_text=_("Buffered output size (in characters) that forces a write before the flush interval.")
+)
+
+
+ORCHESTRATION_ROUTE_CACHE = Setting('ORCHESTRATION_ROUTE_CACHE',
+    '',
+    help_text=_("Django cache alias used for keeping the route table consistent between workers, "
+                "e.g. <tt>'default'</tt>. Leave it blank when running a single process.")
 )
@@ -0,0 +1,66 @@
+import threading
+import time
+
+from . import settings
+from .models import BackendLogChunk
+
+
+class LogStream(object):
+    """
+    Buffers the output of a running execution and persists it as appended chunks
+    
+    log.stdout and log.stderr are kept up to date in memory, the database only receives
+    the new output every ORCHESTRATION_LOG_FLUSH_INTERVAL seconds or when
+    ORCHESTRATION_LOG_FLUSH_SIZE is exceeded. The full text is written once by the final log.save()
+    """
+    def __init__(self, log, interval=None, size=None):
+        self.log = log
+        self.interval = settings.ORCHESTRATION_LOG_FLUSH_INTERVAL if interval is None else interval
+        self.size = settings.ORCHESTRATION_LOG_FLUSH_SIZE if size is None else size
+        self.pending = {
+            BackendLogChunk.STDOUT: [],
+            BackendLogChunk.STDERR: [],
+        }
+        self.pending_size = 0
+        self.last_flush = time.time()
+        self.flushed = False
+        # write() may be called from another thread, i.e. AsyncSSH event loop
+        self.lock = threading.Lock()
+    
+    def write(self, stdout='', stderr=''):
+        """ appends output, only in memory """
+        with self.lock:
+            if stdout:
+                self.log.stdout += stdout
+                self.pending[BackendLogChunk.STDOUT].append(stdout)
+                self.pending_size += len(stdout)
+            if stderr:
+                self.log.stderr += stderr
+                self.pending[BackendLogChunk.STDERR].append(stderr)
+                self.pending_size += len(stderr)
+    
+    def flush(self, force=False):
+        """ stores pending output as new chunks when the thresholds are reached """
+        with self.lock:
+            if not self.pending_size:
+                return
+            if not force and (self.pending_size < self.size and
+                    time.time()-self.last_flush < self.interval):
+                return
+            chunks = []
+            for stream, parts in self.pending.items():
+                if parts:
+                    chunks.append(
+                        BackendLogChunk(log=self.log, stream=stream, content=''.join(parts))
+                    )
+                    self.pending[stream] = []
+            self.pending_size = 0
+            self.last_flush = time.time()
+        BackendLogChunk.objects.using(self.log._state.db).bulk_create(chunks)
+        self.flushed = True
+    
+    def close(self):
+        """ call once the full output has been saved on the log """
+        if self.flushed:
+            BackendLogChunk.objects.using(self.log._state.db).filter(log=self.log).delete()
+            self.flushed = False
@@ -0,0 +1,139 @@
+"""
+Execution method benchmarks using a fake SSH transport
+
+    DJANGO_SETTINGS_MODULE=panel.settings python -m orchestra.contrib.orchestration.tests.benchmarks
+"""
+import asyncio
+import threading
+import time
+
+from orchestra.utils.python import AttrDict
+
+
+class FakeStream(object):
+    def __init__(self, lines, latency):
+        self.lines = list(lines)
+        self.latency = latency
+    
+    @asyncio.coroutine
+    def read(self, n):
+        if not self.lines:
+            return ''
+        yield from asyncio.sleep(self.latency)
+        return self.lines.pop(0)
+
+
+class FakeProcess(object):
+    """ Emulates a remote script printing some lines with network latency """
+    def __init__(self, lines, latency):
+        self.stdin = AttrDict(write=lambda data: None, write_eof=lambda: None)
+        self.stdout = FakeStream(lines, latency)
+        self.stderr = FakeStream([], latency)
+        self.exit_status = 0
+    
+    @asyncio.coroutine
+    def wait_closed(self):
+        pass
+    
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    def __init__(self, lines, latency):
+        self.lines = lines
+        self.latency = latency
+    
+    @asyncio.coroutine
+    def create_process(self, executable, **kwargs):
+        return FakeProcess(self.lines, self.latency)
+
+
+class FakePool(object):
+    def __init__(self, lines, latency):
+        self.connection = FakeConnection(lines, latency)
+    
+    @asyncio.coroutine
+    def get(self, addr):
+        return self.connection
+    
+    def discard(self, addr):
+        pass
+
+
+def get_stream():
+    """ LogStream that is never flushed, no database access """
+    from ..streams import LogStream
+    return LogStream(AttrDict(stdout='', stderr=''))
+
+
+def bench_threads(servers, scripts, lines, latency):
+    """ one thread per script blocking on its transport, like OpenSSH or Paramiko """
+    def execute(stream):
+        for line in lines:
+            time.sleep(latency)
+            stream.write(line)
+    threads = []
+    for i in range(servers*scripts):
+        thread = threading.Thread(target=execute, args=(get_stream(),))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return len(threads)
+
+
+def bench_event_loop(servers, scripts, lines, latency):
+    """ all scripts multiplexed on the shared event loop, like AsyncSSH """
+    from .. import aio
+    pool = FakePool(lines, latency)
+    executions = []
+    for server in range(servers):
+        addr = '10.0.0.%i' % server
+        for i in range(scripts):
+            executions.append(aio.submit(addr, 'true', get_stream(), pool=pool, timeout=60))
+    for execution in executions:
+        execution.result()
+    # the shared event loop thread
+    return 1
+
+
+def bench_collect_scan(instance, iterations):
+    """ backend lookup done by collect() on every post_save before the model index """
+    from ..backends import ServiceBackend
+    for i in range(iterations):
+        for backend_cls in ServiceBackend.get_backends():
+            if not backend_cls.is_main(instance):
+                backend_cls.get_related(instance)
+
+
+def bench_collect_index(instance, iterations):
+    from ..backends import ServiceBackend
+    for i in range(iterations):
+        ServiceBackend.get_model_backends(type(instance))
+
+
+def run_collect(iterations=10000):
+    """ signal overhead for a model without backends """
+    from ..models import Server
+    instance = Server(name='benchmark')
+    for bench in (bench_collect_scan, bench_collect_index):
+        start = time.time()
+        bench(instance, iterations)
+        print('%s: %i signals in %.4fs' % (bench.__name__, iterations, time.time()-start))
+
+
+def run(servers=100, scripts=4, lines=20, latency=0.01):
+    lines = ['line %i\n' % i for i in range(lines)]
+    for bench in (bench_threads, bench_event_loop):
+        start = time.time()
+        threads = bench(servers, scripts, lines, latency)
+        print('%s: %i servers x %i scripts in %.2fs using %i threads' % (
+            bench.__name__, servers, scripts, time.time()-start, threads))
+    run_collect()
+
+
+if __name__ == '__main__':
+    import django
+    django.setup()
+    run()
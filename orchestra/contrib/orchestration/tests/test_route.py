@@ -1,11 +1,15 @@
+from django.db import transaction
+
 from orchestra.utils.tests import BaseTestCase
 
 from .. import backends, Operation
+from ..caches import route_table
 from ..models import Route, Server
 
 
 class RouterTests(BaseTestCase):
     def setUp(self):
+        route_table.invalidate(shared=False)
         self.host = Server.objects.create(name='web.example.com')
         self.host1 = Server.objects.create(name='web1.example.com')
         self.host2 = Server.objects.create(name='web2.example.com')
@@ -39,3 +43,64 @@ class RouterTests(BaseTestCase):
         route = Route.objects.create(backend=backend, host=self.host2,
                 match='route.backend == "something else"')
         self.assertEqual(2, len(Route.objects.get_for_operation(operation)))
+    
+    def test_route_table_rollback(self):
+        
+        class TestBackend(backends.ServiceController):
+            verbose_name = 'Route'
+            models = ['routes.Route']
+            
+            def save(self, instance):
+                pass
+        
+        choices = backends.ServiceBackend.get_choices()
+        Route._meta.get_field('backend')._choices = choices
+        backend = TestBackend.get_name()
+        
+        pending = len(route_table.pending)
+        with self.assertRaises(ZeroDivisionError):
+            with transaction.atomic():
+                Route.objects.create(backend=backend, host=self.host, match='True')
+                self.assertIn((backend, 'save'), route_table.get())
+                self.assertEqual(pending+1, len(route_table.pending))
+                1/0
+        self.assertNotIn((backend, 'save'), route_table.get())
+        self.assertEqual(pending, len(route_table.pending))
+    
+    def test_get_for_operations(self):
+        
+        class TestBackend(backends.ServiceController):
+            verbose_name = 'Route'
+            models = ['routes.Route']
+            
+            def save(self, instance):
+                pass
+        
+        choices = backends.ServiceBackend.get_choices()
+        Route._meta.get_field('backend')._choices = choices
+        backend = TestBackend.get_name()
+        
+        route = Route.objects.create(backend=backend, host=self.host, match='True')
+        route1 = Route.objects.create(backend=backend, host=self.host1,
+                match='route.host.name == "web1.example.com"')
+        operations = [
+            Operation(backend=TestBackend, instance=route, action='save'),
+            Operation(backend=TestBackend, instance=route1, action='save'),
+            Operation(backend=TestBackend, instance=route, action='delete'),
+        ]
+        routes = Route.objects.get_for_operations(operations)
+        self.assertEqual([route], routes[operations[0]])
+        self.assertEqual([route, route1], routes[operations[1]])
+        # TestBackend does not implement delete
+        self.assertEqual([], routes[operations[2]])
+        for operation in operations:
+            self.assertEqual(routes[operation], Route.objects.get_for_operation(operation))
+    
+    def test_match_code(self):
+        route = Route(backend='TestBackend', host=self.host, match='True')
+        code = route.match_code
+        self.assertIs(code, route.match_code)
+        self.assertTrue(route.matches(self.host))
+        route.match = 'False'
+        self.assertIsNot(code, route.match_code)
+        self.assertFalse(route.matches(self.host))
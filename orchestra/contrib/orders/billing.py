@@ -1,69 +1,116 @@
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
-from orchestra.contrib.bills.models import Invoice, Fee, ProForma
+from orchestra.contrib.bills.models import Bill, Invoice, Fee, ProForma, BillLine, BillSubline
+from orchestra.models.utils import bulk_create
 
 
 class BillsBackend(object):
     def create_bills(self, account, lines, **options):
-        bill = None
-        ant_bill = None
-        bills = []
+        return self.bulk_create_bills([(account, lines)], **options)
+    
+    def get_open_bills(self, bill_class, accounts):
+        """ last open bill of each account, {account_id: bill} """
+        open_bills = {}
+        queryset = bill_class.objects.filter(account__in=accounts, is_open=True).order_by('id')
+        for bill in queryset:
+            open_bills[bill.account_id] = bill
+        return open_bills
+    
+    def bulk_create_bills(self, account_lines, **options):
+        """
+        Creates the bills of [(account, lines)], open bills are fetched with one query and
+        bill lines and sublines are inserted in bulk.
+        
+        With dry_run nothing is written: returns unsaved bills (or the current open ones) with
+        their unsaved lines on bill.new_lines and the line sublines on line.new_sublines
+        """
         create_new = options.get('new_open', False)
         proforma = options.get('proforma', False)
-        for line in lines:
-            quantity = line.metric*line.size
-            if quantity == 0:
-                continue
-            service = line.order.service
-            # Create bill if needed
-            if proforma:
-                if ant_bill is None:
-                    if create_new:
-                        bill = ProForma.objects.create(account=account)
-                    else:
-                        bill = ProForma.objects.filter(account=account, is_open=True).last()
-                        if bill:
-                            bill.updated()
-                        else:
-                            bill = ProForma.objects.create(account=account, is_open=True)
-                    bills.append(bill)
-                else:
-                    bill = ant_bill
-                ant_bill = bill
-            elif service.is_fee:
-                bill = Fee.objects.create(account=account)
-                bills.append(bill)
-            else:
-                if ant_bill is None:
-                    if create_new:
-                        bill = Invoice.objects.create(account=account)
-                    else:
-                        bill = Invoice.objects.filter(account=account, is_open=True).last()
-                        if bill:
-                            bill.updated()
-                        else:
-                            bill = Invoice.objects.create(account=account, is_open=True)
-                    bills.append(bill)
+        dry_run = options.get('dry_run', False)
+        bill_class = ProForma if proforma else Invoice
+        open_bills = {}
+        if not create_new:
+            accounts = [account for account, lines in account_lines]
+            open_bills = self.get_open_bills(bill_class, accounts)
+        bills = []
+        for account, lines in account_lines:
+            bill = None
+            for line in lines:
+                quantity = line.metric*line.size
+                if quantity == 0:
+                    continue
+                service = line.order.service
+                # Create bill if needed
+                if not proforma and service.is_fee:
+                    line_bill = Fee(account=account)
+                    line_bill.new_lines = []
+                    bills.append(line_bill)
                 else:
-                    bill = ant_bill
-                ant_bill = bill
-            # Create bill line
-            billine = bill.lines.create(
-                rate=service.nominal_price,
-                quantity=line.metric*line.size,
-                verbose_quantity=self.get_verbose_quantity(line),
-                subtotal=line.subtotal,
-                tax=service.tax,
-                description=self.get_line_description(line),
-                start_on=line.ini,
-                end_on=line.end if service.billing_period != service.NEVER else None,
-                order=line.order,
-                order_billed_on=line.order.old_billed_on,
-                order_billed_until=line.order.old_billed_until
-            )
-            self.create_sublines(billine, line.discounts)
+                    if bill is None:
+                        bill = open_bills.get(account.pk)
+                        if bill is None:
+                            bill = bill_class(account=account)
+                        bill.new_lines = []
+                        bills.append(bill)
+                    line_bill = bill
+                # Create bill line
+                billine = BillLine(
+                    bill=line_bill,
+                    rate=service.nominal_price,
+                    quantity=quantity,
+                    verbose_quantity=self.get_verbose_quantity(line),
+                    subtotal=line.subtotal,
+                    tax=service.tax,
+                    description=self.get_line_description(line),
+                    start_on=line.ini,
+                    end_on=line.end if service.billing_period != service.NEVER else None,
+                    order=line.order,
+                    order_billed_on=line.order.old_billed_on,
+                    order_billed_until=line.order.old_billed_until
+                )
+                billine.new_sublines = self.get_sublines(billine, line.discounts)
+                line_bill.new_lines.append(billine)
+        if not dry_run:
+            self.save_bills(bills)
         return bills
     
+    def save_bills(self, bills):
+        updated = []
+        new_bills = []
+        for bill in bills:
+            if bill.pk:
+                updated.append(bill.pk)
+            else:
+                new_bills.append(bill)
+        numbers = Bill.objects.allocate_numbers(new_bills)
+        for bill, number in zip(new_bills, numbers):
+            bill.number = number
+            bill.save()
+        if updated:
+            now = timezone.now()
+            Bill.objects.filter(pk__in=updated).update(updated_on=now)
+            for bill in bills:
+                if bill.pk in updated:
+                    bill.updated_on = now
+        lines = []
+        for bill in bills:
+            for line in bill.new_lines:
+                line.bill_id = bill.pk
+                lines.append(line)
+        bulk_create(lines)
+        sublines = []
+        for line in lines:
+            for subline in line.new_sublines:
+                subline.line_id = line.pk
+                sublines.append(subline)
+        BillSubline.objects.bulk_create(sublines, batch_size=1000)
+        # bulk_create() sends no pre_save nor post_save of BillLine and BillSubline, skipping
+        # bills.signals update_bill_totals() and update_line_totals(), that recompute the totals
+        # of the bill (done below), and their rollup invalidation, only needed for closed bills.
+        # Receivers added by other apps are not sent either.
+        Bill.objects.filter(pk__in=[bill.pk for bill in bills]).update_totals()
+    
 #    def format_period(self, ini, end):
 #        ini = ini.strftime("%b, %Y")
 #        end = (end-datetime.timedelta(seconds=1)).strftime("%b, %Y")
@@ -87,10 +134,12 @@ class BillsBackend(object):
             return metric
         return "%s&times;%s" % (metric, size)
     
-    def create_sublines(self, line, discounts):
-        for discount in discounts:
-            line.sublines.create(
+    def get_sublines(self, line, discounts):
+        return [
+            BillSubline(
+                line=line,
                 description=_("Discount per %s") % discount.type.lower(),
                 total=discount.total,
                 type=discount.type,
-            )
+            ) for discount in discounts
+        ]
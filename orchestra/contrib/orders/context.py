@@ -0,0 +1,68 @@
+import copy
+
+from django.apps import apps
+
+from . import settings
+
+
+class OrderList(list):
+    """ Preloaded orders providing the OrderQuerySet filters used for billing """
+    # billing state handlers set on the orders of the current run
+    run_attributes = ('new_billed_until', '_compensations')
+    
+    def givers(self, ini, end):
+        return OrderList(
+            order for order in self if (
+                order.cancelled_on is not None and order.billed_until is not None and
+                order.cancelled_on <= order.billed_until and
+                order.billed_until > ini and order.registered_on < end)
+        )
+    
+    def pricing_orders(self, ini, end):
+        """
+        copies of the orders, givers are the same objects and their compensation state
+        should not make them look as if they were being billed
+        """
+        return OrderList(
+            self.copy_order(order) for order in self if (
+                order.billed_until is not None and order.billed_until > ini and
+                order.registered_on < end)
+        )
+    
+    def copy_order(self, order):
+        """ order as stored on the database, like a new query would load it """
+        order = copy.copy(order)
+        for attr in self.run_attributes:
+            order.__dict__.pop(attr, None)
+        return order
+
+
+class BillingContext(object):
+    """
+    Related orders and rates of all the accounts of a billing batch,
+    loaded with a few queries and indexed by (account_id, service_id)
+    """
+    def __init__(self, orders):
+        from .models import Order
+        Service = apps.get_model(settings.ORDERS_SERVICE_MODEL)
+        account_ids = set()
+        service_ids = set()
+        for order in orders:
+            account_ids.add(order.account_id)
+            service_ids.add(order.service_id)
+        self.orders = {}
+        related = Order.objects.filter(account__in=account_ids, service__in=service_ids)
+        for order in related:
+            key = (order.account_id, order.service_id)
+            self.orders.setdefault(key, OrderList()).append(order)
+        Rate = Service._meta.get_field('rates').related_model
+        rates = Rate.objects.filter(service__in=service_ids)
+        self.rates = rates.by_accounts(account_ids)
+    
+    def get_orders(self, account, service):
+        """ account.orders.filter(service=service) """
+        return self.orders.get((account.pk, service.pk), OrderList())
+    
+    def get_rates(self, account, service):
+        """ service.get_rates(account) """
+        return self.rates[(account.pk, service.pk)]
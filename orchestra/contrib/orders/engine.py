@@ -0,0 +1,85 @@
+import logging
+import multiprocessing
+
+from django.db import connection, connections, transaction
+
+from . import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def close_connections():
+    """ forked workers must open their own database connection """
+    connections.close_all()
+
+
+def bill_shard(order_ids, options):
+    """ bills a shard of orders on its own transaction """
+    from .models import Order
+    with transaction.atomic():
+        return Order.objects.filter(id__in=order_ids).bill(**options)
+
+
+class BillingEngine(object):
+    """
+    Bills orders split in shards of accounts
+    
+    Each shard is billed on its own transaction, on a process pool when processes > 1.
+    A crash only rolls back the shards in progress; already billed orders are skipped by the
+    service handlers, so billing the same orders again resumes the run.
+    """
+    def __init__(self, processes=None, shard_size=None):
+        self.processes = processes or settings.ORDERS_BILLING_PROCESSES
+        self.shard_size = shard_size or settings.ORDERS_BILLING_SHARD_SIZE
+    
+    def get_shards(self, queryset):
+        """ order ids grouped by account, shard_size accounts per shard """
+        shards = []
+        shard = []
+        accounts = 0
+        prev_account_id = None
+        orders = queryset.order_by('account_id', 'id').values_list('account_id', 'id')
+        for account_id, order_id in orders:
+            if account_id != prev_account_id:
+                if accounts == self.shard_size:
+                    shards.append(shard)
+                    shard = []
+                    accounts = 0
+                accounts += 1
+                prev_account_id = account_id
+            shard.append(order_id)
+        if shard:
+            shards.append(shard)
+        return shards
+    
+    def run_shards(self, shards, options):
+        processes = min(self.processes, len(shards))
+        if processes > 1 and connection.in_atomic_block:
+            # Workers would not see the data of the ongoing transaction
+            logger.warning("Billing in an atomic block, shards will be billed sequentially.")
+            processes = 1
+        if processes <= 1:
+            return [bill_shard(shard, options) for shard in shards]
+        # Children should not inherit the parent connections
+        close_connections()
+        pool = multiprocessing.Pool(processes, initializer=close_connections)
+        try:
+            return pool.starmap(bill_shard, [(shard, options) for shard in shards])
+        finally:
+            pool.close()
+            pool.join()
+    
+    def bill(self, queryset, **options):
+        """ same as queryset.bill(**options) """
+        if 'related_queryset' in options:
+            # Only used by the admin billing forms, querysets can not be sent to the workers
+            raise ValueError("related_queryset is not supported, add the related orders to queryset.")
+        shards = self.get_shards(queryset)
+        logger.info("Billing %i orders in %i shards" % (sum(map(len, shards)), len(shards)))
+        bills = []
+        for result in self.run_shards(shards, options):
+            bills += result
+        if options.get('commit', True) and not options.get('dry_run', False):
+            return list(set(bills))
+        return bills
@@ -0,0 +1,41 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...engine import BillingEngine
+from ...models import Order
+
+
+class Command(BaseCommand):
+    help = 'Bills pending orders of all accounts using the billing engine.'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, dest='processes',
+            help='Number of billing processes.')
+        parser.add_argument('--shard-size', type=int, dest='shard_size',
+            help='Number of accounts per shard.')
+        parser.add_argument('--billing-point', dest='billing_point',
+            help='Billing point date, YYYY-MM-DD.')
+        parser.add_argument('--fixed-point', action='store_true', dest='fixed_point',
+            default=False, help='Bill until billing point instead of the next billing period.')
+        parser.add_argument('--proforma', action='store_true', dest='proforma', default=False,
+            help='Create proforma bills.')
+        parser.add_argument('--new-open', action='store_true', dest='new_open', default=False,
+            help='Do not reuse open bills.')
+    
+    def handle(self, *args, **options):
+        bill_options = {
+            'fixed_point': options['fixed_point'],
+            'proforma': options['proforma'],
+            'new_open': options['new_open'],
+        }
+        if options['billing_point']:
+            try:
+                bill_options['billing_point'] = datetime.datetime.strptime(
+                    options['billing_point'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError("Invalid billing point '%s'." % options['billing_point'])
+        engine = BillingEngine(processes=options['processes'], shard_size=options['shard_size'])
+        orders = Order.objects.filter(ignore=False)
+        bills = engine.bill(orders, **bill_options)
+        self.stdout.write("%i bills have been created or updated." % len(bills))
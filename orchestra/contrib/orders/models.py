@@ -2,6 +2,7 @@ import datetime
 import decimal
 import logging
 
+from django.conf import settings as djsettings
 from django.db import models
 from django.db.models import F, Q, Sum
 from django.apps import apps
@@ -15,19 +16,37 @@ from orchestra.models import queryset
 from orchestra.utils.python import import_class
 
 from . import settings
+from .context import BillingContext
 
 
 logger = logging.getLogger(__name__)
 
 
+def as_datetime(date):
+    """ same conversion the ORM does when a date is compared against a DateTimeField """
+    if isinstance(date, datetime.datetime):
+        return date
+    date = datetime.datetime(date.year, date.month, date.day)
+    if djsettings.USE_TZ:
+        date = timezone.make_aware(date, timezone.get_default_timezone())
+    return date
+
+
 class OrderQuerySet(models.QuerySet):
     group_by = queryset.group_by
     
     def bill(self, **options):
+        """
+        Bills the orders, commit=False returns [(account, lines)] and dry_run=True
+        the bills that would be created, both without writes
+        """
         bills = []
         bill_backend = Order.get_bill_backend()
-        qs = self.select_related('account', 'service')
+        qs = self.select_related('account', 'service').prefetch_related('metrics')
         commit = options.get('commit', True)
+        dry_run = options.pop('dry_run', False)
+        line_options = dict(options, commit=False) if dry_run else options
+        context = BillingContext(qs)
         for account, services in qs.group_by('account', 'service').items():
             bill_lines = []
             for service, orders in services.items():
@@ -35,16 +54,15 @@ class OrderQuerySet(models.QuerySet):
                     # Saved for undoing support
                     order.old_billed_on = order.billed_on
                     order.old_billed_until = order.billed_until
-                lines = service.handler.generate_bill_lines(orders, account, **options)
+                lines = service.handler.generate_bill_lines(orders, account, context=context,
+                    **line_options)
                 bill_lines.extend(lines)
-            # TODO make this consistent always returning the same fucking types
-            if commit:
-                bills += bill_backend.create_bills(account, bill_lines, **options)
-            else:
-                bills += [(account, bill_lines)]
-        # TODO remove if commit and always return unique elemenets (set()) when the other todo is fixed
-        if commit:
-            return list(set(bills))
+            bills.append((account, bill_lines))
+        # TODO make this consistent always returning the same fucking types
+        if dry_run:
+            return bill_backend.bulk_create_bills(bills, dry_run=True, **options)
+        elif commit:
+            return list(set(bill_backend.bulk_create_bills(bills, **options)))
         return bills
     
     def givers(self, ini, end):
@@ -231,11 +249,19 @@ class Order(models.Model):
         self.save(update_fields=['ignore'])
     
     def get_metric(self, *args, **kwargs):
+        """ prefetched metrics are filtered in python, like when billing """
+        prefetched = 'metrics' in getattr(self, '_prefetched_objects_cache', ())
+        if prefetched:
+            metrics = sorted(self.metrics.all(), key=lambda m: m.id)
         if kwargs.pop('changes', False):
             ini, end = args
+            if prefetched:
+                metrics = (metric for metric in metrics if metric.created_on < end)
+            else:
+                metrics = self.metrics.filter(created_on__lt=end).order_by('id')
             result = []
             prev = None
-            for metric in self.metrics.filter(created_on__lt=end).order_by('id'):
+            for metric in metrics:
                 created = metric.created_on
                 if created > ini:
                     if prev is None:
@@ -253,21 +279,38 @@ class Order(models.Model):
         if len(args) == 2:
             # Slot
             ini, end = args
-            metrics = self.metrics.filter(created_on__lt=end, updated_on__gte=ini)
+            if prefetched:
+                ini = as_datetime(ini)
+                metrics = [
+                    metric for metric in metrics if metric.created_on < end and metric.updated_on >= ini
+                ]
+            else:
+                metrics = self.metrics.filter(created_on__lt=end, updated_on__gte=ini)
         elif len(args) == 1:
             # On effect on date
             date = args[0]
             date = datetime.date(year=date.year, month=date.month, day=date.day)
             date += datetime.timedelta(days=1)
-            metrics = self.metrics.filter(created_on__lte=date)
+            if prefetched:
+                metrics = [metric for metric in metrics if metric.created_on <= date]
+            else:
+                metrics = self.metrics.filter(created_on__lte=date)
         elif not args:
-            return self.metrics.latest('updated_on').value
+            if not prefetched:
+                return self.metrics.latest('updated_on').value
+            if not metrics:
+                raise MetricStorage.DoesNotExist
+            return max(metrics, key=lambda m: m.updated_on).value
         else:
             raise AttributeError
-        try:
-            return metrics.latest('updated_on').value
-        except MetricStorage.DoesNotExist:
+        if not prefetched:
+            try:
+                return metrics.latest('updated_on').value
+            except MetricStorage.DoesNotExist:
+                return decimal.Decimal(0)
+        if not metrics:
             return decimal.Decimal(0)
+        return max(metrics, key=lambda m: m.updated_on).value
 
 
 class MetricStorageQuerySet(models.QuerySet):
@@ -44,3 +44,15 @@ ORDERS_BILLED_METRIC_CLEANUP_DAYS = Setting('ORDERS_BILLED_METRIC_CLEANUP_DAYS',
     40,
     help_text=("Number of days after a billed stored metric is deleted."),
 )
+
+
+ORDERS_BILLING_PROCESSES = Setting('ORDERS_BILLING_PROCESSES',
+    1,
+    help_text="Number of processes used by the billing engine, shards are billed sequentially when 1.",
+)
+
+
+ORDERS_BILLING_SHARD_SIZE = Setting('ORDERS_BILLING_SHARD_SIZE',
+    100,
+    help_text="Number of accounts billed on each billing engine transaction.",
+)
@@ -0,0 +1,329 @@
+import datetime
+from unittest import skipUnless
+
+from dateutil.relativedelta import relativedelta
+from django.db import connection
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from orchestra.contrib.bills.models import Bill, BillLine
+from orchestra.contrib.plans.models import Plan
+from orchestra.contrib.services.models import Service
+from orchestra.contrib.services.tests import test_handler
+from orchestra.contrib.systemusers.models import SystemUser
+from orchestra.utils.tests import random_ascii, AppDependencyMixin, BaseTestCase
+
+from ..context import BillingContext
+from ..engine import BillingEngine, bill_shard
+from ..models import Order
+
+
+class BillingEngineTests(BaseTestCase):
+    """ the engine should produce the same results as OrderQuerySet.bill() """
+    DEPENDENCIES = (
+        'orchestra.contrib.services',
+        'orchestra.contrib.plans',
+        'orchestra.contrib.systemusers',
+    )
+    
+    # Same service the handler tests are run against
+    create_ftp_service = test_handler.HandlerTests.create_ftp_service
+    
+    def create_ftp(self, account):
+        username = '%s_ftp' % random_ascii(10)
+        return SystemUser.objects.create_user(username, account=account)
+    
+    def create_scenario(self):
+        self.create_ftp_service(on_cancel=Service.COMPENSATE)
+        now = timezone.now().date()
+        for num in range(5):
+            account = self.create_account()
+            for ix in range(num+1):
+                self.create_ftp(account)
+            # Orders registered at different dates
+            account.orders.filter(pk=account.orders.last().pk).update(
+                registered_on=now-datetime.timedelta(days=30*num))
+    
+    def create_accounts(self, plans=()):
+        """ accounts with 1, 4 and 12 FTP users registered at different dates """
+        now = timezone.now().date()
+        for num, ftps in enumerate((1, 4, 12)):
+            account = self.create_account()
+            for plan in plans:
+                account.plans.create(plan=plan)
+            for ix in range(ftps):
+                self.create_ftp(account)
+            account.orders.filter(pk=account.orders.last().pk).update(
+                registered_on=now-datetime.timedelta(days=30*num))
+    
+    def create_rates(self, service, plan, rates):
+        for quantity, price in rates:
+            service.rates.create(plan=plan, quantity=quantity, price=price)
+    
+    def assertShardsEqual(self, **options):
+        """ serial and sharded billing previews are the same """
+        bp = timezone.now().date() + relativedelta(years=1)
+        options = dict(billing_point=bp, fixed_point=True, commit=False, **options)
+        serial = self.get_summary(Order.objects.all().bill(**options))
+        self.assertTrue(serial)
+        for shard_size in (1, 2, 10):
+            engine = BillingEngine(processes=1, shard_size=shard_size)
+            sharded = engine.bill(Order.objects.all(), **options)
+            self.assertEqual(serial, self.get_summary(sharded))
+    
+    def get_summary(self, bills):
+        summary = []
+        for account, lines in bills:
+            for line in lines:
+                discounts = sorted((d.type, d.total) for d in line.discounts)
+                summary.append((account.pk, line.order.pk, line.ini, line.end, line.size,
+                    line.metric, line.subtotal, tuple(discounts)))
+        return sorted(summary)
+    
+    def test_preview(self):
+        self.create_scenario()
+        bp = timezone.now().date() + relativedelta(years=1)
+        options = dict(billing_point=bp, fixed_point=True, commit=False)
+        serial = Order.objects.all().bill(**options)
+        for shard_size in (1, 2, 10):
+            engine = BillingEngine(processes=1, shard_size=shard_size)
+            sharded = engine.bill(Order.objects.all(), **options)
+            self.assertEqual(self.get_summary(serial), self.get_summary(sharded))
+    
+    def test_shards(self):
+        self.create_scenario()
+        engine = BillingEngine(processes=1, shard_size=2)
+        shards = engine.get_shards(Order.objects.all())
+        self.assertEqual(3, len(shards))
+        self.assertEqual(Order.objects.count(), sum(map(len, shards)))
+        for shard in shards:
+            accounts = set(Order.objects.filter(id__in=shard).values_list('account_id', flat=True))
+            self.assertLessEqual(len(accounts), 2)
+    
+    def test_commit_and_resume(self):
+        self.create_scenario()
+        bp = timezone.now().date() + relativedelta(years=1)
+        options = dict(billing_point=bp, fixed_point=True)
+        preview = Order.objects.all().bill(commit=False, **options)
+        totals = {
+            account.pk: sum(line.subtotal + sum(d.total for d in line.discounts) for line in lines)
+                for account, lines in preview
+        }
+        engine = BillingEngine(processes=1, shard_size=2)
+        bills = engine.bill(Order.objects.all(), **options)
+        self.assertEqual(5, len(bills))
+        for bill in bills:
+            self.assertEqual(totals[bill.account_id], bill.get_total())
+        # Billing again should not bill already billed orders
+        self.assertEqual([], engine.bill(Order.objects.all(), **options))
+    
+    def test_dry_run(self):
+        self.create_scenario()
+        bp = timezone.now().date() + relativedelta(years=1)
+        options = dict(billing_point=bp, fixed_point=True)
+        billed = list(Order.objects.values_list('id', 'billed_until'))
+        bills = Order.objects.all().bill(dry_run=True, **options)
+        self.assertEqual(5, len(bills))
+        self.assertEqual(0, Bill.objects.count())
+        self.assertEqual(billed, list(Order.objects.values_list('id', 'billed_until')))
+        expected = {}
+        for bill in bills:
+            self.assertIsNone(bill.pk)
+            for line in bill.new_lines:
+                self.assertIsNone(line.pk)
+                total = line.subtotal + sum(subline.total for subline in line.new_sublines)
+                expected[line.order_id] = total
+        bills = Order.objects.all().bill(**options)
+        lines = BillLine.objects.filter(bill__in=bills).prefetch_related('sublines')
+        self.assertEqual(len(expected), len(lines))
+        for line in lines:
+            self.assertIsNotNone(line.pk)
+            self.assertEqual(expected[line.order_id], line.compute_total())
+    
+    def test_save_bills(self):
+        """ lines and sublines created in bulk belong to their bills and lines """
+        self.create_ftp_service(on_cancel=Service.COMPENSATE)
+        self.create_accounts()
+        bp = timezone.now().date() + relativedelta(years=1)
+        Order.objects.all().bill(billing_point=bp, fixed_point=True)
+        for order in Order.objects.order_by('id')[::2]:
+            order.cancel()
+        for account in set(order.account for order in Order.objects.select_related('account')):
+            self.create_ftp(account)
+        options = dict(billing_point=bp+relativedelta(years=1), fixed_point=True)
+        discounts = {}
+        for account, lines in Order.objects.all().bill(commit=False, **options):
+            for line in lines:
+                discounts[line.order.pk] = sorted(discount.total for discount in line.discounts)
+        self.assertTrue(any(discounts.values()))
+        bills = Order.objects.all().bill(**options)
+        self.assertEqual(3, len(set(bill.account_id for bill in bills)))
+        lines = BillLine.objects.filter(bill__in=bills).select_related('bill', 'order')
+        lines = lines.prefetch_related('sublines')
+        self.assertTrue(lines)
+        for line in lines:
+            self.assertEqual(line.order.account_id, line.bill.account_id)
+            sublines = sorted(subline.total for subline in line.sublines.all())
+            self.assertEqual(discounts[line.order_id], sublines)
+    
+    def test_related_queryset(self):
+        self.create_scenario()
+        engine = BillingEngine(processes=1)
+        with self.assertRaises(ValueError):
+            engine.bill(Order.objects.all(), related_queryset=Order.objects.all())
+    
+    # Scenarios of the handler tests, billed through the engine
+    
+    def test_handler_rates(self):
+        service = self.create_ftp_service()
+        superplan = Plan.objects.create(name='SUPER', allow_multiple=False, is_combinable=True)
+        self.create_rates(service, superplan, ((1, 0), (3, 10), (4, 9), (10, 1)))
+        dupeplan = Plan.objects.create(name='DUPE', allow_multiple=True, is_combinable=True)
+        self.create_rates(service, dupeplan, ((1, 0), (3, 9)))
+        hyperplan = Plan.objects.create(name='HYPER', allow_multiple=False, is_combinable=False)
+        self.create_rates(service, hyperplan, ((1, 0), (20, 5)))
+        self.create_accounts(plans=[superplan])
+        self.create_accounts(plans=[superplan, dupeplan])
+        self.create_accounts(plans=[superplan, dupeplan, hyperplan])
+        self.assertShardsEqual()
+        hyperplan.is_combinable = True
+        hyperplan.save()
+        self.assertShardsEqual()
+        service.rate_algorithm = 'orchestra.contrib.plans.ratings.match_price'
+        service.save()
+        self.assertShardsEqual()
+    
+    def test_handler_incomplete_and_zero_rates(self):
+        service = self.create_ftp_service()
+        superplan = Plan.objects.create(name='SUPER', allow_multiple=False, is_combinable=True)
+        self.create_rates(service, superplan, ((4, 9), (10, 1)))
+        zeroplan = Plan.objects.create(name='ZERO', allow_multiple=False, is_combinable=True)
+        self.create_rates(service, zeroplan, ((0, 0), (3, 10), (4, 9), (10, 1)))
+        self.create_accounts(plans=[superplan])
+        self.create_accounts(plans=[zeroplan])
+        self.assertShardsEqual()
+    
+    def test_handler_rates_allow_multiple(self):
+        service = self.create_ftp_service()
+        dupeplan = Plan.objects.create(name='DUPE', allow_multiple=True, is_combinable=True)
+        self.create_rates(service, dupeplan, ((1, 0), (3, 9)))
+        for contracts in range(1, 4):
+            self.create_accounts(plans=[dupeplan]*contracts)
+        self.assertShardsEqual()
+    
+    def test_handler_best_price(self):
+        service = self.create_ftp_service(rate_algorithm='orchestra.contrib.plans.ratings.best_price')
+        dupeplan = Plan.objects.create(name='DUPE')
+        self.create_rates(service, dupeplan, ((0, 0), (2, 9), (3, 8), (4, 7), (5, 10), (10, 5)))
+        for contracts in range(1, 4):
+            self.create_accounts(plans=[dupeplan]*contracts)
+        self.assertShardsEqual()
+    
+    def test_handler_default_plan(self):
+        service = self.create_ftp_service()
+        defaultplan = Plan.objects.create(name='DEFAULT', is_default=True)
+        self.create_rates(service, defaultplan, ((1, 5),))
+        dupeplan = Plan.objects.create(name='DUPE', allow_multiple=True)
+        self.create_rates(service, dupeplan, ((1, 0), (3, 9)))
+        self.create_accounts()
+        self.create_accounts(plans=[dupeplan, dupeplan])
+        self.assertShardsEqual()
+    
+    def test_handler_compensation(self):
+        self.create_ftp_service(on_cancel=Service.COMPENSATE)
+        self.create_accounts()
+        bp = timezone.now().date() + relativedelta(years=1)
+        Order.objects.all().bill(billing_point=bp, fixed_point=True)
+        # Cancelled orders compensate the ones registered afterwards
+        for order in Order.objects.order_by('id')[::2]:
+            order.cancel()
+        for account in set(order.account for order in Order.objects.select_related('account')):
+            self.create_ftp(account)
+        self.assertShardsEqual()
+    
+    def test_context_compensation(self):
+        """ preloaded related orders bill like the querysets of each account """
+        self.create_ftp_service(on_cancel=Service.COMPENSATE)
+        self.create_accounts()
+        bp = timezone.now().date() + relativedelta(years=1)
+        Order.objects.all().bill(billing_point=bp, fixed_point=True)
+        for order in Order.objects.order_by('id')[::2]:
+            order.cancel()
+        for account in set(order.account for order in Order.objects.select_related('account')):
+            self.create_ftp(account)
+        bp = bp + relativedelta(years=1)
+        options = dict(billing_point=bp, fixed_point=True, commit=False)
+        queryset = Order.objects.select_related('account', 'service')
+        for use_context in (False, True):
+            context = BillingContext(queryset) if use_context else None
+            bills = []
+            for account, services in queryset.group_by('account', 'service').items():
+                lines = []
+                for service, orders in services.items():
+                    lines.extend(service.handler.generate_bill_lines(orders, account,
+                        context=context, **options))
+                bills.append((account, lines))
+            if context is None:
+                expected = self.get_summary(bills)
+                self.assertTrue(any(discounts for *__, discounts in expected))
+            else:
+                self.assertEqual(expected, self.get_summary(bills))
+
+
+@skipUnless(connection.vendor == 'postgresql', "Worker processes need a shared test database")
+class BillingEngineProcessTests(AppDependencyMixin, TransactionTestCase):
+    """ shards billed by worker processes, each one on its own transaction """
+    DEPENDENCIES = BillingEngineTests.DEPENDENCIES
+    
+    create_account = BaseTestCase.create_account
+    create_ftp_service = BillingEngineTests.create_ftp_service
+    create_ftp = BillingEngineTests.create_ftp
+    create_scenario = BillingEngineTests.create_scenario
+    
+    def get_billed(self):
+        """ stored lines and sublines, with the orders billing state """
+        lines = BillLine.objects.select_related('bill').prefetch_related('sublines')
+        billed = []
+        for line in lines:
+            sublines = sorted((subline.type, subline.total) for subline in line.sublines.all())
+            billed.append((line.bill.account_id, line.bill.type, line.order_id, line.start_on,
+                line.end_on, line.quantity, line.subtotal, tuple(sublines)))
+        orders = Order.objects.order_by('id').values_list('id', 'billed_on', 'billed_until')
+        return sorted(billed), list(orders)
+    
+    def bill_serial(self, options):
+        """ billed lines of a serial run, leaving the orders unbilled again """
+        orders = list(Order.objects.values_list('id', 'billed_on', 'billed_until', 'billed_metric'))
+        Order.objects.all().bill(**options)
+        billed = self.get_billed()
+        Bill.objects.all().delete()
+        for pk, billed_on, billed_until, billed_metric in orders:
+            Order.objects.filter(pk=pk).update(billed_on=billed_on, billed_until=billed_until,
+                billed_metric=billed_metric)
+        return billed
+    
+    def test_processes(self):
+        self.create_scenario()
+        bp = timezone.now().date() + relativedelta(years=1)
+        options = dict(billing_point=bp, fixed_point=True)
+        expected = self.bill_serial(options)
+        self.assertTrue(expected[0])
+        engine = BillingEngine(processes=2, shard_size=2)
+        bills = engine.bill(Order.objects.all(), **options)
+        self.assertEqual(5, len(bills))
+        self.assertEqual(expected, self.get_billed())
+        # Billing again should not bill already billed orders
+        self.assertEqual([], engine.bill(Order.objects.all(), **options))
+        self.assertEqual(expected, self.get_billed())
+    
+    def test_resume(self):
+        self.create_scenario()
+        bp = timezone.now().date() + relativedelta(years=1)
+        options = dict(billing_point=bp, fixed_point=True)
+        expected = self.bill_serial(options)
+        engine = BillingEngine(processes=2, shard_size=2)
+        # Only the first shard was committed before the crash
+        shards = engine.get_shards(Order.objects.all())
+        bill_shard(shards[0], options)
+        engine.bill(Order.objects.all(), **options)
+        self.assertEqual(expected, self.get_billed())
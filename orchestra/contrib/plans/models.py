@@ -1,3 +1,4 @@
+from collections import Counter, defaultdict
 from functools import lru_cache
 
 from django.core.validators import ValidationError
@@ -57,6 +58,29 @@ class ContractedPlan(models.Model):
                 raise ValidationError("A contracted plan for this account already exists.")
 
 
+class RateList(list):
+    """ Preloaded rates sorted like by_account(), the rating methods accept them as a queryset """
+    group_by = queryset.group_by
+    
+    @staticmethod
+    def get_order_key(rate):
+        # order_by('plan', 'quantity'), null quantities go last
+        return (rate.plan_id, rate.quantity is None, rate.quantity or 0)
+    
+    def is_ordered(self):
+        keys = [self.get_order_key(rate) for rate in self]
+        return keys == sorted(keys)
+    
+    def distinct(self):
+        seen = set()
+        rates = RateList()
+        for rate in self:
+            if rate.pk not in seen:
+                seen.add(rate.pk)
+                rates.append(rate)
+        return rates
+
+
 class RateQuerySet(models.QuerySet):
     group_by = queryset.group_by
     
@@ -66,6 +90,38 @@ class RateQuerySet(models.QuerySet):
             Q(plan__is_default=True) |
             Q(plan__contracts__account=account)
         ).order_by('plan', 'quantity').select_related('plan', 'service')
+    
+    def by_accounts(self, account_ids):
+        """
+        by_account() of many accounts with two queries
+        returns {(account_id, service_id): RateList}, with empty RateLists for missing keys
+        """
+        rates = self.filter(plan__isnull=False).order_by('service', 'plan', 'quantity')
+        rates = list(rates.select_related('plan', 'service'))
+        # by_account() joins contracts, rates are repeated once per contract
+        default_contracts = Counter()
+        account_contracts = Counter()
+        contracts = ContractedPlan.objects.filter(plan__in=set(rate.plan_id for rate in rates))
+        contracts = contracts.filter(Q(plan__is_default=True) | Q(account__in=account_ids))
+        contracts = contracts.values_list('plan_id', 'account_id', 'plan__is_default')
+        for plan_id, account_id, is_default in contracts:
+            if is_default:
+                default_contracts[plan_id] += 1
+            else:
+                account_contracts[(account_id, plan_id)] += 1
+        result = defaultdict(RateList)
+        for account_id in account_ids:
+            for rate in rates:
+                if rate.plan.is_default:
+                    repeat = max(default_contracts[rate.plan_id], 1)
+                else:
+                    repeat = account_contracts[(account_id, rate.plan_id)]
+                if repeat:
+                    key = (account_id, rate.service_id)
+                    result[key].extend([rate]*repeat)
+        for rates in result.values():
+            rates.sort(key=RateList.get_order_key)
+        return result
 
 
 class Rate(models.Model):
@@ -5,6 +5,16 @@ from django.utils.translation import ugettext_lazy as _
 from orchestra.utils.python import AttrDict
 
 
+def _check_ordering(rates):
+    """ rates queryset or pre-sorted RateList should be ordered by 'plan' and 'quantity' """
+    if hasattr(rates, 'query'):
+        ordered = rates.query.order_by == ['plan', 'quantity']
+    else:
+        ordered = rates.is_ordered()
+    if not ordered:
+        raise ValueError("rates queryset should be ordered by 'plan' and 'quantity'")
+
+
 def _compute_steps(rates, metric):
     value = 0
     num = len(rates)
@@ -65,8 +75,7 @@ def _standardize(rates):
 
 
 def step_price(rates, metric):
-    if rates.query.order_by != ['plan', 'quantity']:
-        raise ValueError("rates queryset should be ordered by 'plan' and 'quantity'")
+    _check_ordering(rates)
     # Step price
     group = []
     minimal = (sys.maxsize, [])
@@ -127,8 +136,7 @@ step_price.help_text = _("All rates with a quantity lower or equal than the metr
 
 
 def match_price(rates, metric):
-    if rates.query.order_by != ['plan', 'quantity']:
-        raise ValueError("rates queryset should be ordered by 'plan' and 'quantity'")
+    _check_ordering(rates)
     candidates = []
     selected = False
     prev = None
@@ -159,8 +167,7 @@ match_price.help_text = _("Only <b>the rate</b> with a) inmediate inferior metri
 
 
 def best_price(rates, metric):
-    if rates.query.order_by != ['plan', 'quantity']:
-        raise ValueError("rates queryset should be ordered by 'plan' and 'quantity'")
+    _check_ordering(rates)
     candidates = []
     for plan, rates in rates.group_by('plan').items():
         rates = _standardize(rates)
@@ -1,4 +1,4 @@
-from .backends import ServiceMonitor
+from .backends import LogMonitor, ServiceMonitor
 
 
 default_app_config = 'orchestra.contrib.resources.apps.ResourcesConfig'
@@ -2,6 +2,7 @@ import datetime
 import decimal
 import itertools
 
+from django.db.models import Sum
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
@@ -22,6 +23,13 @@ class Aggregation(plugins.Plugin, metaclass=plugins.PluginMount):
         """ given a dataset computes its usage according to the method (avg, sum, ...) """
         raise NotImplementedError
     
+    def compute_usages(self, dataset, date=None):
+        """
+        filters and computes the usage of every object on dataset at once
+        returns {object_id: usage}
+        """
+        raise NotImplementedError
+    
     def aggregate_history(self, dataset):
         raise NotImplementedError
 
@@ -43,6 +51,12 @@ class Last(Aggregation):
             return sum(values)
         return None
     
+    def compute_usages(self, dataset, date=None):
+        if date is not None:
+            dataset = dataset.filter(created_at__lte=date)
+        dataset = dataset.order_by('object_id', '-id').distinct('object_id')
+        return dict(dataset.values_list('object_id', 'value'))
+    
     def aggregate_history(self, dataset):
         prev_object_id = None
         prev_object_repr = None
@@ -74,7 +88,36 @@ class MonthlySum(Last):
             created_at__month=date.month,
         )
     
+    def get_period(self, date=None):
+        """ start and end of the month """
+        if date is None:
+            date = timezone.now().date()
+        ini = datetime.datetime(year=date.year, month=date.month, day=1)
+        if date.month == 12:
+            end = ini.replace(year=date.year+1, month=1)
+        else:
+            end = ini.replace(month=date.month+1)
+        return timezone.make_aware(ini), timezone.make_aware(end)
+    
+    def compute_usages(self, dataset, date=None):
+        from .rollups import sum_usages
+        usages = sum_usages(dataset, *self.get_period(date=date))
+        if usages is not None:
+            return usages
+        dataset = self.filter(dataset, date=date).order_by()
+        return dict(dataset.values_list('object_id').annotate(Sum('value')))
+    
     def aggregate_history(self, dataset):
+        from .rollups import monthly_sums
+        sums = monthly_sums(dataset)
+        if sums is not None:
+            for object_id, months in itertools.groupby(sums, key=lambda row: row[0]):
+                datas = [
+                    AttrDict(date=date, value=value, content_object_repr=content_object_repr)
+                        for __, date, value, content_object_repr in months
+                ]
+                yield (datas[-1].content_object_repr, datas)
+            return
         prev = None
         prev_object_id = None
         datas = []
@@ -122,30 +165,52 @@ class MonthlyAvg(MonthlySum):
             day=1,
         )
     
+    def compute_average(self, datas):
+        """ time weighted average of (created_at, value) pairs sorted by date """
+        last_created_at = datas[-1][0]
+        epoch = self.get_epoch(date=last_created_at)
+        if not isinstance(epoch, datetime.datetime):
+            epoch = timezone.make_aware(datetime.datetime.combine(epoch, datetime.time.min))
+        total = (last_created_at-epoch).total_seconds()
+        ini = epoch
+        current = 0
+        for created_at, value in datas:
+            slot = (created_at-ini).total_seconds()
+            if total:
+                current += value * decimal.Decimal(str(slot/total))
+            ini = created_at
+        return current
+    
     def compute_usage(self, dataset):
         result = 0
         has_result = False
-        aggregate = []
         for object_id, dataset in dataset.order_by('created_at').group_by('object_id').items():
-            try:
-                last = dataset[-1]
-            except IndexError:
+            if not dataset:
                 continue
-            epoch = self.get_epoch(date=last.created_at)
-            total = (last.created_at-epoch).total_seconds()
-            ini = epoch
-            current = 0
-            for mdata in dataset:
-                has_result = True
-                slot = (mdata.created_at-ini).total_seconds()
-                current += mdata.value * decimal.Decimal(str(slot/total))
-                ini = mdata.created_at
-            else:
-                result += current
+            has_result = True
+            result += self.compute_average([(mdata.created_at, mdata.value) for mdata in dataset])
         if has_result:
             return result
         return None
     
+    def compute_usages(self, dataset, date=None):
+        """ one pass over all the values, ordered by object """
+        dataset = self.filter(dataset, date=date).order_by('object_id', 'created_at')
+        usages = {}
+        datas = []
+        prev_object_id = None
+        dataset = dataset.values_list('object_id', 'created_at', 'value')
+        for object_id, created_at, value in dataset.iterator():
+            if object_id != prev_object_id:
+                if datas:
+                    usages[prev_object_id] = self.compute_average(datas)
+                datas = []
+                prev_object_id = object_id
+            datas.append((created_at, value))
+        if datas:
+            usages[prev_object_id] = self.compute_average(datas)
+        return usages
+    
     def aggregate_history(self, dataset):
         yield from super(MonthlySum, self).aggregate_history(dataset)
 
@@ -1,12 +1,113 @@
 import datetime
+import logging
+import os
+import textwrap
+import threading
+import uuid
+from contextlib import contextmanager
 
+from django.db import connections, router, transaction
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 
 from orchestra.contrib.orchestration import ServiceBackend
 
-from . import helpers
+from . import helpers, settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class MonitorDataWriter(object):
+    """
+    Parses monitor output and stores it in batches,
+    resolving content_object_repr with one in_bulk() and writing with one bulk_create()
+    (or COPY on PostgreSQL) per batch
+    """
+    def __init__(self, monitor, batch_size=None, use_copy=None, using=None):
+        from .models import MonitorData
+        if using is None:
+            using = router.db_for_write(MonitorData)
+        self.monitor = monitor
+        self.batch_size = batch_size or settings.RESOURCES_MONITOR_DATA_BATCH_SIZE
+        if use_copy is None:
+            use_copy = settings.RESOURCES_MONITOR_DATA_COPY
+        self.use_copy = use_copy and connections[using].vendor == 'postgresql'
+        self.using = using
+        self.name = monitor.get_name()
+        self.ct = monitor.content_type
+        self.model = self.ct.model_class()
+        self.batch = []
+        self.count = 0
+    
+    def write(self, output):
+        """ output of a finished execution, data of failed ones is never stored """
+        for line in output.split('\n'):
+            self.write_line(line)
+    
+    def write_line(self, line):
+        line = line.strip()
+        if not line:
+            return
+        object_id, value, state = self.monitor.process(line)
+        if isinstance(value, bytes):
+            value = value.decode('ascii')
+        if isinstance(state, bytes):
+            state = state.decode('ascii')
+        self.batch.append((int(object_id), value, state))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+    
+    def flush(self):
+        from .models import MonitorData
+        if not self.batch:
+            return
+        objects = self.model.objects.using(self.using).in_bulk(
+            set(object_id for object_id, __, __ in self.batch))
+        datas = []
+        for object_id, value, state in self.batch:
+            try:
+                content_object = objects[object_id]
+            except KeyError:
+                logger.warning("%s: %s with id %s does not exist." % (self.name, self.model, object_id))
+                continue
+            datas.append(MonitorData(
+                monitor=self.name, object_id=object_id, content_type=self.ct, value=value,
+                state=state, created_at=self.monitor.current_date,
+                content_object_repr=str(content_object)[:256],
+            ))
+        if self.use_copy:
+            self.copy(datas)
+        else:
+            MonitorData.objects.using(self.using).bulk_create(datas)
+        self.count += len(datas)
+        self.batch = []
+    
+    def copy(self, datas):
+        """ PostgreSQL COPY FROM, faster than multi-row INSERT for big batches """
+        from io import StringIO
+        from .models import MonitorData
+        def escape(value):
+            if value is None:
+                return '\\N'
+            value = str(value)
+            for char, escaped in (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r')):
+                value = value.replace(char, escaped)
+            return value
+        columns = ('monitor', 'content_type_id', 'object_id', 'created_at', 'value', 'state',
+            'content_object_repr')
+        buff = StringIO()
+        for data in datas:
+            buff.write('\t'.join(escape(getattr(data, column)) for column in columns) + '\n')
+        buff.seek(0)
+        with connections[self.using].cursor() as cursor:
+            cursor.copy_from(buff, MonitorData._meta.db_table, columns=columns)
+    
+    def close(self):
+        """ stores pending lines, returns the number of stored values """
+        self.flush()
+        return self.count
 
 
 class ServiceMonitor(ServiceBackend):
@@ -19,6 +120,8 @@ class ServiceMonitor(ServiceBackend):
     abstract = True
     delete_old_equal_values = False
     monthly_sum_old_values = False
+    # {tier: days} overriding RESOURCES_MONITOR_RETENTION
+    retention = {}
     
     @classmethod
     def get_plugins(cls):
@@ -42,14 +145,16 @@ class ServiceMonitor(ServiceBackend):
         model = model.lower()
         return ContentType.objects.get_by_natural_key(app_label, model)
     
-    def get_last_data(self, object_id):
+    @cached_property
+    def last_data(self):
+        """ {object_id: last data} of all objects, loaded once per script with a single query """
         from .models import MonitorData
-        try:
-            return MonitorData.objects.filter(content_type=self.content_type,
-                monitor=self.get_name(), object_id=object_id).latest()
-        except MonitorData.DoesNotExist:
-            return None
-        
+        return MonitorData.objects.filter(content_type=self.content_type,
+            monitor=self.get_name()).get_latest_by_object()
+    
+    def get_last_data(self, object_id):
+        return self.last_data.get(int(object_id))
+    
     def get_last_date(self, object_id):
         data = self.get_last_data(object_id)
         if data is None:
@@ -66,25 +171,14 @@ class ServiceMonitor(ServiceBackend):
         result.append(None)
         return result
     
+    def get_writer(self):
+        return MonitorDataWriter(self)
+    
     def store(self, log):
         """ stores monitored values from stdout """
-        from django.contrib.contenttypes.models import ContentType
-        from .models import MonitorData
-        name = self.get_name()
-        app_label, model_name = self.model.split('.')
-        ct = ContentType.objects.get_by_natural_key(app_label, model_name.lower())
-        for line in log.stdout.splitlines():
-            line = line.strip()
-            object_id, value, state = self.process(line)
-            if isinstance(value, bytes):
-                value = value.decode('ascii')
-            if isinstance(state, bytes):
-                state = state.decode('ascii')
-            content_object = ct.get_object_for_this_type(pk=object_id)
-            MonitorData.objects.create(
-                monitor=name, object_id=object_id, content_type=ct, value=value, state=state,
-                created_at=self.current_date, content_object_repr=str(content_object),
-            )
+        writer = self.get_writer()
+        writer.write(log.stdout)
+        return writer.close()
     
     def execute(self, *args, **kwargs):
         log = super(ServiceMonitor, self).execute(*args, **kwargs)
@@ -93,8 +187,143 @@ class ServiceMonitor(ServiceBackend):
         return log
     
     @classmethod
-    def aggregate(cls, dataset):
+    def aggregate(cls, dataset, dry_run=False, batch_size=None):
+        """ compacts old dataset, returns the number of deleted (or to be deleted) rows """
         if cls.delete_old_equal_values:
-            return helpers.delete_old_equal_values(dataset)
+            return helpers.delete_old_equal_values(dataset, dry_run=dry_run, batch_size=batch_size)
         elif cls.monthly_sum_old_values:
-            return helpers.monthly_sum_old_values(dataset)
+            return helpers.monthly_sum_old_values(dataset, dry_run=dry_run, batch_size=batch_size)
+
+
+class LogMonitor(ServiceMonitor):
+    """
+    Monitor parsing log files on the monitored server.
+    With RESOURCES_MONITOR_OFFSETS_PATH the (inode, offset) of the last line read of each log
+    is kept on the server and only the new lines are read, following log rotations.
+    
+    The offsets of a run are staged by its script and only committed, by a second script,
+    once its data has been stored. Runs limited to some objects (partial_run()) read the
+    new lines without consuming them, the period end is enforced as on full log reads.
+    """
+    abstract = True
+    # monitors instantiated inside partial_run()
+    partial = threading.local()
+    
+    def __init__(self):
+        super(LogMonitor, self).__init__()
+        self.consume = self.incremental and not getattr(self.partial, 'active', False)
+        self.checkpoint = uuid.uuid4().hex if self.consume else ''
+    
+    @classmethod
+    @contextmanager
+    def partial_run(cls):
+        """ monitors created inside do not advance the offsets shared by all objects """
+        cls.partial.active = True
+        try:
+            yield
+        finally:
+            cls.partial.active = False
+    
+    @property
+    def incremental(self):
+        return bool(settings.RESOURCES_MONITOR_OFFSETS_PATH)
+    
+    def get_offsets_path(self):
+        """ remote path where the log offsets of this monitor are kept """
+        if self.incremental:
+            return os.path.join(settings.RESOURCES_MONITOR_OFFSETS_PATH, self.get_name())
+        return ''
+    
+    def get_log_reader(self):
+        """
+        Python source defining read_logs(path), lines of path and its rotated path.1 not read yet,
+        save_offsets(), staging the offsets once all lines have been processed, and commit_offsets().
+        When consumed, lines are only read once and the end of the monitored period is not
+        enforced (end_date).
+        """
+        context = "offsets_path = %r\ncheckpoint = %r\n" % (self.get_offsets_path(), self.checkpoint)
+        return context + textwrap.dedent("""\
+            import glob
+            import json
+            import os
+            import sys
+            
+            incremental = bool(offsets_path)
+            consume = bool(checkpoint)
+            offsets = {}
+            new_offsets = {}
+            if incremental:
+                try:
+                    with open(offsets_path) as handler:
+                        offsets = json.load(handler)
+                except (IOError, ValueError):
+                    pass
+            
+            def get_inode(path):
+                try:
+                    return os.stat(path).st_ino
+                except OSError:
+                    return None
+            
+            def read_logs(path):
+                checkpoint = offsets.get(path)
+                rotated = path + '.1'
+                if checkpoint and checkpoint[0] == get_inode(path):
+                    offset = checkpoint[1]
+                    if os.path.getsize(path) < offset:
+                        # Truncated in place (copytruncate)
+                        offset = 0
+                    logs = [(path, offset)]
+                elif checkpoint and checkpoint[0] == get_inode(rotated):
+                    # Rotated since the previous run
+                    logs = [(rotated, checkpoint[1]), (path, 0)]
+                else:
+                    # First run or rotated more than once
+                    logs = [(rotated, 0), (path, 0)]
+                for log, offset in logs:
+                    try:
+                        handler = open(log, 'rb')
+                    except IOError as e:
+                        if os.path.exists(log):
+                            sys.stderr.write(str(e)+'\\n')
+                        continue
+                    with handler:
+                        handler.seek(offset)
+                        for line in handler:
+                            if not line.endswith(b'\\n'):
+                                # Still being written
+                                break
+                            offset += len(line)
+                            if str is not bytes:
+                                line = line.decode('utf-8', 'replace')
+                            yield line
+                        if log == path:
+                            new_offsets[path] = (os.fstat(handler.fileno()).st_ino, offset)
+            
+            def save_offsets():
+                # Staged until the data of this run has been stored
+                if consume:
+                    offsets.update(new_offsets)
+                    directory = os.path.dirname(offsets_path)
+                    if not os.path.exists(directory):
+                        os.makedirs(directory)
+                    with open(offsets_path + '.tmp', 'w') as handler:
+                        json.dump(offsets, handler)
+                    os.rename(offsets_path + '.tmp', offsets_path + '.' + checkpoint)
+            
+            def commit_offsets():
+                if consume:
+                    os.rename(offsets_path + '.' + checkpoint, offsets_path)
+                    # Staged by failed runs
+                    for path in glob.glob(offsets_path + '.*'):
+                        os.remove(path)
+            """)
+    
+    def store(self, log):
+        """ the lines read are consumed once all the data has been stored """
+        from .models import MonitorData
+        with transaction.atomic(using=router.db_for_write(MonitorData)):
+            stored = super(LogMonitor, self).store(log)
+        if self.consume:
+            self.script_method(log, log.server, [self.get_log_reader() + 'commit_offsets()'], False)
+        return stored
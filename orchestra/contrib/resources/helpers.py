@@ -1,7 +1,14 @@
 import decimal
+import itertools
+import textwrap
 
+from django.db import connections, transaction
 from django.template.defaultfilters import date as date_format
 
+from orchestra.utils.python import AttrDict
+
+from . import settings
+
 
 def get_history_data(queryset):
     resources = {}
@@ -83,8 +90,91 @@ def get_history_data(queryset):
     return result
 
 
-def delete_old_equal_values(dataset):
+def get_dataset_sql(dataset):
+    """ SQL of the dataset rows with the columns needed by the compactions """
+    dataset = dataset.order_by().values_list('id', 'content_type_id', 'object_id', 'created_at', 'value')
+    return dataset.query.sql_with_params()
+
+
+def delete_old_equal_values(dataset, dry_run=False, batch_size=None):
     """ only first and last values of an equal serie (+-error) are kept """
+    batch_size = batch_size or settings.RESOURCES_CLEANUP_BATCH_SIZE
+    using = dataset.db
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return _delete_old_equal_values(dataset, dry_run=dry_run)
+    error = decimal.Decimal('0.005')
+    sql, params = get_dataset_sql(dataset)
+    # Same comparisons as the row by row version, where the second value of each object
+    # is never compared with the first one
+    sql = textwrap.dedent("""\
+        SELECT id FROM (
+            SELECT id, value,
+                   lag(value) OVER w AS prev_value,
+                   lead(value) OVER w AS next_value,
+                   row_number() OVER w AS position
+            FROM (%s) AS dataset
+            WINDOW w AS (PARTITION BY content_type_id, object_id ORDER BY created_at, id)
+        ) AS data
+        WHERE position > 2
+          AND value*(1-%%s) < prev_value AND prev_value < value*(1+%%s)
+          AND next_value*(1-%%s) < value AND value < next_value*(1+%%s)""") % sql
+    params = params + (error,)*4
+    table = dataset.model._meta.db_table
+    delete_count = 0
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ids = [row[0] for row in cursor.fetchall()]
+    for ix in range(0, len(ids), batch_size):
+        chunk = ids[ix:ix+batch_size]
+        if not dry_run:
+            with transaction.atomic(using=using), connection.cursor() as cursor:
+                cursor.execute('DELETE FROM %s WHERE id = ANY(%%s)' % table, (chunk,))
+        delete_count += len(chunk)
+    return delete_count
+
+
+def monthly_sum_old_values(dataset, dry_run=False, batch_size=None):
+    """ values of each object are summed up on the last value of every month """
+    batch_size = batch_size or settings.RESOURCES_CLEANUP_BATCH_SIZE
+    using = dataset.db
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return _monthly_sum_old_values(dataset, dry_run=dry_run)
+    sql, params = get_dataset_sql(dataset)
+    sql = textwrap.dedent("""\
+        SELECT (array_agg(id ORDER BY created_at DESC, id DESC))[1], SUM(value), array_agg(id)
+        FROM (%s) AS dataset
+        GROUP BY content_type_id, object_id, date_trunc('month', created_at AT TIME ZONE 'UTC')
+        HAVING COUNT(*) > 1""") % sql
+    table = dataset.model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        groups = cursor.fetchall()
+    delete_count = 0
+    ix = 0
+    while ix < len(groups):
+        # Whole months, at least batch_size rows per chunk
+        keep, totals, delete = [], [], []
+        while ix < len(groups) and len(delete) < batch_size:
+            last_id, total, ids = groups[ix]
+            keep.append(last_id)
+            totals.append(total)
+            delete.extend(pk for pk in ids if pk != last_id)
+            ix += 1
+        if not dry_run:
+            with transaction.atomic(using=using), connection.cursor() as cursor:
+                cursor.execute(textwrap.dedent("""\
+                    UPDATE {table} SET value = data.total
+                    FROM unnest(%s::integer[], %s::numeric[]) AS data(id, total)
+                    WHERE {table}.id = data.id""").format(table=table), (keep, totals))
+                cursor.execute('DELETE FROM %s WHERE id = ANY(%%s)' % table, (delete,))
+        delete_count += len(delete)
+    return delete_count
+
+
+def _delete_old_equal_values(dataset, dry_run=False):
+    """ row by row delete_old_equal_values() for databases without window functions """
     prev_value = None
     prev_key = None
     delete_count = 0
@@ -95,7 +185,8 @@ def delete_old_equal_values(dataset):
         if prev_key == key:
             if prev_value is not None and mdata.value*(1-error) < prev_value < mdata.value*(1+error):
                 if third:
-                    prev.delete()
+                    if not dry_run:
+                        prev.delete()
                     delete_count += 1
                 else:
                     third = True
@@ -110,25 +201,30 @@ def delete_old_equal_values(dataset):
     return delete_count
 
 
-def monthly_sum_old_values(dataset):
+def _monthly_sum_old_values(dataset, dry_run=False):
+    """ row by row monthly_sum_old_values() for databases without window functions """
     aggregated = 0
     prev_key = None
     prev = None
     to_delete = []
     delete_count = 0
-    for mdata in dataset.order_by('content_type_id', 'object_id', 'created_at'):
+    sink = AttrDict(content_type_id=None, object_id=None, created_at=AttrDict(year=None, month=None))
+    for mdata in itertools.chain(dataset.order_by('content_type_id', 'object_id', 'created_at'), [sink]):
         key = (mdata.content_type_id, mdata.object_id, mdata.created_at.year, mdata.created_at.month)
         if prev_key is not None and prev_key != key:
-            if prev.value != aggregated:
-                prev.value = aggregated
-                prev.save(update_fields=('value',))
-            for obj in to_delete[:-1]:
-                obj.delete()
-                delete_count += 1
+            if len(to_delete) > 1:
+                if not dry_run:
+                    if prev.value != aggregated:
+                        prev.value = aggregated
+                        prev.save(update_fields=('value',))
+                    for obj in to_delete[:-1]:
+                        obj.delete()
+                delete_count += len(to_delete)-1
             aggregated = 0
             to_delete = []
         prev = mdata
         prev_key = key
-        aggregated += mdata.value
-        to_delete.append(mdata)
+        if mdata is not sink:
+            aggregated += mdata.value
+            to_delete.append(mdata)
     return delete_count
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('resources', '0010_auto_20160219_1108'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='monitordata',
+            index_together=set([('content_type', 'object_id'), ('monitor', 'content_type', 'object_id', 'created_at')]),
+        ),
+    ]
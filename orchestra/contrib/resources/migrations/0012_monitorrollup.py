@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('resources', '0011_monitordata_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonitorRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('monitor', models.CharField(max_length=256, verbose_name='monitor')),
+                ('object_id', models.PositiveIntegerField(verbose_name='object id')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day'), ('month', 'Month')], max_length=8, verbose_name='period')),
+                ('date', models.DateTimeField(help_text='Start of the period.', verbose_name='date')),
+                ('samples', models.PositiveIntegerField(verbose_name='samples')),
+                ('total', models.DecimalField(decimal_places=2, max_digits=20, verbose_name='total')),
+                ('minimum', models.DecimalField(decimal_places=2, max_digits=16, verbose_name='minimum')),
+                ('maximum', models.DecimalField(decimal_places=2, max_digits=16, verbose_name='maximum')),
+                ('last', models.DecimalField(decimal_places=2, max_digits=16, verbose_name='last')),
+                ('last_at', models.DateTimeField(verbose_name='last at')),
+                ('content_object_repr', models.CharField(editable=False, max_length=256, verbose_name='content object representation')),
+                ('content_type', models.ForeignKey(to='contenttypes.ContentType', verbose_name='content type')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='monitorrollup',
+            unique_together=set([('monitor', 'period', 'content_type', 'object_id', 'date')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='monitorrollup',
+            index_together=set([('monitor', 'period', 'date')]),
+        ),
+    ]
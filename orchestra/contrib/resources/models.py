@@ -2,6 +2,7 @@ from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelatio
 from django.contrib.contenttypes.models import ContentType
 from django.apps import apps
 from django.db import models
+from django.db.models import Case, Max, When, Value
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
@@ -150,6 +151,47 @@ class Resource(models.Model):
     def get_scale(self):
         return eval(self.scale)
     
+    def get_used(self, ids=None):
+        """
+        Set-based ResourceData.get_used() for all objects (or ids)
+        returns {object_id: used}, objects without monitored data are not included
+        """
+        aggregation = self.aggregation_instance
+        if ids is not None:
+            ids = set(ids)
+        totals = {}
+        for monitor in self.monitors:
+            path = self.get_model_path(monitor)
+            monitor_model = ServiceMonitor.get_backend(monitor).model_class()
+            ct = ContentType.objects.get_for_model(monitor_model)
+            dataset = MonitorData.objects.filter(monitor=monitor, content_type=ct)
+            if path == []:
+                mapping = None
+                if ids is not None:
+                    dataset = dataset.filter(object_id__in=ids)
+            else:
+                fields = '__'.join(path)
+                objects = monitor_model.objects.all()
+                if ids is not None:
+                    objects = objects.filter(**{'%s__in' % fields: ids})
+                # Reverse and m2m paths relate a monitored object to many objects
+                mapping = {}
+                for monitored_id, object_id in objects.order_by().values_list('id', fields).distinct():
+                    if object_id is not None:
+                        mapping.setdefault(monitored_id, []).append(object_id)
+                dataset = dataset.filter(object_id__in=list(mapping.keys()))
+            for monitored_id, usage in aggregation.compute_usages(dataset).items():
+                if usage is None:
+                    continue
+                object_ids = [monitored_id] if mapping is None else mapping[monitored_id]
+                for object_id in object_ids:
+                    if ids is None or object_id in ids:
+                        totals[object_id] = totals.get(object_id, 0) + usage
+        scale = self.get_scale()
+        return {
+            object_id: float(total)/scale for object_id, total in totals.items()
+        }
+    
     def get_verbose_name(self):
         return self.verbose_name or self.name
     
@@ -174,6 +216,44 @@ class ResourceDataQuerySet(models.QuerySet):
                 resource=resource,
                 allocated=resource.default_allocation
             ), True
+    
+    def update_used(self, resource, objs, batch_size=500):
+        """
+        Set-based ResourceData.update() for all objs, missing ResourceData is created
+        returns the updated dataset
+        """
+        objs = {obj.pk: obj for obj in objs}
+        ct = resource.content_type
+        dataset = self.filter(resource=resource, content_type=ct, object_id__in=list(objs.keys()))
+        existing = set(dataset.values_list('object_id', flat=True))
+        self.bulk_create([
+            self.model(
+                content_type=ct,
+                object_id=pk,
+                content_object_repr=str(obj),
+                resource=resource,
+                allocated=resource.default_allocation
+            ) for pk, obj in objs.items() if pk not in existing
+        ])
+        used = resource.get_used(ids=list(objs.keys()))
+        now = timezone.now()
+        datas = list(dataset)
+        for data in datas:
+            data.used = used.get(data.object_id) or 0
+            data.updated_at = now
+            data.content_object_repr = str(objs[data.object_id])
+        for ix in range(0, len(datas), batch_size):
+            batch = datas[ix:ix+batch_size]
+            self.filter(pk__in=[data.pk for data in batch]).update(
+                used=Case(*[
+                    When(pk=data.pk, then=Value(data.used)) for data in batch
+                ], output_field=self.model._meta.get_field('used')),
+                content_object_repr=Case(*[
+                    When(pk=data.pk, then=Value(data.content_object_repr)) for data in batch
+                ], output_field=self.model._meta.get_field('content_object_repr')),
+                updated_at=now,
+            )
+        return datas
 
 
 class ResourceData(models.Model):
@@ -261,6 +341,50 @@ class ResourceData(models.Model):
 
 class MonitorDataQuerySet(models.QuerySet):
     group_by = queryset.group_by
+    # Fields shared with MonitorRollup, datasets only filtered by them can be read from rollups
+    rollup_fields = ('monitor', 'content_type', 'content_type_id', 'object_id')
+    
+    def __init__(self, *args, **kwargs):
+        super(MonitorDataQuerySet, self).__init__(*args, **kwargs)
+        self.rollup_filters = {}
+    
+    def _clone(self, **kwargs):
+        clone = super(MonitorDataQuerySet, self)._clone(**kwargs)
+        clone.rollup_filters = self.rollup_filters
+        return clone
+    
+    def _filter_or_exclude(self, negate, *args, **kwargs):
+        clone = super(MonitorDataQuerySet, self)._filter_or_exclude(negate, *args, **kwargs)
+        if self.rollup_filters is not None:
+            if negate or args or any(lookup.split('__')[0] not in self.rollup_fields for lookup in kwargs):
+                clone.rollup_filters = None
+            else:
+                clone.rollup_filters = dict(self.rollup_filters, **kwargs)
+        return clone
+    
+    def get_monitor(self):
+        """ monitor of the dataset when it can be answered from the rollups """
+        if self.rollup_filters is not None:
+            monitor = self.rollup_filters.get('monitor')
+            if isinstance(monitor, str):
+                return monitor
+        return None
+    
+    def get_rollups(self):
+        """ MonitorRollup queryset of the same objects """
+        if self.rollup_filters is None:
+            raise TypeError("Dataset filters can not be applied to the rollups.")
+        return MonitorRollup.objects.filter(**self.rollup_filters)
+    
+    def get_latest_by_object(self):
+        """ {object_id: last data by created_at and id} with two queries """
+        lasts = dict(self.order_by().values_list('object_id').annotate(Max('created_at')))
+        queryset = self.filter(object_id__in=lasts, created_at__in=set(lasts.values()))
+        latest = {}
+        for data in queryset.order_by('created_at', 'id'):
+            if data.created_at == lasts[data.object_id]:
+                latest[data.object_id] = data
+        return latest
 
 
 class MonitorData(models.Model):
@@ -280,10 +404,11 @@ class MonitorData(models.Model):
     objects = MonitorDataQuerySet.as_manager()
     
     class Meta:
-        get_latest_by = 'id'
+        get_latest_by = 'created_at'
         verbose_name_plural = _("monitor data")
         index_together = (
             ('content_type', 'object_id'),
+            ('monitor', 'content_type', 'object_id', 'created_at'),
         )
     
     def __str__(self):
@@ -294,6 +419,43 @@ class MonitorData(models.Model):
         return self.resource.unit
 
 
+class MonitorRollup(models.Model):
+    """ Monitored data aggregated per object and hour, day or month, maintained by resources.rollups """
+    HOUR = 'hour'
+    DAY = 'day'
+    MONTH = 'month'
+    PERIODS = (
+        (HOUR, _("Hour")),
+        (DAY, _("Day")),
+        (MONTH, _("Month")),
+    )
+    
+    monitor = models.CharField(_("monitor"), max_length=256)
+    content_type = models.ForeignKey(ContentType, verbose_name=_("content type"))
+    object_id = models.PositiveIntegerField(_("object id"))
+    period = models.CharField(_("period"), max_length=8, choices=PERIODS)
+    date = models.DateTimeField(_("date"), help_text=_("Start of the period."))
+    samples = models.PositiveIntegerField(_("samples"))
+    total = models.DecimalField(_("total"), max_digits=20, decimal_places=2)
+    minimum = models.DecimalField(_("minimum"), max_digits=16, decimal_places=2)
+    maximum = models.DecimalField(_("maximum"), max_digits=16, decimal_places=2)
+    last = models.DecimalField(_("last"), max_digits=16, decimal_places=2)
+    last_at = models.DateTimeField(_("last at"))
+    content_object_repr = models.CharField(_("content object representation"), max_length=256,
+        editable=False)
+    
+    class Meta:
+        unique_together = (
+            ('monitor', 'period', 'content_type', 'object_id', 'date'),
+        )
+        index_together = (
+            ('monitor', 'period', 'date'),
+        )
+    
+    def __str__(self):
+        return "%s %s %s" % (self.monitor, self.period, self.date)
+
+
 def create_resource_relation():
     class ResourceHandler(object):
         """ account.resources.web """
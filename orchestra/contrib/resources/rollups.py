@@ -0,0 +1,241 @@
+"""
+Hourly, daily and monthly rollups of MonitorData
+
+Rollups are built incrementally: only the buckets after the last rolled up one (the watermark)
+and closed for at least RESOURCES_MONITOR_ROLLUP_DELAY are aggregated. Monitored data is dated
+when the monitor run starts but stored when it finishes, the delay leaves room for late rows.
+Hours are aggregated from the raw samples, days from hours and months from days, each with a
+single INSERT ... SELECT.
+Usages are computed from the coarsest complete rollup and the raw samples after it.
+"""
+import datetime
+
+from django.db import connection, transaction
+from django.db.models import Max, Min, Sum
+from django.utils import timezone
+
+from . import settings
+from .backends import ServiceMonitor
+from .models import MonitorData, MonitorRollup
+
+
+PERIODS = (MonitorRollup.HOUR, MonitorRollup.DAY, MonitorRollup.MONTH)
+SOURCE = {
+    MonitorRollup.DAY: MonitorRollup.HOUR,
+    MonitorRollup.MONTH: MonitorRollup.DAY,
+}
+
+
+def is_supported():
+    return connection.vendor == 'postgresql'
+
+
+def truncate(date, period):
+    """ start of the period (current timezone) date belongs to """
+    date = timezone.localtime(date)
+    date = date.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+    if period != MonitorRollup.HOUR:
+        date = date.replace(hour=0)
+    if period == MonitorRollup.MONTH:
+        date = date.replace(day=1)
+    return timezone.make_aware(date, is_dst=False)
+
+
+def get_next(date, period):
+    """ start of the period following the one starting at date """
+    date = timezone.localtime(date).replace(tzinfo=None)
+    if period == MonitorRollup.HOUR:
+        date += datetime.timedelta(hours=1)
+    elif period == MonitorRollup.DAY:
+        date += datetime.timedelta(days=1)
+    elif date.month == 12:
+        date = date.replace(year=date.year+1, month=1)
+    else:
+        date = date.replace(month=date.month+1)
+    return timezone.make_aware(date, is_dst=False)
+
+
+def get_watermarks(monitor):
+    """ {period: end of the last rolled up bucket} """
+    rollups = MonitorRollup.objects.filter(monitor=monitor).order_by()
+    watermarks = {}
+    for period, date in rollups.values_list('period').annotate(Max('date')):
+        watermarks[period] = get_next(date, period)
+    return watermarks
+
+
+RAW_SQL = """
+    INSERT INTO {rollup} (monitor, content_type_id, object_id, period, date, samples, total,
+                          minimum, maximum, last, last_at, content_object_repr)
+    SELECT monitor, content_type_id, object_id, %s, bucket, COUNT(*), SUM(value), MIN(value),
+           MAX(value), (array_agg(value ORDER BY created_at DESC, id DESC))[1], MAX(created_at),
+           (array_agg(content_object_repr ORDER BY created_at DESC, id DESC))[1]
+    FROM (
+        SELECT *, date_trunc(%s, created_at AT TIME ZONE %s) AT TIME ZONE %s AS bucket
+        FROM {data}
+        WHERE monitor = %s AND created_at >= %s AND created_at < %s
+    ) AS data
+    GROUP BY monitor, content_type_id, object_id, bucket"""
+
+
+CASCADE_SQL = """
+    INSERT INTO {rollup} (monitor, content_type_id, object_id, period, date, samples, total,
+                          minimum, maximum, last, last_at, content_object_repr)
+    SELECT monitor, content_type_id, object_id, %s, bucket, SUM(samples), SUM(total), MIN(minimum),
+           MAX(maximum), (array_agg(last ORDER BY last_at DESC))[1], MAX(last_at),
+           (array_agg(content_object_repr ORDER BY last_at DESC))[1]
+    FROM (
+        SELECT *, date_trunc(%s, date AT TIME ZONE %s) AT TIME ZONE %s AS bucket
+        FROM {rollup}
+        WHERE monitor = %s AND period = %s AND date >= %s AND date < %s
+    ) AS rollup
+    GROUP BY monitor, content_type_id, object_id, bucket"""
+
+
+@transaction.atomic
+def rollup(monitor, now=None):
+    """ aggregates the complete buckets of monitor not rolled up yet, returns {period: rows} """
+    now = now or timezone.now()
+    # Buckets still receiving data of running monitors are left open
+    closed = now - datetime.timedelta(seconds=settings.RESOURCES_MONITOR_ROLLUP_DELAY)
+    tzname = timezone.get_current_timezone_name()
+    tables = {
+        'rollup': MonitorRollup._meta.db_table,
+        'data': MonitorData._meta.db_table,
+    }
+    watermarks = get_watermarks(monitor)
+    epoch = timezone.make_aware(datetime.datetime(1970, 1, 1))
+    created = {}
+    with connection.cursor() as cursor:
+        for period in PERIODS:
+            ini = watermarks.get(period, epoch)
+            end = truncate(closed, period)
+            if ini >= end:
+                created[period] = 0
+                continue
+            source = SOURCE.get(period)
+            if source is None:
+                sql = RAW_SQL.format(**tables)
+                params = (period, period, tzname, tzname, monitor, ini, end)
+            else:
+                sql = CASCADE_SQL.format(**tables)
+                params = (period, period, tzname, tzname, monitor, source, ini, end)
+            cursor.execute(sql, params)
+            created[period] = cursor.rowcount
+    return created
+
+
+def get_retention(monitor):
+    """ {tier: days}, tier is 'raw' or a rollup period """
+    retention = dict(settings.RESOURCES_MONITOR_RETENTION)
+    try:
+        backend = ServiceMonitor.get_backend(monitor)
+    except KeyError:
+        pass
+    else:
+        retention.update(backend.retention)
+    return retention
+
+
+def delete_chunked(queryset, batch_size):
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        queryset.model.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+
+
+def apply_retention(monitor, now=None, batch_size=5000):
+    """ deletes the tiers of monitor older than its retention, returns {tier: deleted} """
+    now = now or timezone.now()
+    watermarks = get_watermarks(monitor)
+    deleted = {}
+    for tier, days in get_retention(monitor).items():
+        if days is None:
+            continue
+        threshold = now - datetime.timedelta(days=days)
+        if tier == 'raw':
+            # Only samples already accounted on the hourly rollups
+            threshold = min(threshold, watermarks.get(MonitorRollup.HOUR, threshold))
+            queryset = MonitorData.objects.filter(monitor=monitor, created_at__lt=threshold)
+        else:
+            queryset = MonitorRollup.objects.filter(monitor=monitor, period=tier, date__lt=threshold)
+        deleted[tier] = delete_chunked(queryset.order_by(), batch_size)
+    return deleted
+
+
+def get_tiers(monitor, ini, end):
+    """
+    [(period, ini, end)] covering ini-end with the coarsest rollups available
+    period is None for the remaining range, that has to be read from the raw samples
+    ini should be aligned with the start of a month
+    """
+    watermarks = get_watermarks(monitor)
+    tiers = []
+    for period in reversed(PERIODS):
+        stop = min(watermarks.get(period, ini), end)
+        if stop > ini:
+            tiers.append((period, ini, stop))
+            ini = stop
+    if ini < end:
+        tiers.append((None, ini, end))
+    return tiers
+
+
+def sum_usages(dataset, ini, end):
+    """
+    {object_id: sum of values between ini and end} of dataset, from rollups when possible
+    returns None when dataset can not be answered from the rollups
+    """
+    monitor = dataset.get_monitor()
+    if monitor is None or not is_supported():
+        return None
+    totals = {}
+    for period, tier_ini, tier_end in get_tiers(monitor, ini, end):
+        if period is None:
+            values = dataset.filter(created_at__gte=tier_ini, created_at__lt=tier_end)
+            values = values.order_by().values_list('object_id').annotate(Sum('value'))
+        else:
+            values = dataset.get_rollups().filter(period=period, date__gte=tier_ini, date__lt=tier_end)
+            values = values.order_by().values_list('object_id').annotate(Sum('total'))
+        for object_id, value in values:
+            totals[object_id] = totals.get(object_id, 0) + value
+    return totals
+
+
+def monthly_sums(dataset):
+    """
+    yields (object_id, date, value, content_object_repr) with the monthly sums of dataset,
+    ordered by object and month, from rollups when possible
+    returns None when dataset can not be answered from the rollups
+    """
+    monitor = dataset.get_monitor()
+    if monitor is None or not is_supported():
+        return None
+    raw_ini = dataset.order_by().aggregate(ini=Min('created_at'))['ini']
+    rollup_ini = dataset.get_rollups().order_by().aggregate(ini=Min('date'))['ini']
+    ini = min(date for date in (raw_ini, rollup_ini, timezone.now()) if date is not None)
+    ini = truncate(ini, MonitorRollup.MONTH)
+    months = {}
+    for period, tier_ini, tier_end in get_tiers(monitor, ini, get_next(timezone.now(), MonitorRollup.HOUR)):
+        if period is None:
+            rows = dataset.filter(created_at__gte=tier_ini, created_at__lt=tier_end).values_list(
+                'object_id', 'created_at', 'value', 'content_object_repr').order_by('created_at', 'id')
+        else:
+            rows = dataset.get_rollups().filter(period=period, date__gte=tier_ini, date__lt=tier_end).values_list(
+                'object_id', 'date', 'total', 'content_object_repr').order_by('date')
+        for object_id, date, value, content_object_repr in rows.iterator():
+            date = timezone.localtime(date).date().replace(day=1)
+            key = (object_id, date)
+            try:
+                months[key][0] += value
+            except KeyError:
+                months[key] = [value, content_object_repr]
+            else:
+                months[key][1] = content_object_repr
+    return (
+        (object_id, date, value, content_object_repr)
+            for (object_id, date), (value, content_object_repr) in sorted(months.items())
+    )
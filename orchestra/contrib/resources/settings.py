@@ -4,3 +4,48 @@ from orchestra.contrib.settings import Setting
 RESOURCES_OLD_MONITOR_DATA_DAYS = Setting('RESOURCES_OLD_MONITOR_DATA_DAYS',
     40,
 )
+
+
+RESOURCES_CLEANUP_BATCH_SIZE = Setting('RESOURCES_CLEANUP_BATCH_SIZE',
+    10000,
+    help_text="Rows deleted on each transaction when compacting old monitor data."
+)
+
+
+RESOURCES_MONITOR_DATA_BATCH_SIZE = Setting('RESOURCES_MONITOR_DATA_BATCH_SIZE',
+    1000,
+    help_text="Number of monitored values stored per query."
+)
+
+
+RESOURCES_MONITOR_DATA_COPY = Setting('RESOURCES_MONITOR_DATA_COPY',
+    False,
+    help_text="Use PostgreSQL COPY for storing monitored values."
+)
+
+
+RESOURCES_MONITOR_OFFSETS_PATH = Setting('RESOURCES_MONITOR_OFFSETS_PATH',
+    '',
+    help_text=("Directory of the monitored servers where log monitors keep the position of the last "
+               "line read, only new lines are parsed on the next run. "
+               "Leave empty for parsing the whole current and rotated logs every time.")
+)
+
+
+RESOURCES_MONITOR_ROLLUP_DELAY = Setting('RESOURCES_MONITOR_ROLLUP_DELAY',
+    2*60*60,
+    help_text=("Seconds a period has to be closed before it is rolled up. Monitored data is dated "
+               "when the monitor starts, it should be longer than the slowest monitor run.")
+)
+
+
+RESOURCES_MONITOR_RETENTION = Setting('RESOURCES_MONITOR_RETENTION',
+    {
+        'raw': None,
+        'hour': 90,
+        'day': 3*365,
+        'month': None,
+    },
+    help_text=("Days monitored data is kept on each tier: raw samples and hourly, daily and monthly "
+               "rollups. None keeps it forever. Monitors can override it with their retention attribute.")
+)
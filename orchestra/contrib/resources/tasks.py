@@ -1,7 +1,6 @@
 import datetime
 
 from celery.task.schedules import crontab
-from django.db import transaction
 from django.utils import timezone
 
 from orchestra.contrib.orchestration import Operation
@@ -10,7 +9,7 @@ from orchestra.models.utils import get_model_field_path
 from orchestra.utils.sys import LockFile
 
 from . import settings
-from .backends import ServiceMonitor
+from .backends import LogMonitor, ServiceMonitor
 
 
 @task(name='resources.Monitor')
@@ -36,18 +35,21 @@ def monitor(resource_id, ids=None):
             for obj in model.objects.filter(**kwargs):
                 op = Operation(backend, obj, Operation.MONITOR)
                 monitorings.append(op)
-            logs += Operation.execute(monitorings, async=False)
+            if ids:
+                with LogMonitor.partial_run():
+                    logs += Operation.execute(monitorings, async=False)
+            else:
+                logs += Operation.execute(monitorings, async=False)
         
         kwargs = {'id__in': ids} if ids else {}
         # Update used resources and trigger resource exceeded and revovery
         triggers = []
         model = resource.content_type.model_class()
-        for obj in model.objects.filter(**kwargs):
-            data, __ = ResourceData.objects.get_or_create(obj, resource)
-            data.update()
-            if not resource.disable_trigger:
-                a = data.used
-                b = data.allocated
+        objs = {obj.pk: obj for obj in model.objects.filter(**kwargs)}
+        datas = ResourceData.objects.update_used(resource, objs.values())
+        if not resource.disable_trigger:
+            for data in datas:
+                obj = objs[data.object_id]
                 if data.used > (data.allocated or 0):
                     op = Operation(backend, obj, Operation.EXCEEDED)
                     triggers.append(op)
@@ -59,8 +61,8 @@ def monitor(resource_id, ids=None):
 
 
 @periodic_task(run_every=crontab(hour=2, minute=30), name='resources.cleanup_old_monitors')
-@transaction.atomic
-def cleanup_old_monitors(queryset=None):
+def cleanup_old_monitors(queryset=None, dry_run=False, batch_size=None):
+    """ each batch of deletions is committed on its own, dry_run only counts them """
     if queryset is None:
         from .models import MonitorData
         queryset = MonitorData.objects.all()
@@ -69,9 +71,23 @@ def cleanup_old_monitors(queryset=None):
     queryset = queryset.filter(created_at__lt=threshold)
     delete_counts = []
     for monitor in ServiceMonitor.get_plugins():
-        dataset = queryset.filter(monitor=monitor)
-        delete_count = monitor.aggregate(dataset)
+        dataset = queryset.filter(monitor=monitor.get_name())
+        delete_count = monitor.aggregate(dataset, dry_run=dry_run, batch_size=batch_size)
         delete_counts.append(
             (monitor.get_name(), delete_count)
         )
     return delete_counts
+
+
+@periodic_task(run_every=crontab(minute=15), name='resources.rollup_monitors')
+def rollup_monitors():
+    from . import rollups
+    if not rollups.is_supported():
+        return []
+    results = []
+    for monitor in ServiceMonitor.get_plugins():
+        name = monitor.get_name()
+        results.append(
+            (name, rollups.rollup(name), rollups.apply_retention(name))
+        )
+    return results
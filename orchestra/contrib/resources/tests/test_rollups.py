@@ -0,0 +1,174 @@
+import datetime
+import decimal
+from unittest import mock, skipUnless
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+
+from orchestra.contrib.accounts.models import Account
+from orchestra.utils.tests import BaseTestCase
+
+from .. import rollups, settings
+from ..models import MonitorData, MonitorRollup
+
+
+@skipUnless(connection.vendor == 'postgresql', "Rollups require PostgreSQL")
+class RollupTests(BaseTestCase):
+    """ rollups should give the same results as the raw samples """
+    DEPENDENCIES = (
+        'orchestra.contrib.orchestration',
+    )
+    monitor = 'RollupTestMonitor'
+    
+    def setUp(self):
+        self.content_type = ContentType.objects.get_for_model(Account)
+        self.now = timezone.make_aware(datetime.datetime(2016, 3, 15, 10, 30))
+        self.ini = timezone.make_aware(datetime.datetime(2016, 1, 10, 0, 10))
+        self.delay = datetime.timedelta(seconds=settings.RESOURCES_MONITOR_ROLLUP_DELAY)
+    
+    def create_sample(self, object_id, created_at, value):
+        return MonitorData.objects.create(monitor=self.monitor, content_type=self.content_type,
+            object_id=object_id, created_at=created_at, value=value,
+            content_object_repr='object %i' % object_id)
+    
+    def create_data(self):
+        """ samples of 3 objects every 40 minutes until now """
+        datas = []
+        created_at = self.ini
+        ix = 0
+        while created_at < self.now:
+            for object_id in (1, 2, 3):
+                datas.append(MonitorData(monitor=self.monitor, content_type=self.content_type,
+                    object_id=object_id, created_at=created_at,
+                    value=decimal.Decimal(ix % 13) + decimal.Decimal('0.50'),
+                    content_object_repr='object %i' % object_id))
+                ix += 1
+            created_at += datetime.timedelta(minutes=40)
+        MonitorData.objects.bulk_create(datas)
+    
+    def get_dataset(self):
+        return MonitorData.objects.filter(monitor=self.monitor, content_type=self.content_type)
+    
+    def get_raw_buckets(self, period, end):
+        """ {(object_id, date): (samples, total, minimum, maximum, last)} of the raw samples """
+        buckets = {}
+        dataset = self.get_dataset().filter(created_at__lt=end).order_by('created_at', 'id')
+        for object_id, created_at, value in dataset.values_list('object_id', 'created_at', 'value'):
+            key = (object_id, rollups.truncate(created_at, period))
+            samples, total, minimum, maximum, last = buckets.get(key, (0, 0, value, value, value))
+            buckets[key] = (samples+1, total+value, min(minimum, value), max(maximum, value), value)
+        return buckets
+    
+    def get_rollup_buckets(self, period):
+        rows = MonitorRollup.objects.filter(monitor=self.monitor, period=period).values_list(
+            'object_id', 'date', 'samples', 'total', 'minimum', 'maximum', 'last')
+        return {
+            (object_id, date): tuple(values) for object_id, date, *values in rows
+        }
+    
+    def get_raw_usages(self, ini, end):
+        dataset = self.get_dataset().filter(created_at__gte=ini, created_at__lt=end).order_by()
+        return dict(dataset.values_list('object_id').annotate(Sum('value')))
+    
+    def get_months(self):
+        month = rollups.truncate(self.ini, MonitorRollup.MONTH)
+        while month < self.now:
+            yield month, rollups.get_next(month, MonitorRollup.MONTH)
+            month = rollups.get_next(month, MonitorRollup.MONTH)
+    
+    def test_rollup(self):
+        self.create_data()
+        created = rollups.rollup(self.monitor, now=self.now)
+        closed = self.now - self.delay
+        for period in rollups.PERIODS:
+            expected = self.get_raw_buckets(period, rollups.truncate(closed, period))
+            self.assertEqual(expected, self.get_rollup_buckets(period))
+            self.assertEqual(len(expected), created[period])
+        # Incremental
+        later = self.now + datetime.timedelta(hours=5)
+        created = rollups.rollup(self.monitor, now=later)
+        self.assertEqual(0, created[MonitorRollup.MONTH])
+        closed = later - self.delay
+        for period in rollups.PERIODS:
+            expected = self.get_raw_buckets(period, rollups.truncate(closed, period))
+            self.assertEqual(expected, self.get_rollup_buckets(period))
+    
+    def test_late_data(self):
+        self.create_data()
+        rollups.rollup(self.monitor, now=self.now)
+        # Dated when the monitor started, stored after the rollup
+        late = self.now - self.delay + datetime.timedelta(minutes=1)
+        self.create_sample(1, late, decimal.Decimal('100'))
+        hour = rollups.truncate(late, MonitorRollup.HOUR)
+        hours = MonitorRollup.objects.filter(monitor=self.monitor, period=MonitorRollup.HOUR)
+        self.assertFalse(hours.filter(date=hour).exists())
+        month_ini = rollups.truncate(self.now, MonitorRollup.MONTH)
+        month_end = rollups.get_next(self.now, MonitorRollup.MONTH)
+        expected = self.get_raw_usages(month_ini, month_end)
+        self.assertEqual(expected, rollups.sum_usages(self.get_dataset(), month_ini, month_end))
+        later = self.now + datetime.timedelta(hours=3)
+        rollups.rollup(self.monitor, now=later)
+        buckets = self.get_raw_buckets(MonitorRollup.HOUR, rollups.truncate(later, MonitorRollup.HOUR))
+        self.assertEqual(buckets[(1, hour)], self.get_rollup_buckets(MonitorRollup.HOUR)[(1, hour)])
+        self.assertEqual(expected, rollups.sum_usages(self.get_dataset(), month_ini, month_end))
+    
+    def test_get_tiers(self):
+        ini = rollups.truncate(self.ini, MonitorRollup.MONTH)
+        self.assertEqual([(None, ini, self.now)], rollups.get_tiers(self.monitor, ini, self.now))
+        self.create_data()
+        rollups.rollup(self.monitor, now=self.now)
+        tiers = rollups.get_tiers(self.monitor, ini, self.now)
+        self.assertEqual(
+            [MonitorRollup.MONTH, MonitorRollup.DAY, MonitorRollup.HOUR, None],
+            [period for period, tier_ini, tier_end in tiers]
+        )
+        self.assertEqual(ini, tiers[0][1])
+        self.assertEqual(self.now, tiers[-1][2])
+        for prev, tier in zip(tiers, tiers[1:]):
+            self.assertEqual(prev[2], tier[1])
+    
+    def test_sum_usages(self):
+        self.create_data()
+        rollups.rollup(self.monitor, now=self.now)
+        for ini, end in self.get_months():
+            usages = rollups.sum_usages(self.get_dataset(), ini, end)
+            self.assertEqual(self.get_raw_usages(ini, end), usages)
+        # Filtered by object
+        ini, end = next(self.get_months())
+        usages = rollups.sum_usages(self.get_dataset().filter(object_id__in=[1, 3]), ini, end)
+        expected = self.get_raw_usages(ini, end)
+        expected.pop(2)
+        self.assertEqual(expected, usages)
+        # Datasets filtered by other fields are not answered from the rollups
+        dataset = self.get_dataset().filter(value__gt=0)
+        self.assertIsNone(rollups.sum_usages(dataset, ini, end))
+    
+    def test_monthly_sums(self):
+        self.create_data()
+        expected = []
+        for ini, end in self.get_months():
+            for object_id, value in self.get_raw_usages(ini, end).items():
+                date = timezone.localtime(ini).date()
+                expected.append((object_id, date, value, 'object %i' % object_id))
+        rollups.rollup(self.monitor, now=self.now)
+        self.assertEqual(sorted(expected), list(rollups.monthly_sums(self.get_dataset())))
+    
+    def test_apply_retention(self):
+        self.create_data()
+        expected = [self.get_raw_usages(ini, end) for ini, end in self.get_months()]
+        rollups.rollup(self.monitor, now=self.now)
+        retention = {'raw': 30, 'hour': 40, 'day': None, 'month': None}
+        with mock.patch.object(settings, 'RESOURCES_MONITOR_RETENTION', retention):
+            deleted = rollups.apply_retention(self.monitor, now=self.now)
+        threshold = self.now - datetime.timedelta(days=30)
+        self.assertLess(0, deleted['raw'])
+        self.assertFalse(self.get_dataset().filter(created_at__lt=threshold).exists())
+        self.assertTrue(self.get_dataset().filter(created_at__gte=threshold).exists())
+        hours = MonitorRollup.objects.filter(monitor=self.monitor, period=MonitorRollup.HOUR)
+        self.assertFalse(hours.filter(date__lt=self.now-datetime.timedelta(days=40)).exists())
+        self.assertNotIn('day', deleted)
+        # Usages are still answered from the remaining tiers
+        usages = [rollups.sum_usages(self.get_dataset(), ini, end) for ini, end in self.get_months()]
+        self.assertEqual(expected, usages)
@@ -12,6 +12,7 @@ class BSCWController(ServiceController):
     model = 'saas.SaaS'
     default_route_match = "saas.service == 'bscw'"
     actions = ('save', 'delete', 'validate_creation')
+    instance_attributes = ('password',)
     doc_settings = (settings,
         ('SAAS_BSCW_BSADMIN_PATH',)
     )
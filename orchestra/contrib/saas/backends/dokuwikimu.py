@@ -20,6 +20,7 @@ class DokuWikiMuController(ServiceController):
     verbose_name = _("DokuWiki multisite")
     model = 'saas.SaaS'
     default_route_match = "saas.service == 'dokuwiki'"
+    instance_attributes = ('password',)
     doc_settings = (settings, (
         'SAAS_DOKUWIKI_TEMPLATE_PATH',
         'SAAS_DOKUWIKI_FARM_PATH',
@@ -14,6 +14,7 @@ class GitLabSaaSController(ServiceController):
     default_route_match = "saas.service == 'gitlab'"
     serialize = True
     actions = ('save', 'delete', 'validate_creation')
+    instance_attributes = ('password',)
     doc_settings = (settings,
         ('SAAS_GITLAB_DOMAIN', 'SAAS_GITLAB_ROOT_PASSWORD'),
     )
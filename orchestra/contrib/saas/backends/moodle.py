@@ -49,6 +49,7 @@ class MoodleMuController(ServiceController):
     verbose_name = _("Moodle multisite")
     model = 'saas.SaaS'
     default_route_match = "saas.service == 'moodle'"
+    instance_attributes = ('password',)
     
     def save(self, webapp):
         context = self.get_context(webapp)
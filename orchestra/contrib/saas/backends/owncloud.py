@@ -104,6 +104,7 @@ class OwnCloudController(OwnClouwAPIMixin, ServiceController):
     verbose_name = _("ownCloud SaaS")
     model = 'saas.SaaS'
     default_route_match = "saas.service == 'owncloud'"
+    instance_attributes = ('password',)
     doc_settings = (settings,
         ('SAAS_OWNCLOUD_API_URL',)
     )
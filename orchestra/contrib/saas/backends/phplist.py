@@ -32,6 +32,7 @@ class PhpListSaaSController(ServiceController):
     verbose_name = _("phpList SaaS")
     model = 'saas.SaaS'
     default_route_match = "saas.service == 'phplist'"
+    instance_attributes = ('password',)
     serialize = True
     
     def error(self, msg):
@@ -11,10 +11,11 @@ from django.utils import timezone, translation
 from django.utils.translation import ugettext, ugettext_lazy as _
 
 from orchestra import plugins
+from orchestra.models.utils import bulk_update
 from orchestra.utils.humanize import text2int
 from orchestra.utils.python import AttrDict, format_exception
 
-from . import settings, helpers
+from . import settings, helpers, intervals
 
 
 class ServiceHandler(plugins.Plugin, metaclass=plugins.PluginMount):
@@ -121,6 +122,17 @@ class ServiceHandler(plugins.Plugin, metaclass=plugins.PluginMount):
                 return True
         return False
     
+    def get_rates(self, account, cache=True, context=None):
+        """ rates are read from the billing context when available """
+        if context is not None:
+            return context.get_rates(account, self.service)
+        return self.service.get_rates(account, cache=cache)
+    
+    def get_related_orders(self, account, context=None):
+        if context is not None:
+            return context.get_orders(account, self.service)
+        return account.orders.filter(service=self.service)
+    
     def get_metric(self, instance):
         if self.metric:
             safe_locals = self.get_expression_context(instance)
@@ -303,7 +315,7 @@ class ServiceHandler(plugins.Plugin, metaclass=plugins.PluginMount):
                 ini = order.billed_until or order.registered_on
                 end = order.cancelled_on or datetime.date.max
                 interval = helpers.Interval(ini, end)
-                compensations, used_compensations = helpers.compensate(interval, compensations)
+                compensations, used_compensations = intervals.compensate(interval, compensations)
                 order._compensations = used_compensations
                 for comp in used_compensations:
                     comp.order.new_billed_until = min(comp.order.billed_until, comp.ini,
@@ -359,7 +371,7 @@ class ServiceHandler(plugins.Plugin, metaclass=plugins.PluginMount):
         # Concurrent
         # Get pricing orders
         priced = {}
-        for ini, end, orders in helpers.get_chunks(porders, ini, end):
+        for ini, end, orders in intervals.get_chunks(porders, ini, end):
             size = self.get_price_size(ini, end)
             metric = len(orders)
             interval = helpers.Interval(ini=ini, end=end)
@@ -460,14 +472,15 @@ class ServiceHandler(plugins.Plugin, metaclass=plugins.PluginMount):
         orders = orders_
         
         # Compensation
-        related_orders = account.orders.filter(service=self.service)
+        context = options.get('context')
+        related_orders = self.get_related_orders(account, context=context)
         if self.payment_style == self.PREPAY and self.on_cancel == self.COMPENSATE:
             # Get orders pending for compensation
             givers = list(related_orders.givers(ini, end))
             givers = sorted(givers, key=cmp_to_key(helpers.cmp_billed_until_or_registered_on))
             orders = sorted(orders, key=cmp_to_key(helpers.cmp_billed_until_or_registered_on))
             self.assign_compensations(givers, orders, **options)
-        rates = self.get_rates(account)
+        rates = self.get_rates(account, context=context)
         has_billing_period = self.billing_period != self.NEVER
         has_pricing_period = self.get_pricing_period() != self.NEVER
         if rates and (has_billing_period or has_pricing_period):
@@ -508,6 +521,7 @@ class ServiceHandler(plugins.Plugin, metaclass=plugins.PluginMount):
     def bill_with_metric(self, orders, account, **options):
         lines = []
         bp = None
+        rates = self.get_rates(account, context=options.get('context'))
         for order in orders:
             prepay_discount = 0
             bp = self.get_billing_point(order, bp=bp, **options)
@@ -525,11 +539,11 @@ class ServiceHandler(plugins.Plugin, metaclass=plugins.PluginMount):
                         if bmetric is None:
                             bmetric = order.get_metric(order.billed_on)
                         bsize = self.get_price_size(rini, order.billed_until)
-                        prepay_discount = self.get_price(account, bmetric) * bsize
+                        prepay_discount = self.get_price(account, bmetric, rates=rates) * bsize
                         prepay_discount = round(prepay_discount, 2)
                         for cini, cend, metric in order.get_metric(rini, rend, changes=True):
                             size = self.get_price_size(cini, cend)
-                            price = self.get_price(account, metric) * size
+                            price = self.get_price(account, metric, rates=rates) * size
                             discounts = ()
                             discount = min(price, max(prepay_discount, 0))
                             prepay_discount -= price
@@ -565,7 +579,7 @@ class ServiceHandler(plugins.Plugin, metaclass=plugins.PluginMount):
                     # Changes (Mailbox disk-like)
                     for cini, cend, metric in order.get_metric(ini, bp, changes=True):
                         cini = max(recharged_until, cini)
-                        price = self.get_price(account, metric)
+                        price = self.get_price(account, metric, rates=rates)
                         discounts = ()
                         # Since the current datamodel can't guarantee to retrieve the exact
                         # state for calculating prepay_discount (service price could have change)
@@ -588,7 +602,7 @@ class ServiceHandler(plugins.Plugin, metaclass=plugins.PluginMount):
                             "Metric with prepay and pricing_period == billing_period")
                     for cini, cend in self.get_pricing_slots(ini, bp):
                         metric = order.get_metric(cini, cend)
-                        price = self.get_price(account, metric)
+                        price = self.get_price(account, metric, rates=rates)
                         discounts = ()
 #                        discount = min(price, max(prepay_discount, 0))
 #                        if discount > 0:
@@ -606,7 +620,7 @@ class ServiceHandler(plugins.Plugin, metaclass=plugins.PluginMount):
                         # Traffic Prepay
                         metric = order.get_metric(timezone.now().date())
                         if metric > 0:
-                            price = self.get_price(account, metric)
+                            price = self.get_price(account, metric, rates=rates)
                             for cini, cend in self.get_pricing_slots(ini, bp):
                                 line = self.generate_line(order, price, cini, cend, metric=metric)
                                 lines.append(line)
@@ -624,7 +638,7 @@ class ServiceHandler(plugins.Plugin, metaclass=plugins.PluginMount):
                 if self.get_pricing_period() == self.NEVER:
                     # get metric (Job-like)
                     metric = order.get_metric(date)
-                    price = self.get_price(account, metric)
+                    price = self.get_price(account, metric, rates=rates)
                     line = self.generate_line(order, price, date, metric=metric)
                     lines.append(line)
                 else:
@@ -647,5 +661,6 @@ class ServiceHandler(plugins.Plugin, metaclass=plugins.PluginMount):
                 order.billed_on = now
                 order.billed_metric = getattr(order, 'new_billed_metric', order.billed_metric)
                 order.billed_until = getattr(order, 'new_billed_until', order.billed_until)
-                order.save(update_fields=('billed_on', 'billed_until', 'billed_metric'))
+            orders = [line.order for line in lines]
+            bulk_update(orders, ('billed_on', 'billed_until', 'billed_metric'))
         return lines
@@ -0,0 +1,236 @@
+"""
+Sweep-line and interval tree versions of helpers.get_chunks() and helpers.compensate()
+
+Both produce the same results as the recursive helpers without their exponential
+(get_chunks) and quadratic (compensate) behaviour on many overlapping orders.
+"""
+import bisect
+import heapq
+from collections import namedtuple
+from functools import cmp_to_key
+
+from . import helpers
+
+
+class IntervalTree(object):
+    """
+    Static centered interval tree of objects with ini and end attributes
+    Finds the intervals overlapping a range in O(log n + hits)
+    """
+    def __init__(self, intervals):
+        intervals = [interval for interval in intervals if interval.ini < interval.end]
+        self.left = None
+        self.right = None
+        self.center = None
+        self.by_ini = []
+        self.by_end = []
+        if not intervals:
+            return
+        points = sorted(set(point for interval in intervals for point in (interval.ini, interval.end)))
+        self.center = points[(len(points)-1)//2]
+        left = []
+        right = []
+        center = []
+        for interval in intervals:
+            if interval.end <= self.center:
+                left.append(interval)
+            elif interval.ini > self.center:
+                right.append(interval)
+            else:
+                center.append(interval)
+        self.by_ini = sorted(center, key=lambda i: i.ini)
+        self.by_end = sorted(center, key=lambda i: i.end, reverse=True)
+        if left:
+            self.left = IntervalTree(left)
+        if right:
+            self.right = IntervalTree(right)
+    
+    def overlap(self, ini, end):
+        """ intervals with a positive overlap with ini-end """
+        result = []
+        if ini >= end:
+            return result
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            if node.center is None:
+                continue
+            if end <= node.center:
+                for interval in node.by_ini:
+                    if interval.ini >= end:
+                        break
+                    result.append(interval)
+                if node.left:
+                    nodes.append(node.left)
+            elif ini >= node.center:
+                for interval in node.by_end:
+                    if interval.end <= ini:
+                        break
+                    result.append(interval)
+                if node.right:
+                    nodes.append(node.right)
+            else:
+                result.extend(node.by_ini)
+                if node.left:
+                    nodes.append(node.left)
+                if node.right:
+                    nodes.append(node.right)
+        return result
+
+
+def get_chunks(porders, ini, end):
+    """
+    Splits ini-end into chunks with the orders active on each of them, in porders order
+    same result as helpers.get_chunks(), chunks sorted by date
+    """
+    relevant = []
+    for position, order in enumerate(porders):
+        bu = getattr(order, 'new_billed_until', order.billed_until)
+        if bu and bu > ini and order.registered_on < end:
+            relevant.append((position, order, order.registered_on, bu))
+    if not ini < end:
+        return [[ini, end, [order for __, order, __, __ in relevant]]]
+    points = set([ini, end])
+    for position, order, registered_on, bu in relevant:
+        if registered_on > ini:
+            points.add(registered_on)
+        if bu < end:
+            points.add(bu)
+    points = sorted(points)
+    index = {point: ix for ix, point in enumerate(points)}
+    starts = [[] for point in points]
+    ends = [[] for point in points]
+    zero_length = []
+    for position, order, registered_on, bu in relevant:
+        start, stop = max(registered_on, ini), min(bu, end)
+        if start < stop:
+            starts[index[start]].append(position)
+            ends[index[stop]].append(position)
+        elif start == stop:
+            zero_length.append((position, order, registered_on))
+    orders = {position: order for position, order, __, __ in relevant}
+    chunks = []
+    active = []
+    for ix, point in enumerate(points[:-1]):
+        for position in ends[ix]:
+            del active[bisect.bisect_left(active, position)]
+        for position in starts[ix]:
+            bisect.insort(active, position)
+        chunks.append([point, points[ix+1], [orders[position] for position in active]])
+    # Orders with registered_on == billed_until produce an empty chunk when no previous
+    # order has already split the period on that date
+    for position, order, point in zero_length:
+        for previous, __, registered_on, bu in relevant:
+            if previous >= position or registered_on == point or bu == point:
+                break
+        if previous < position:
+            continue
+        members = [
+            (other, other_order) for other, other_order, registered_on, bu in relevant
+                if registered_on < point < bu
+        ]
+        members.append((position, order))
+        chunks.append([point, point, [member for __, member in sorted(members, key=lambda m: m[0])]])
+    chunks.sort(key=lambda chunk: (chunk[0], chunk[1]))
+    return chunks
+
+
+Entry = namedtuple('Entry', ('ini', 'end', 'index'))
+
+
+class Rank(object):
+    """
+    Order of helpers.get_intersections() after its successive stable sorts:
+    compared by current length, then by the previous lengths, then by position.
+    history is a tuple of (step, length) changes.
+    """
+    __slots__ = ('history', 'index')
+    
+    def __init__(self, history, index):
+        self.history = history
+        self.index = index
+    
+    def compare(self, other):
+        a, b = self.history, other.history
+        ia, ib = len(a)-1, len(b)-1
+        while True:
+            (sa, la), (sb, lb) = a[ia], b[ib]
+            if la != lb:
+                return -1 if la < lb else 1
+            step = max(sa, sb)
+            if step == 0:
+                break
+            if sa == step:
+                ia -= 1
+            if sb == step:
+                ib -= 1
+        return (self.index > other.index) - (self.index < other.index)
+    
+    def __lt__(self, other):
+        # Greatest first on a heapq
+        return self.compare(other) > 0
+
+
+def compensate(order, compensations):
+    """
+    Same as helpers.compensate(), the compensation with the largest intersection is applied
+    first. Only the compensations overlapping an applied interval are measured again.
+    """
+    compensations = list(compensations)
+    if not compensations:
+        return [], []
+    remaining = [order]
+    
+    def overlap(compensation):
+        """ days of compensation intersecting the remaining (sorted, disjoint) intervals """
+        length = 0
+        ix = bisect.bisect_right([interval.end for interval in remaining], compensation.ini)
+        while ix < len(remaining) and remaining[ix].ini < compensation.end:
+            interval = remaining[ix]
+            days = (min(interval.end, compensation.end)-max(interval.ini, compensation.ini)).days
+            length += max(days, 0)
+            ix += 1
+        return length
+    
+    lengths = [overlap(compensation) for compensation in compensations]
+    history = [[(0, length)] for length in lengths]
+    versions = [0] * len(compensations)
+    alive = [True] * len(compensations)
+    tree = IntervalTree(
+        Entry(compensation.ini, compensation.end, ix) for ix, compensation in enumerate(compensations)
+    )
+    heap = [(Rank(tuple(history[ix]), ix), ix, 0) for ix in range(len(compensations))]
+    heapq.heapify(heap)
+    applied_compensations = []
+    remaining_compensations = []
+    step = 0
+    while heap:
+        rank, ix, version = heap[0]
+        if not alive[ix] or version != versions[ix]:
+            heapq.heappop(heap)
+            continue
+        if lengths[ix] <= 0:
+            break
+        heapq.heappop(heap)
+        alive[ix] = False
+        applied, remaining, remaining_compensation = helpers.apply_compensation(
+            remaining, compensations[ix])
+        remaining_compensations += remaining_compensation
+        applied_compensations += applied
+        step += 1
+        changed = set()
+        for interval in applied:
+            for entry in tree.overlap(interval.ini, interval.end):
+                if alive[entry.index]:
+                    changed.add(entry.index)
+        for cix in changed:
+            length = overlap(compensations[cix])
+            if length != lengths[cix]:
+                lengths[cix] = length
+                history[cix].append((step, length))
+                versions[cix] += 1
+                heapq.heappush(heap, (Rank(tuple(history[cix]), cix), cix, versions[cix]))
+    pending = [ix for ix in range(len(compensations)) if alive[ix]]
+    pending.sort(key=cmp_to_key(lambda a, b: Rank(history[a], a).compare(Rank(history[b], b))))
+    remaining_compensations += [compensations[ix] for ix in pending]
+    return remaining_compensations, applied_compensations
@@ -6,7 +6,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
 
 from orchestra.contrib.systemusers.models import SystemUser
-from orchestra.contrib.plans.models import Plan
+from orchestra.contrib.plans.models import Plan, RateList
 from orchestra.utils.tests import BaseTestCase
 
 from .. import helpers
@@ -535,3 +535,29 @@ class HandlerTests(BaseTestCase):
             },
         ]
         self.validate_results(rates, results)
+    
+    def test_preloaded_rates(self):
+        service = self.create_ftp_service()
+        account = self.create_account()
+        other = self.create_account()
+        defaultplan = Plan.objects.create(name='DEFAULT', is_default=True)
+        service.rates.create(plan=defaultplan, quantity=1, price=5)
+        dupeplan = Plan.objects.create(name='DUPE', allow_multiple=True)
+        service.rates.create(plan=dupeplan, quantity=1, price=0)
+        service.rates.create(plan=dupeplan, quantity=3, price=9)
+        account.plans.create(plan=dupeplan)
+        account.plans.create(plan=dupeplan)
+        other.plans.create(plan=defaultplan)
+        preloaded = service.rates.by_accounts([account.pk, other.pk])
+        for acc in (account, other):
+            rates = list(service.get_rates(acc, cache=False))
+            self.assertEqual(rates, preloaded[(acc.pk, service.pk)])
+            for metric in (1, 5, 30):
+                self.validate_results(
+                    [{'price': rate.price, 'quantity': rate.quantity}
+                        for rate in service.rate_method(service.get_rates(acc, cache=False), metric)],
+                    service.rate_method(preloaded[(acc.pk, service.pk)], metric)
+                )
+        unsorted = RateList(reversed(preloaded[(account.pk, service.pk)]))
+        with self.assertRaises(ValueError):
+            service.rate_method(unsorted, 5)
@@ -0,0 +1,108 @@
+import datetime
+import random
+
+from django.test import SimpleTestCase
+
+from .. import helpers, intervals
+
+
+class Order(object):
+    """ Fake order for testing """
+    last_id = 0
+    
+    def __init__(self, registered_on, billed_until=None):
+        self.registered_on = registered_on
+        self.billed_until = billed_until
+        type(self).last_id += 1
+        self.id = self.last_id
+        self.pk = self.id
+
+
+class IntervalsTests(SimpleTestCase):
+    """ property tests: same results as the recursive helpers on random orders """
+    iterations = 2000
+    
+    def setUp(self):
+        self.random = random.Random(2016)
+        self.today = datetime.date(2016, 1, 1)
+    
+    def get_date(self, days):
+        return self.today + datetime.timedelta(days=days)
+    
+    def get_orders(self, num, span):
+        orders = []
+        for ix in range(num):
+            registered_on = self.get_date(self.random.randint(0, span))
+            kind = self.random.random()
+            if kind < 0.15:
+                billed_until = None
+            elif kind < 0.25:
+                # Registered and cancelled the same day
+                billed_until = registered_on
+            else:
+                billed_until = registered_on + datetime.timedelta(days=self.random.randint(1, span))
+            order = Order(registered_on, billed_until=billed_until)
+            if billed_until and self.random.random() < 0.3:
+                order.new_billed_until = billed_until + datetime.timedelta(
+                    days=self.random.randint(0, span))
+            orders.append(order)
+        return orders
+    
+    def get_compensations(self, num, span):
+        compensations = []
+        for ix in range(num):
+            ini = self.get_date(self.random.randint(0, span))
+            end = ini + datetime.timedelta(days=self.random.randint(0, span))
+            compensations.append(helpers.Interval(ini, end, Order(ini)))
+        return compensations
+    
+    def serialize_chunks(self, chunks):
+        return sorted((ini, end, [order.id for order in orders]) for ini, end, orders in chunks)
+    
+    def serialize_intervals(self, intervals):
+        return [(i.ini, i.end, getattr(i.order, 'id', None)) for i in intervals]
+    
+    def test_interval_tree(self):
+        for ix in range(self.iterations):
+            span = self.random.choice([5, 20, 100])
+            compensations = self.get_compensations(self.random.randint(0, 20), span)
+            tree = intervals.IntervalTree(compensations)
+            ini = self.get_date(self.random.randint(-5, span))
+            end = ini + datetime.timedelta(days=self.random.randint(0, span))
+            expected = [c for c in compensations if c.intersect(helpers.Interval(ini, end))]
+            self.assertEqual(
+                sorted(map(id, expected)), sorted(map(id, tree.overlap(ini, end))))
+    
+    def test_get_chunks(self):
+        for ix in range(self.iterations):
+            span = self.random.choice([5, 20, 100])
+            porders = self.get_orders(self.random.randint(0, 12), span)
+            ini = self.get_date(self.random.randint(-3, span))
+            end = ini + datetime.timedelta(days=self.random.randint(-1, span))
+            self.assertEqual(
+                self.serialize_chunks(helpers.get_chunks(porders, ini, end)),
+                self.serialize_chunks(intervals.get_chunks(porders, ini, end))
+            )
+    
+    def test_compensate(self):
+        for ix in range(self.iterations):
+            span = self.random.choice([5, 20, 100])
+            compensations = self.get_compensations(self.random.randint(0, 25), span)
+            ini = self.get_date(self.random.randint(-5, span))
+            end = ini + datetime.timedelta(days=self.random.randint(0, 2*span))
+            order = helpers.Interval(ini, end)
+            remaining, applied = helpers.compensate(order, list(compensations))
+            sremaining, sapplied = intervals.compensate(order, list(compensations))
+            self.assertEqual(self.serialize_intervals(remaining), self.serialize_intervals(sremaining))
+            self.assertEqual(self.serialize_intervals(applied), self.serialize_intervals(sapplied))
+    
+    def test_many_concurrent_orders(self):
+        """ would hit the recursion limit with helpers.get_chunks() """
+        porders = []
+        for ix in range(2000):
+            registered_on = self.get_date(ix % 365)
+            porders.append(Order(registered_on, registered_on+datetime.timedelta(days=400)))
+        chunks = intervals.get_chunks(porders, self.today, self.get_date(800))
+        self.assertEqual(self.today, chunks[0][0])
+        self.assertEqual(self.get_date(800), chunks[-1][1])
+        self.assertEqual(2000, max(len(orders) for ini, end, orders in chunks))
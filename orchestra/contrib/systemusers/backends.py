@@ -5,7 +5,7 @@ import textwrap
 from django.utils.translation import ugettext_lazy as _
 
 from orchestra.contrib.orchestration import ServiceController, replace
-from orchestra.contrib.resources import ServiceMonitor
+from orchestra.contrib.resources import LogMonitor, ServiceMonitor
 
 from . import settings
 
@@ -18,6 +18,10 @@ class UNIXUserController(ServiceController):
     verbose_name = _("UNIX user")
     model = 'systemusers.SystemUser'
     actions = ('save', 'delete', 'set_permission', 'validate_paths_exist', 'create_link')
+    instance_attributes = (
+        'set_perm_action', 'set_perm_base_home', 'set_perm_home_extension', 'set_perm_perms',
+        'paths_to_validate', 'create_link_target', 'create_link_name',
+    )
     doc_settings = (settings, (
         'SYSTEMUSERS_DEFAULT_GROUP_MEMBERS',
         'SYSTEMUSERS_MOVE_ON_DELETE_PATH',
@@ -278,7 +282,7 @@ class UNIXUserDisk(ServiceMonitor):
         return replace(context, "'", '"')
 
 
-class Exim4Traffic(ServiceMonitor):
+class Exim4Traffic(LogMonitor):
     """
     Exim4 mainlog parser for mails sent on the webserver by system users (e.g. via PHP <tt>mail()</tt>)
     """
@@ -292,10 +296,11 @@ class Exim4Traffic(ServiceMonitor):
     )
     
     def prepare(self):
+        self.append(self.get_log_reader())
         mainlog = settings.SYSTEMUSERS_MAIL_LOG_PATH
         context = {
             'current_date': self.current_date.strftime("%Y-%m-%d %H:%M:%S %Z"),
-            'mainlogs': str((mainlog, mainlog+'.1')),
+            'mainlog': mainlog,
         }
         self.append(textwrap.dedent("""\
             import re
@@ -309,10 +314,13 @@ class Exim4Traffic(ServiceMonitor):
                 date = date.astimezone(tzlocal)
                 return date
             
-            mainlogs = {mainlogs}
+            mainlog = '{mainlog}'
             # Use local timezone
             end_date = to_local_timezone('{current_date}')
             end_date = int(end_date.strftime('%Y%m%d%H%M%S'))
+            if consume:
+                # Lines are read only once, the ones logged while running belong to this period
+                end_date = 99999999999999
             users = {{}}
             
             def prepare(object_id, username, ini_date):
@@ -321,26 +329,21 @@ class Exim4Traffic(ServiceMonitor):
                 ini_date = int(ini_date.strftime('%Y%m%d%H%M%S'))
                 users[username] = [ini_date, object_id, 0]
             
-            def monitor(users, end_date, mainlogs):
+            def monitor(users, end_date, mainlog):
                 user_regex = re.compile(r' U=([^ ]+) ')
-                for mainlog in mainlogs:
-                    try:
-                        with open(mainlog, 'r') as mainlog:
-                            for line in mainlog.readlines():
-                                if ' <= ' in line and 'P=local' in line:
-                                    username = user_regex.search(line).groups()[0]
-                                    try:
-                                        sender = users[username]
-                                    except KeyError:
-                                        continue
-                                    else:
-                                        date, time, id, __, __, user, protocol, size = line.split()[:8]
-                                        date = date.replace('-', '')
-                                        date += time.replace(':', '')
-                                        if sender[0] < int(date) < end_date:
-                                            sender[2] += int(size[2:])
-                    except IOError as e:
-                        sys.stderr.write(e)
+                for line in read_logs(mainlog):
+                    if ' <= ' in line and 'P=local' in line:
+                        username = user_regex.search(line).groups()[0]
+                        try:
+                            sender = users[username]
+                        except KeyError:
+                            continue
+                        else:
+                            date, time, id, __, __, user, protocol, size = line.split()[:8]
+                            date = date.replace('-', '')
+                            date += time.replace(':', '')
+                            if sender[0] < int(date) < end_date:
+                                sender[2] += int(size[2:])
                 
                 for username, opts in users.iteritems():
                     __, object_id, size = opts
@@ -349,7 +352,8 @@ class Exim4Traffic(ServiceMonitor):
         )
     
     def commit(self):
-        self.append('monitor(users, end_date, mainlogs)')
+        self.append('monitor(users, end_date, mainlog)')
+        self.append('save_offsets()')
     
     def monitor(self, user):
         context = self.get_context(user)
@@ -364,7 +368,7 @@ class Exim4Traffic(ServiceMonitor):
         return context
 
 
-class VsFTPdTraffic(ServiceMonitor):
+class VsFTPdTraffic(LogMonitor):
     """
     vsFTPd log parser.
     """
@@ -378,10 +382,11 @@ class VsFTPdTraffic(ServiceMonitor):
     )
     
     def prepare(self):
+        self.append(self.get_log_reader())
         vsftplog = settings.SYSTEMUSERS_FTP_LOG_PATH
         context = {
             'current_date': self.current_date.strftime("%Y-%m-%d %H:%M:%S %Z"),
-            'vsftplogs': str((vsftplog, vsftplog+'.1')),
+            'vsftplog': vsftplog,
         }
         self.append(textwrap.dedent("""\
             import re
@@ -395,10 +400,13 @@ class VsFTPdTraffic(ServiceMonitor):
                 date = date.astimezone(tzlocal)
                 return date
             
-            vsftplogs = {vsftplogs}
+            vsftplog = '{vsftplog}'
             # Use local timezone
             end_date = to_local_timezone('{current_date}')
             end_date = int(end_date.strftime('%Y%m%d%H%M%S'))
+            if consume:
+                # Lines are read only once, the ones logged while running belong to this period
+                end_date = 99999999999999
             users = {{}}
             months = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
             months = dict((m, '%02d' % n) for n, m in enumerate(months, 1))
@@ -409,27 +417,22 @@ class VsFTPdTraffic(ServiceMonitor):
                 ini_date = int(ini_date.strftime('%Y%m%d%H%M%S'))
                 users[username] = [ini_date, object_id, 0]
             
-            def monitor(users, end_date, months, vsftplogs):
+            def monitor(users, end_date, months, vsftplog):
                 user_regex = re.compile(r'\] \[([^ ]+)\] (OK|FAIL) ')
                 bytes_regex = re.compile(r', ([0-9]+) bytes, ')
-                for vsftplog in vsftplogs:
-                    try:
-                        with open(vsftplog, 'r') as vsftplog:
-                            for line in vsftplog.readlines():
-                                if ' bytes, ' in line:
-                                    username = user_regex.search(line).groups()[0]
-                                    try:
-                                        user = users[username]
-                                    except KeyError:
-                                        continue
-                                    else:
-                                        __, month, day, time, year = line.split()[:5]
-                                        date = year + months[month] + day + time.replace(':', '')
-                                        if user[0] < int(date) < end_date:
-                                            bytes = bytes_regex.search(line).groups()[0]
-                                            user[2] += int(bytes)
-                    except IOError as e:
-                        sys.stderr.write(e)
+                for line in read_logs(vsftplog):
+                    if ' bytes, ' in line:
+                        username = user_regex.search(line).groups()[0]
+                        try:
+                            user = users[username]
+                        except KeyError:
+                            continue
+                        else:
+                            __, month, day, time, year = line.split()[:5]
+                            date = year + months[month] + day + time.replace(':', '')
+                            if user[0] < int(date) < end_date:
+                                bytes = bytes_regex.search(line).groups()[0]
+                                user[2] += int(bytes)
                 
                 for username, opts in users.items():
                     __, object_id, size = opts
@@ -442,7 +445,8 @@ class VsFTPdTraffic(ServiceMonitor):
         self.append("prepare(%(object_id)s, '%(username)s', '%(last_date)s')" % context)
     
     def commit(self):
-        self.append('monitor(users, end_date, months, vsftplogs)')
+        self.append('monitor(users, end_date, months, vsftplog)')
+        self.append('save_offsets()')
     
     def get_context(self, user):
         context = {
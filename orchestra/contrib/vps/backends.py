@@ -9,6 +9,7 @@ from . import settings
 
 class ProxmoxOVZ(ServiceController):
     model = 'vps.VPS'
+    instance_attributes = ('password',)
     
     RESOURCES = (
         ('memory', 'mem'),
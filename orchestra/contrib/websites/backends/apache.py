@@ -6,7 +6,7 @@ from django.template import Template, Context
 from django.utils.translation import ugettext_lazy as _
 
 from orchestra.contrib.orchestration import ServiceController
-from orchestra.contrib.resources import ServiceMonitor
+from orchestra.contrib.resources import LogMonitor, ServiceMonitor
 
 from .. import settings
 from ..utils import normurlpath
@@ -424,74 +424,105 @@ class Apache2Controller(ServiceController):
         context.update(content_context)
 
 
-class Apache2Traffic(ServiceMonitor):
+class Apache2Traffic(LogMonitor):
     """
     Parses apache logs,
     looking for the size of each request on the last word of the log line.
+    All logs are parsed by a single process, reading each file only once.
     """
     model = 'websites.Website'
     resource = ServiceMonitor.TRAFFIC
     verbose_name = _("Apache 2 Traffic")
+    script_executable = '/usr/bin/python'
     monthly_sum_old_values = True
     doc_settings = (settings,
         ('WEBSITES_TRAFFIC_IGNORE_HOSTS',)
     )
     
     def prepare(self):
-        super(Apache2Traffic, self).prepare()
-        ignore_hosts = '\\|'.join(settings.WEBSITES_TRAFFIC_IGNORE_HOSTS)
+        self.append(self.get_log_reader())
+        ignore_hosts = '|'.join(re.escape(host) for host in settings.WEBSITES_TRAFFIC_IGNORE_HOSTS)
         context = {
             'current_date': self.current_date.strftime("%Y-%m-%d %H:%M:%S %Z"),
-            'ignore_hosts': '-v "%s"' % ignore_hosts if ignore_hosts else '',
+            'ignore_hosts': repr(ignore_hosts),
         }
         self.append(textwrap.dedent("""\
-            function monitor () {
-                OBJECT_ID=$1
-                INI_DATE=$(date "+%%Y%%m%%d%%H%%M%%S" -d "$2")
-                END_DATE=$(date '+%%Y%%m%%d%%H%%M%%S' -d '%(current_date)s')
-                LOG_FILE="$3"
-                {
-                    { grep %(ignore_hosts)s ${LOG_FILE} || echo -e '\\r'; } \\
-                        | awk -v ini="${INI_DATE}" -v end="${END_DATE}" '
-                            BEGIN {
-                                sum = 0
-                                months["Jan"] = "01"
-                                months["Feb"] = "02"
-                                months["Mar"] = "03"
-                                months["Apr"] = "04"
-                                months["May"] = "05"
-                                months["Jun"] = "06"
-                                months["Jul"] = "07"
-                                months["Aug"] = "08"
-                                months["Sep"] = "09"
-                                months["Oct"] = "10"
-                                months["Nov"] = "11"
-                                months["Dec"] = "12"
-                            } {
-                                # date = [11/Jul/2014:13:50:41
-                                date = substr($4, 2)
-                                year = substr(date, 8, 4)
-                                month = months[substr(date, 4, 3)];
-                                day = substr(date, 1, 2)
-                                hour = substr(date, 13, 2)
-                                minute = substr(date, 16, 2)
-                                second = substr(date, 19, 2)
-                                line_date = year month day hour minute second
-                                if ( line_date > ini && line_date < end)
-                                    sum += $NF
-                            } END {
-                                print sum
-                            }' || [[ $? == 1 ]] && true
-                } | xargs echo ${OBJECT_ID}
-            }""") % context)
+            import re
+            import sys
+            from datetime import datetime
+            from dateutil import tz
+            
+            def to_local_timezone(date, tzlocal=tz.tzlocal()):
+                date = datetime.strptime(date, '%Y-%m-%d %H:%M:%S %Z')
+                date = date.replace(tzinfo=tz.tzutc())
+                date = date.astimezone(tzlocal)
+                return date
+            
+            # Use local timezone
+            end_date = to_local_timezone('{current_date}')
+            end_date = int(end_date.strftime('%Y%m%d%H%M%S'))
+            if consume:
+                # Lines are read only once, the ones logged while running belong to this period
+                end_date = 99999999999999
+            ignore_hosts = {ignore_hosts}
+            months = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+            months = dict((m, '%02d' % n) for n, m in enumerate(months, 1))
+            # {{log_file: [[ini_date, object_id, size]]}}
+            logs = {{}}
+            
+            def prepare(object_id, log_file, ini_date):
+                global logs
+                ini_date = to_local_timezone(ini_date)
+                ini_date = int(ini_date.strftime('%Y%m%d%H%M%S'))
+                logs.setdefault(log_file, []).append([ini_date, object_id, 0])
+            
+            def parse_date(date, months=months):
+                # [11/Jul/2014:13:50:41
+                return int(date[8:12] + months[date[4:7]] + date[1:3] + date[13:15] + date[16:18] + date[19:21])
+            
+            def monitor(logs, end_date, ignore_hosts):
+                ignore = re.compile(ignore_hosts).search if ignore_hosts else None
+                for log_file, sites in logs.items():
+                    ini_date = min(site[0] for site in sites)
+                    last_date, line_date = None, 0
+                    for line in read_logs(log_file):
+                        if ignore and ignore(line):
+                            continue
+                        fields = line.split()
+                        if len(fields) < 5:
+                            continue
+                        size = fields[-1]
+                        if not size.isdigit():
+                            continue
+                        # Consecutive lines usually share the same date
+                        if fields[3] != last_date:
+                            last_date = fields[3]
+                            try:
+                                line_date = parse_date(last_date)
+                            except (KeyError, ValueError):
+                                line_date = 0
+                        if ini_date < line_date < end_date:
+                            size = int(size)
+                            for site in sites:
+                                if site[0] < line_date:
+                                    site[2] += size
+                for sites in logs.values():
+                    for __, object_id, size in sites:
+                        sys.stdout.write('%s %s\\n' % (object_id, size))
+            """).format(**context)
+        )
     
     def monitor(self, site):
         context = self.get_context(site)
-        self.append('monitor {object_id} "{last_date}" {log_file}'.format(**context))
+        self.append("prepare(%(object_id)s, '%(log_file)s', '%(last_date)s')" % context)
+    
+    def commit(self):
+        self.append('monitor(logs, end_date, ignore_hosts)')
+        self.append('save_offsets()')
     
     def get_context(self, site):
         return {
-            'log_file': '%s{,.1}' % site.get_www_access_log_path(),
+            'log_file': site.get_www_access_log_path(),
             'last_date': self.get_last_date(site.pk).strftime("%Y-%m-%d %H:%M:%S %Z"),
             'object_id': site.pk,
         }
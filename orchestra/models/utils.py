@@ -1,7 +1,12 @@
 from django.conf import settings
 from django.core.exceptions import FieldDoesNotExist
 from django.apps import apps
+from django.db import connections, router
+from django.db.models import AutoField
+from django.db.models.base import ModelState
+from django.db.models.sql import InsertQuery
 import importlib
+from collections import OrderedDict
 
 
 def get_model(label, import_module=True):
@@ -57,3 +62,80 @@ def get_model_field_path(origin, target):
                 new_path.append(field.name)
                 queue.append((new_model, new_path))
     raise LookupError("Path does not exists between '%s' and '%s' models" % (origin, target))
+
+
+def snapshot(obj, attributes=()):
+    """
+    Lightweight copy of obj with its concrete field values and the provided dynamic attributes
+    Related objects and querysets are not copied, they are lazily loaded when accessed.
+    """
+    cls = type(obj)
+    copy = cls.__new__(cls)
+    values = obj.__dict__
+    for field in obj._meta.concrete_fields:
+        # deferred fields are not present
+        if field.attname in values:
+            copy.__dict__[field.attname] = values[field.attname]
+    copy._state = ModelState()
+    copy._state.db = obj._state.db
+    copy._state.adding = obj._state.adding
+    for attribute in attributes:
+        if attribute in values:
+            copy.__dict__[attribute] = values[attribute]
+    return copy
+
+
+def bulk_update(objs, fields, batch_size=1000):
+    """ saves fields of objs, objects with the same values are updated with a single query """
+    objs = list(objs)
+    if not objs:
+        return
+    model = type(objs[0])
+    attnames = [model._meta.get_field(name).attname for name in fields]
+    groups = OrderedDict()
+    for obj in objs:
+        values = tuple(getattr(obj, attname) for attname in attnames)
+        groups.setdefault(values, []).append(obj.pk)
+    for values, pks in groups.items():
+        for ix in range(0, len(pks), batch_size):
+            model._base_manager.filter(pk__in=pks[ix:ix+batch_size]).update(
+                **dict(zip(attnames, values)))
+
+
+def bulk_create(objs, batch_size=1000, using=None):
+    """
+    bulk_create() that also sets the primary keys of objs
+    uses INSERT ... RETURNING when supported, one insert per object otherwise
+    """
+    objs = list(objs)
+    if not objs:
+        return objs
+    model = type(objs[0])
+    if using is None:
+        using = router.db_for_write(model, instance=objs[0])
+    connection = connections[using]
+    if getattr(connection.features, 'can_return_ids_from_bulk_insert', False):
+        # Django >= 1.10 already does it
+        return model._base_manager.using(using).bulk_create(objs, batch_size=batch_size)
+    if not connection.features.can_return_id_from_insert:
+        for obj in objs:
+            obj.save(force_insert=True, using=using)
+        return objs
+    opts = model._meta
+    fields = [field for field in opts.concrete_fields if not isinstance(field, AutoField)]
+    returning = ' RETURNING %s.%s' % (
+        connection.ops.quote_name(opts.db_table), connection.ops.quote_name(opts.pk.column))
+    with connection.cursor() as cursor:
+        for ix in range(0, len(objs), batch_size):
+            batch = objs[ix:ix+batch_size]
+            query = InsertQuery(model)
+            query.insert_values(fields, batch)
+            for statement, params in query.get_compiler(using=using).as_sql():
+                cursor.execute(statement + returning, params)
+                # PostgreSQL does not document it, but returns the rows of a multi-row
+                # INSERT ... VALUES in VALUES order, Django >= 1.10 bulk_create() relies on it too
+                for obj, row in zip(batch, cursor.fetchall()):
+                    obj.pk = row[0]
+                    obj._state.adding = False
+                    obj._state.db = using
+    return objs
@@ -90,3 +90,9 @@ ORCHESTRA_SSH_CONTROL_PATH = Setting('ORCHESTRA_SSH_CONTROL_PATH',
     '~/.ssh/orchestra-%r-%h-%p',
     help_text='Location for the control socket used by the multiplexed sessions, used for SSH connection reuse.'
 )
+
+
+ORCHESTRA_PDF_RENDER_WORKERS = Setting('ORCHESTRA_PDF_RENDER_WORKERS',
+    0,
+    help_text="Number of HTML to PDF conversions run in parallel, <tt>0</tt> uses one per CPU core."
+)
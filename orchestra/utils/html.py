@@ -1,4 +1,9 @@
+import atexit
+import os
+import subprocess
 import textwrap
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from django.templatetags.static import static
 from django.utils.translation import ugettext_lazy as _
@@ -6,25 +11,85 @@ from django.utils.translation import ugettext_lazy as _
 from orchestra.utils.sys import run
 
 
+class PDFRenderer(object):
+    """
+    Converts HTML to PDF with wkhtmltopdf
+    
+    All conversions share one persistent Xvfb display instead of running xvfb-run
+    each time, and render_many() renders on a pool of workers.
+    """
+    screen = '2480x3508x16'
+    
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.display = None
+        self.xvfb = None
+        self.executor = None
+        self.lock = threading.Lock()
+        atexit.register(self.terminate)
+    
+    def get_display(self):
+        with self.lock:
+            if self.xvfb is None or self.xvfb.poll() is not None:
+                read, write = os.pipe()
+                self.xvfb = subprocess.Popen(
+                    ['Xvfb', '-displayfd', str(write), '-screen', '0', self.screen, '-nolisten', 'tcp'],
+                    pass_fds=(write,), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                os.close(write)
+                # Xvfb writes the display number once it is ready
+                with os.fdopen(read) as displayfd:
+                    display = displayfd.readline().strip()
+                if not display:
+                    self.xvfb.kill()
+                    self.xvfb.wait()
+                    self.xvfb = None
+                    raise OSError("Xvfb did not start, no display number was read.")
+                self.display = ':%s' % display
+            return self.display
+    
+    def terminate(self):
+        if self.xvfb is not None and self.xvfb.poll() is None:
+            self.xvfb.terminate()
+    
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                from .. import settings
+                workers = self.workers or settings.ORCHESTRA_PDF_RENDER_WORKERS or os.cpu_count()
+                self.executor = ThreadPoolExecutor(max_workers=workers)
+            return self.executor
+    
+    def render(self, html, pagination=False):
+        context = {
+            'display': self.get_display(),
+            'pagination': textwrap.dedent("""\
+                --footer-center "Page [page] of [topage]" \\
+                --footer-font-name sans \\
+                --footer-font-size 7 \\
+                --footer-spacing 7"""
+            ) if pagination else '',
+        }
+        cmd = textwrap.dedent("""\
+            PATH=$PATH:/usr/local/bin/
+            DISPLAY=%(display)s wkhtmltopdf -q \\
+                --use-xserver \\
+                %(pagination)s \\
+                --margin-bottom 22 \\
+                --margin-top 20 - - \
+            """) % context
+        return run(cmd, stdin=html.encode('utf-8')).stdout
+    
+    def render_many(self, documents):
+        """ renders [(html, pagination)] in parallel, yields the PDFs in the same order """
+        return self.get_executor().map(lambda document: self.render(*document), documents)
+
+
+renderer = PDFRenderer()
+
+
 def html_to_pdf(html, pagination=False):
     """ converts HTL to PDF using wkhtmltopdf """
-    context = {
-        'pagination': textwrap.dedent("""\
-            --footer-center "Page [page] of [topage]" \\
-            --footer-font-name sans \\
-            --footer-font-size 7 \\
-            --footer-spacing 7"""
-        ) if pagination else '',
-    }
-    cmd = textwrap.dedent("""\
-        PATH=$PATH:/usr/local/bin/
-        xvfb-run -a -s "-screen 0 2480x3508x16" wkhtmltopdf -q \\
-            --use-xserver \\
-            %(pagination)s \\
-            --margin-bottom 22 \\
-            --margin-top 20 - - \
-        """) % context
-    return run(cmd, stdin=html.encode('utf-8')).stdout
+    return renderer.render(html, pagination=pagination)
 
 
 def get_on_site_link(url):